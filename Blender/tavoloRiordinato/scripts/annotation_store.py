@@ -0,0 +1,333 @@
+"""
+Store the annotations of many frames in a few large files, instead of
+several small text files and PNG images per object.
+
+A store is a directory containing:
+    - shard files (`shard_00000.bin`, `shard_00001.bin`, ...), each made
+      of records appended one after the other, where each record holds
+      all the annotations of one frame, serialized in .npz format.
+    - an index file (`index.bin`), with one fixed-size entry per record
+      (see `INDEX_DTYPE`), telling which shard it is in, at which offset
+      and how long it is.
+Records are only ever appended, and the index entry of a record is
+written after the record itself, so a store stays readable even if the
+process writing it is killed. Shards are memory-mapped when reading, so
+any frame can be accessed without reading anything else.
+
+Within a record, per-object data is stored in arrays with one row per
+object, while data whose size varies from object to object (vertices,
+RLE masks, outlines) is concatenated into a single array along with the
+offsets where each object's data starts (see `pack_frame_annotations`).
+Neither `bpy` nor `mathutils` are needed.
+"""
+
+from pathlib import Path
+import io
+import json
+
+import numpy as np
+
+INDEX_FILENAME = 'index.bin'
+INDEX_DTYPE = np.dtype([
+    ('frame_id', np.int64),
+    ('shard', np.int32),
+    ('offset', np.int64),
+    ('size', np.int64)
+])
+
+MASK_KINDS = ['mask_visible', 'mask_complete']
+OUTLINE_KINDS = ['outline_visible', 'outline_complete']
+
+
+def _get_shard_path(directory, shard):
+    return Path(directory) / f'shard_{shard:05d}.bin'
+
+
+def _pack_ragged(arrays, dtype, shape=()):
+    """
+    Concatenate a list of arrays along their first axis. Returns the
+    concatenated array and an array of len(arrays) + 1 offsets, such
+    that the i-th array is `concatenated[offsets[i]:offsets[i + 1]]`.
+    """
+
+    arrays = [np.asarray(array, dtype=dtype).reshape((-1,) + shape) for array in arrays]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(array) for array in arrays])
+
+    if arrays:
+        concatenated = np.concatenate(arrays)
+    else:
+        concatenated = np.empty((0,) + shape, dtype=dtype)
+
+    return concatenated, offsets
+
+
+def _unpack_ragged(concatenated, offsets):
+    return [
+        concatenated[start:end] for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def pack_frame_annotations(
+    objects,
+    masks=None,
+    outlines=None,
+    mask_size=None,
+    metadata=None
+):
+    """
+    Pack the annotations of a frame into a dict of arrays.
+
+    `objects` is a list of dicts, one for each object, with keys 'name',
+    'category_id', 'pass_index', 'location' and 'bbox' and, optionally,
+    'vertices'. `masks` and `outlines` map any of the kinds in
+    `MASK_KINDS` and `OUTLINE_KINDS` (e.g. 'mask_visible') to a dict
+    from pass indices to, respectively, RLE counts (see
+    `index_buffer_utils.encode_rle`) and (K, 2) outline coordinates;
+    objects that are missing get an empty mask or outline. `mask_size`
+    is the (height, width) of the masks and `metadata` is any
+    JSON-serializable dict.
+    """
+
+    pass_indices = [obj['pass_index'] for obj in objects]
+    arrays = {
+        'names': np.array([obj['name'] for obj in objects], dtype=str),
+        'category_ids': np.array(
+            [obj['category_id'] for obj in objects],
+            dtype=np.int32
+        ),
+        'pass_indices': np.array(pass_indices, dtype=np.int32),
+        'locations': np.array(
+            [obj['location'] for obj in objects],
+            dtype=np.float32
+        ).reshape(-1, 2),
+        'bboxes': np.array(
+            [obj['bbox'] for obj in objects],
+            dtype=np.int32
+        ).reshape(-1, 4),
+        'metadata': np.array(json.dumps(metadata or {}))
+    }
+
+    if any('vertices' in obj for obj in objects):
+        arrays['vertices'], arrays['vertices_offsets'] = _pack_ragged(
+            [obj.get('vertices', []) for obj in objects],
+            np.int32,
+            (2,)
+        )
+
+    # The RLE of an empty mask is a single run of zeros
+    empty_mask = [] if mask_size is None else [mask_size[0] * mask_size[1]]
+    for kind, masks_by_pass_index in (masks or {}).items():
+        arrays[f'{kind}_counts'], arrays[f'{kind}_offsets'] = _pack_ragged(
+            [
+                masks_by_pass_index.get(index, empty_mask)
+                for index in pass_indices
+            ],
+            np.int32
+        )
+
+    for kind, outlines_by_pass_index in (outlines or {}).items():
+        arrays[f'{kind}_coords'], arrays[f'{kind}_offsets'] = _pack_ragged(
+            [outlines_by_pass_index.get(index, []) for index in pass_indices],
+            np.int32,
+            (2,)
+        )
+
+    if mask_size is not None:
+        arrays['mask_size'] = np.array(mask_size, dtype=np.int64)
+
+    return arrays
+
+
+def unpack_frame_annotations(arrays):
+    """
+    Unpack the annotations of a frame, packed with
+    `pack_frame_annotations`. Returns a list of dicts, one for each
+    object, and the metadata of the frame. Masks are returned as dicts
+    with keys 'size' and 'counts', as in COCO.
+    """
+
+    objects = [
+        {
+            'name': str(name),
+            'category_id': int(category_id),
+            'pass_index': int(pass_index),
+            'location': location,
+            'bbox': bbox
+        }
+        for name, category_id, pass_index, location, bbox in zip(
+            arrays['names'],
+            arrays['category_ids'],
+            arrays['pass_indices'],
+            arrays['locations'],
+            arrays['bboxes']
+        )
+    ]
+
+    if 'vertices' in arrays:
+        vertices = _unpack_ragged(arrays['vertices'], arrays['vertices_offsets'])
+        for obj, obj_vertices in zip(objects, vertices):
+            obj['vertices'] = obj_vertices
+
+    for kind in MASK_KINDS:
+        if f'{kind}_counts' not in arrays:
+            continue
+        counts = _unpack_ragged(
+            arrays[f'{kind}_counts'],
+            arrays[f'{kind}_offsets']
+        )
+        for obj, obj_counts in zip(objects, counts):
+            obj[kind] = {
+                'size': arrays['mask_size'].tolist(),
+                'counts': obj_counts
+            }
+
+    for kind in OUTLINE_KINDS:
+        if f'{kind}_coords' not in arrays:
+            continue
+        coords = _unpack_ragged(
+            arrays[f'{kind}_coords'],
+            arrays[f'{kind}_offsets']
+        )
+        for obj, obj_coords in zip(objects, coords):
+            obj[kind] = obj_coords
+
+    return objects, json.loads(str(arrays['metadata']))
+
+
+class AnnotationWriter:
+    """
+    Append the annotations of one frame at a time to a store (see the
+    module docstring). A new shard is started as soon as the current one
+    exceeds `max_shard_size` bytes. Writing to an existing store appends
+    to it. Use it as a context manager, or call `close` when done.
+    """
+
+    def __init__(self, directory, max_shard_size=2**30, compress=False):
+
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_shard_size = max_shard_size
+        self.compress = compress
+
+        # Resume from the last shard, discarding anything that has been
+        # written after its last indexed record (and any incomplete
+        # index entry)
+        index = read_index(self.directory)
+        self.index_file = open(self.directory / INDEX_FILENAME, 'ab')
+        self.index_file.truncate(len(index) * INDEX_DTYPE.itemsize)
+        if len(index):
+            self.shard = int(index['shard'][-1])
+            last_record_end = int(index['offset'][-1] + index['size'][-1])
+        else:
+            self.shard = 0
+            last_record_end = 0
+        self.shard_file = open(_get_shard_path(self.directory, self.shard), 'ab')
+        self.shard_file.truncate(last_record_end)
+        self.shard_file.seek(last_record_end)
+
+    def write(self, frame_id, arrays):
+        """
+        Append a record, holding the given dict of arrays (e.g. as
+        returned by `pack_frame_annotations`), for frame `frame_id`.
+        """
+
+        buffer = io.BytesIO()
+        if self.compress:
+            np.savez_compressed(buffer, **arrays)
+        else:
+            np.savez(buffer, **arrays)
+        record = buffer.getvalue()
+
+        offset = self.shard_file.tell()
+        if offset > 0 and offset + len(record) > self.max_shard_size:
+            self.shard_file.close()
+            self.shard += 1
+            # A shard left over by a crash after a previous rollover has
+            # no indexed records, so it is overwritten
+            self.shard_file = open(_get_shard_path(self.directory, self.shard), 'wb')
+            offset = 0
+
+        self.shard_file.write(record)
+        self.shard_file.flush()
+
+        entry = np.array(
+            [(frame_id, self.shard, offset, len(record))],
+            dtype=INDEX_DTYPE
+        )
+        self.index_file.write(entry.tobytes())
+        self.index_file.flush()
+
+    def close(self):
+        self.shard_file.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_index(directory):
+    """
+    Read the index of a store, ignoring an incomplete last entry.
+    """
+
+    index_path = Path(directory) / INDEX_FILENAME
+    if not index_path.exists():
+        return np.empty(0, dtype=INDEX_DTYPE)
+
+    n_entries = index_path.stat().st_size // INDEX_DTYPE.itemsize
+    return np.fromfile(index_path, dtype=INDEX_DTYPE, count=n_entries)
+
+
+class AnnotationReader:
+    """
+    Random access to the records of a store (see the module docstring),
+    whose shards are memory-mapped. If a frame has been written more
+    than once, the last record wins.
+    """
+
+    def __init__(self, directory):
+
+        self.directory = Path(directory)
+        self.index = read_index(self.directory)
+        self.frame_ids = self.index['frame_id']
+        self._positions = {
+            int(frame_id): position
+            for position, frame_id in enumerate(self.frame_ids)
+        }
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def _get_shard(self, shard):
+        if shard not in self._shards:
+            self._shards[shard] = np.memmap(
+                _get_shard_path(self.directory, shard),
+                dtype=np.uint8,
+                mode='r'
+            )
+        return self._shards[shard]
+
+    def read_record(self, position):
+        """
+        Get the dict of arrays stored in the `position`-th record.
+        """
+
+        _, shard, offset, size = self.index[position]
+        record = self._get_shard(int(shard))[offset:offset + size]
+        with np.load(io.BytesIO(record), allow_pickle=False) as arrays:
+            return dict(arrays)
+
+    def read_frame(self, frame_id):
+        """
+        Get the annotations of frame `frame_id`, unpacked with
+        `unpack_frame_annotations`.
+        """
+
+        return unpack_frame_annotations(
+            self.read_record(self._positions[int(frame_id)])
+        )
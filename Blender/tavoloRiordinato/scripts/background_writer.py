@@ -0,0 +1,111 @@
+"""
+Run annotation I/O (deriving masks and outlines from the object index
+pass, encoding, compressing and writing them) on a background thread,
+while the main thread moves on to the physics and render of the next
+frame.
+
+Jobs are run one at a time, in the order they were submitted, so
+records are appended to annotation stores, COCO files and manifests in
+the same order as without a background writer. The queue of pending
+jobs is bounded: when it is full, submitting a job blocks until the
+writer catches up (backpressure), so memory doesn't grow if writing is
+slower than rendering. All pending jobs are run before the writer is
+closed, which also happens at interpreter exit if it hasn't been done
+explicitly. Jobs must not touch `bpy` (which is not thread-safe): they
+should only be given NumPy arrays and plain Python values. Most of the
+time is spent in NumPy, zlib and file writes, which release the GIL.
+"""
+
+import atexit
+import queue
+import threading
+import time
+
+
+class BackgroundWriter:
+    """
+    Run jobs (i.e. function calls) submitted with `submit` on a
+    background thread, with at most `max_pending_jobs` of them waiting
+    (see the module docstring). If a job raises an exception, no further
+    jobs are run and the exception is raised again by any later call to
+    `submit`, `flush` or `close`.
+    """
+
+    def __init__(self, max_pending_jobs=8):
+
+        self._queue = queue.Queue(maxsize=max_pending_jobs)
+        self._error = None
+        self._closed = False
+        self.n_jobs = 0
+        self.blocked_time = 0.0
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name='background-writer',
+            daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                if self._error is None:
+                    function, args, kwargs = job
+                    function(*args, **kwargs)
+            except BaseException as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queue `function(*args, **kwargs)`, blocking while the queue is
+        full.
+        """
+
+        if self._closed:
+            raise RuntimeError('The background writer has been closed')
+        self._raise_error()
+
+        start_time = time.perf_counter()
+        self._queue.put((function, args, kwargs))
+        self.blocked_time += time.perf_counter() - start_time
+        self.n_jobs += 1
+
+    def flush(self):
+        """
+        Wait until all the jobs submitted so far have been run.
+        """
+
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Run all pending jobs and stop the background thread.
+        """
+
+        if self._closed:
+            return
+
+        self._closed = True
+        atexit.unregister(self.close)
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,485 @@
+from pathlib import Path
+import argparse
+import itertools
+import json
+import sys
+import time
+
+import numpy as np
+
+scripts_folder = Path(__file__).parent
+sys.path.insert(0, str(scripts_folder))
+import coordinates_utils as cu
+import index_buffer_utils as ibu
+import lens_projections as lp
+import rasterizer as ra
+
+
+def make_synthetic_index_buffer(
+    render_width,
+    render_height,
+    n_objects,
+    min_radius_px=20,
+    max_radius_px=60,
+    seed=0
+):
+    """
+    Create a fake IndexOB pass, i.e. a `render_height` x `render_width`
+    float32 array where each of `n_objects` discs is filled with its
+    pass index (starting from 1) and the background is 0. Discs are drawn
+    in order, so later objects occlude earlier ones.
+    """
+
+    rng = np.random.default_rng(seed)
+    index_buffer = np.zeros((render_height, render_width), dtype=np.float32)
+    rows, cols = np.ogrid[:render_height, :render_width]
+
+    for pass_index in range(1, n_objects + 1):
+        radius = rng.uniform(min_radius_px, max_radius_px)
+        center_row = rng.uniform(0, render_height)
+        center_col = rng.uniform(0, render_width)
+        disc = (rows - center_row)**2 + (cols - center_col)**2 <= radius**2
+        index_buffer[disc] = pass_index
+
+    return index_buffer
+
+
+def make_uv_sphere(n_rings, n_segments, radius=1.0):
+    """
+    Create the vertices and triangles of a UV sphere centered at the 
+    origin, as `rasterizer.make_mesh` wants them.
+    """
+
+    polar_angles = np.linspace(0, np.pi, n_rings + 1)[1:-1]
+    azimuths = np.linspace(0, 2 * np.pi, n_segments, endpoint=False)
+    polar_grid, azimuth_grid = np.meshgrid(polar_angles, azimuths, indexing='ij')
+    vertices = np.concatenate([
+        [[0, 0, radius]],
+        radius * np.column_stack([
+            (np.sin(polar_grid) * np.cos(azimuth_grid)).ravel(),
+            (np.sin(polar_grid) * np.sin(azimuth_grid)).ravel(),
+            np.cos(polar_grid).ravel()
+        ]),
+        [[0, 0, -radius]]
+    ])
+
+    # Ring i (from 0) starts at vertex 1 + i * n_segments
+    segments = np.arange(n_segments)
+    next_segments = (segments + 1) % n_segments
+    triangles = [np.column_stack([
+        np.zeros(n_segments, dtype=np.int64),
+        1 + segments,
+        1 + next_segments
+    ])]
+    for ring in range(n_rings - 2):
+        top = 1 + ring * n_segments
+        bottom = top + n_segments
+        triangles.append(np.column_stack([top + segments, bottom + segments, bottom + next_segments]))
+        triangles.append(np.column_stack([top + segments, bottom + next_segments, top + next_segments]))
+    last = 1 + (n_rings - 2) * n_segments
+    triangles.append(np.column_stack([
+        last + segments,
+        np.full(n_segments, len(vertices) - 1),
+        last + next_segments
+    ]))
+
+    return vertices, np.concatenate(triangles)
+
+
+def make_random_meshes(n_objects, n_rings=32, n_segments=64, seed=0):
+    """
+    Create `n_objects` meshes (see `rasterizer.make_mesh`) of randomly
+    sized UV spheres, scattered without overlapping within a 2 x 1.5 area
+    on the z = 0 plane, with pass indices starting from 1. Returns them
+    along with the world matrix of a camera looking down at them from 2
+    units above, which sees all of them.
+    """
+
+    rng = np.random.default_rng(seed)
+    vertices, triangles = make_uv_sphere(n_rings, n_segments)
+
+    # Spheres overlapping when seen from above could hide each other, so
+    # that not every object would be rendered
+    radii = []
+    centers = []
+    while len(radii) < n_objects:
+        radius = rng.uniform(0.05, 0.15)
+        center = rng.uniform([-1, -0.75], [1, 0.75])
+        if all(
+            np.linalg.norm(center - other_center) > radius + other_radius
+            for other_radius, other_center in zip(radii, centers)
+        ):
+            radii.append(radius)
+            centers.append(center)
+
+    meshes = []
+    for pass_index, (radius, center) in enumerate(zip(radii, centers), 1):
+        matrix_world = np.eye(4)
+        matrix_world[:3, :3] *= radius
+        matrix_world[:2, 3] = center
+        meshes.append(ra.make_mesh(vertices, triangles, matrix_world, pass_index))
+
+    camera_matrix_world = np.eye(4)
+    camera_matrix_world[2, 3] = 2
+
+    return meshes, camera_matrix_world
+
+
+def reference_outline_loop(pixels, object_pass_index):
+    """
+    Per-pixel outline extraction, as originally done by
+    `segmentation_utils.get_visible_outline_in_rendered_image`. Kept
+    only as a baseline for benchmarks.
+    """
+
+    render_height, render_width = pixels.shape
+    pixels_copy = np.zeros_like(pixels)
+
+    indexes = itertools.product(
+        range(1, render_height - 1),
+        range(1, render_width - 1)
+    )
+    for row, col in indexes:
+
+        val = pixels[row, col]
+
+        if pixels[row, col-1] != val or \
+           pixels[row-1, col] != val or \
+           pixels[row, col+1] != val or \
+           pixels[row+1, col] != val:
+
+            pixels_copy[row, col] = val
+
+    return np.argwhere(pixels_copy == object_pass_index)
+
+
+def time_function(function, *args, repeats=1):
+    """
+    Call `function(*args)` `repeats` times and return the result of the
+    last call along with the best wall-clock time, in seconds.
+    """
+
+    best_time = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        best_time = min(best_time, time.perf_counter() - start)
+
+    return result, best_time
+
+
+def benchmark_outlines(args):
+    """
+    Compare the per-pixel outline loop, run once per object, with the
+    vectorized extractor, run once for all objects.
+    """
+
+    index_buffer = make_synthetic_index_buffer(
+        args.render_width,
+        args.render_height,
+        args.n_objects,
+        seed=args.seed
+    )
+    pass_indices = range(1, args.n_objects + 1)
+
+    outlines, vectorized_time = time_function(
+        ibu.get_outlines,
+        index_buffer,
+        pass_indices,
+        repeats=args.repeats
+    )
+    print(f'vectorized, all objects: {vectorized_time * 1000:.1f} ms')
+    timings = {'vectorized': vectorized_time}
+
+    if args.skip_reference:
+        return timings
+
+    # The loop is way too slow to be run for every object, so time it on
+    # the first object only and extrapolate
+    reference_outline, loop_time = time_function(
+        reference_outline_loop,
+        index_buffer,
+        1
+    )
+    assert np.array_equal(reference_outline, outlines[1])
+    print(f'loop, one object:        {loop_time * 1000:.1f} ms')
+    print(
+        f'loop, all objects (est): {loop_time * args.n_objects * 1000:.1f} ms '
+        f'(speedup: {loop_time * args.n_objects / vectorized_time:.0f}x)'
+    )
+
+    return timings
+
+
+def benchmark_masks(args):
+    """
+    Compare one `np.argwhere` per object, which returns (K, 2) int64 
+    coordinate lists, with the single-pass mask decomposition.
+    """
+
+    index_buffer = make_synthetic_index_buffer(
+        args.render_width,
+        args.render_height,
+        args.n_objects,
+        seed=args.seed
+    )
+    pass_indices = range(1, args.n_objects + 1)
+
+    timings = {}
+    single_pass_masks = {}
+    for encoding in ('rle', 'bbox'):
+        single_pass_masks[encoding], single_pass_time = time_function(
+            ibu.get_masks,
+            index_buffer,
+            pass_indices,
+            encoding,
+            repeats=args.repeats
+        )
+        print(f'single pass ({encoding}): {single_pass_time * 1000:.1f} ms')
+        timings[f'single_pass_{encoding}'] = single_pass_time
+
+    if args.skip_reference:
+        return timings
+
+    def argwhere_per_object(index_buffer):
+        return {
+            pass_index: np.argwhere(index_buffer == pass_index)
+            for pass_index in pass_indices
+        }
+
+    reference_coordinates, argwhere_time = time_function(
+        argwhere_per_object,
+        index_buffer,
+        repeats=args.repeats
+    )
+    print(f'argwhere per object:  {argwhere_time * 1000:.1f} ms')
+
+    height, width = index_buffer.shape
+    for pass_index, coordinates in reference_coordinates.items():
+        reference_mask = np.zeros((height, width), dtype=bool)
+        reference_mask[tuple(coordinates.T)] = True
+        rle_mask = single_pass_masks['rle'][pass_index]
+        assert np.array_equal(
+            ibu.decode_rle(rle_mask['counts'], height, width),
+            reference_mask
+        )
+        assert np.array_equal(
+            ibu.decode_cropped_mask(single_pass_masks['bbox'][pass_index], height, width),
+            reference_mask
+        )
+
+    return timings
+
+
+def benchmark_projection(args):
+    """
+    Compare projecting the vertices of all objects in a single batch 
+    with projecting them one object at a time (as when computing 
+    bounding boxes), for each camera model.
+    """
+
+    meshes, camera_matrix_world = make_random_meshes(args.n_objects, seed=args.seed)
+    world_coords = [
+        cu.transform_points(mesh['matrix_world'], mesh['vertices'])
+        for mesh in meshes
+    ]
+    all_world_coords = np.concatenate(world_coords)
+    print(f'{len(all_world_coords)} vertices')
+
+    def project(coords, projection):
+        return cu.world_to_pixel_coordinates(
+            args.camera_sensor_width,
+            args.camera_sensor_height,
+            args.lens_focal_length,
+            camera_matrix_world,
+            coords,
+            args.render_width,
+            args.render_height,
+            projection
+        )
+
+    def project_per_object(projection):
+        return [project(coords, projection) for coords in world_coords]
+
+    timings = {}
+    for projection in (lp.rectilinear, lp.fisheye_equisolid):
+        _, batch_time = time_function(
+            project,
+            all_world_coords,
+            projection,
+            repeats=args.repeats
+        )
+        print(f'{projection.__name__}, one batch:  {batch_time * 1000:.1f} ms')
+        timings[f'{projection.__name__}_batch'] = batch_time
+
+        if not args.skip_reference:
+            _, per_object_time = time_function(
+                project_per_object,
+                projection,
+                repeats=args.repeats
+            )
+            print(
+                f'{projection.__name__}, per object: '
+                f'{per_object_time * 1000:.1f} ms'
+            )
+
+    return timings
+
+
+def benchmark_rasterizer(args):
+    """
+    Time the software rasterizer on random spheres, for each camera 
+    model, and check that each object gets some pixels.
+    """
+
+    meshes, camera_matrix_world = make_random_meshes(args.n_objects, seed=args.seed)
+    print(f'{sum(len(mesh["triangles"]) for mesh in meshes)} triangles')
+
+    timings = {}
+    for projection in (lp.rectilinear, lp.fisheye_equisolid):
+        (index_buffer, _), rasterizer_time = time_function(
+            ra.rasterize_index_buffer,
+            meshes,
+            args.camera_sensor_width,
+            args.camera_sensor_height,
+            args.lens_focal_length,
+            camera_matrix_world,
+            args.render_width,
+            args.render_height,
+            projection,
+            repeats=args.repeats
+        )
+        visible_pass_indices = np.unique(index_buffer)
+        print(
+            f'{projection.__name__}: {rasterizer_time * 1000:.1f} ms '
+            f'({len(visible_pass_indices) - 1} visible objects)'
+        )
+        missing_pass_indices = sorted(
+            set(range(1, len(meshes) + 1)) - set(visible_pass_indices.tolist())
+        )
+        assert not missing_pass_indices, \
+            f'Objects {missing_pass_indices} got no pixels'
+        timings[projection.__name__] = rasterizer_time
+
+    return timings
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Print the timings in `results` that are slower than in `baseline` 
+    (both dicts mapping benchmark names to dicts of timings) by more 
+    than `tolerance` (e.g. 0.25 for 25%). Returns whether there are any.
+    """
+
+    regressions = False
+    for benchmark_name, timings in results.items():
+        for timing_name, timing in timings.items():
+            baseline_timing = baseline.get(benchmark_name, {}).get(timing_name)
+            if baseline_timing is None:
+                continue
+            if timing > baseline_timing * (1 + tolerance):
+                print(
+                    f'REGRESSION {benchmark_name}/{timing_name}: '
+                    f'{timing * 1000:.1f} ms '
+                    f'(baseline: {baseline_timing * 1000:.1f} ms)'
+                )
+                regressions = True
+
+    return regressions
+
+
+benchmarks = {
+    'outlines': benchmark_outlines,
+    'masks': benchmark_masks,
+    'projection': benchmark_projection,
+    'rasterizer': benchmark_rasterizer,
+}
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(Path(__file__).stem)
+    parser.add_argument(
+        'benchmarks',
+        nargs='*',
+        metavar='benchmark',
+        help=f'any of: {", ".join(benchmarks)} (default: all of them)'
+    )
+    parser.add_argument(
+        '-rw', '--render-width',
+        type=int,
+        default=2048
+    )
+    parser.add_argument(
+        '-rh', '--render-height',
+        type=int,
+        default=1536
+    )
+    parser.add_argument(
+        '-csw', '--camera-sensor-width',
+        type=float,
+        default=36
+    )
+    parser.add_argument(
+        '-csh', '--camera-sensor-height',
+        type=float,
+        default=27
+    )
+    parser.add_argument(
+        '-f', '--lens-focal-length',
+        type=float,
+        default=16
+    )
+    parser.add_argument(
+        '-n', '--n-objects',
+        type=int,
+        default=21
+    )
+    parser.add_argument(
+        '-r', '--repeats',
+        type=int,
+        default=5
+    )
+    parser.add_argument(
+        '-s', '--seed',
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        '--skip-reference',
+        action='store_true',
+        default=False
+    )
+    parser.add_argument(
+        '-o', '--output-path',
+        default=None,
+        help='save the timings as JSON, e.g. to be used as a baseline'
+    )
+    parser.add_argument(
+        '-b', '--baseline',
+        default=None,
+        help='timings saved with --output-path: exit with an error if '
+             'any benchmark is slower by more than --tolerance'
+    )
+    parser.add_argument(
+        '-t', '--tolerance',
+        type=float,
+        default=0.25
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for benchmark_name in args.benchmarks or benchmarks:
+        if benchmark_name not in benchmarks:
+            parser.error(f'unknown benchmark: {benchmark_name}')
+        print(f'--- {benchmark_name} ---')
+        results[benchmark_name] = benchmarks[benchmark_name](args)
+
+    if args.output_path is not None:
+        with open(args.output_path, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare_with_baseline(results, baseline, args.tolerance):
+            sys.exit(1)
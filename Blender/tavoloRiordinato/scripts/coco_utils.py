@@ -0,0 +1,183 @@
+"""
+Write annotations in COCO format (see `format_annotations.ipy` for a
+description of the format) while a dataset is being generated.
+
+Since a dataset doesn't fit in memory, `CocoWriter` doesn't build the
+COCO JSON file directly: it appends one line per image to a JSON Lines
+file, holding the image entry and the annotations of its objects (the
+first line holds the categories). Such files can be written by several
+processes in parallel, one each, and are then merged into a single COCO
+JSON file with `write_coco_dataset` (see `merge_coco.py`), which streams
+them twice (once for images and once for annotations), so neither
+writing nor merging ever holds more than one image in memory. Neither
+`bpy` nor `mathutils` are needed.
+"""
+
+from pathlib import Path
+import json
+
+import numpy as np
+
+import index_buffer_utils as ibu
+import sharding_utils as shu
+
+COCO_LINES_FILENAME = 'coco.jsonl'
+
+
+def make_categories(collection_names, category_ids, supercategory='pool object'):
+    """
+    Make the COCO categories for objects in the given collections, where
+    objects in the i-th collection are given the i-th category ID (as in
+    `label_utils.get_objects`). Collections sharing the same category ID
+    give a single category, named after the first of them.
+    """
+
+    categories = {}
+    for collection_name, category_id in zip(collection_names, category_ids):
+        categories.setdefault(int(category_id), {
+            'supercategory': supercategory,
+            'id': int(category_id),
+            'name': collection_name
+        })
+
+    return list(categories.values())
+
+
+def make_image_entry(image_id, file_name, width, height):
+
+    return {
+        'file_name': file_name,
+        'height': int(height),
+        'width': int(width),
+        'id': int(image_id)
+    }
+
+
+def make_object_annotation(annotation, mask_counts, image_id, width, height):
+    """
+    Make the COCO annotation of an object, given its annotation as
+    computed by `label_utils.compute_annotations` and the RLE counts of
+    its mask (see `index_buffer_utils.encode_rle`). The segmentation is
+    stored as compressed RLE, and the bounding box is the one of the
+    projected vertices, clipped to the image. Annotation IDs are only
+    assigned when merging (see `write_coco_dataset`).
+    """
+
+    min_row, min_col, bbox_width, bbox_height = (
+        int(value) for value in annotation['bbox']
+    )
+
+    # Convert from (row, column) to (x, y) and clip to the image
+    x_min = min(max(min_col, 0), width)
+    y_min = min(max(min_row, 0), height)
+    x_max = min(max(min_col + bbox_width, 0), width)
+    y_max = min(max(min_row + bbox_height, 0), height)
+
+    mask_counts = np.asarray(mask_counts)
+
+    return {
+        'segmentation': {
+            'size': [int(height), int(width)],
+            'counts': ibu.compress_rle(mask_counts)
+        },
+        'area': int(mask_counts[1::2].sum()),
+        'iscrowd': 0,
+        'image_id': int(image_id),
+        'bbox': [x_min, y_min, x_max - x_min, y_max - y_min],
+        'category_id': int(annotation['category_id'])
+    }
+
+
+class CocoWriter:
+    """
+    Append images and their annotations to a COCO JSON Lines file (see
+    the module docstring). If the file already exists, images are
+    appended to it. Each image reaches the disk before `add_image`
+    returns.
+    """
+
+    def __init__(self, path, categories):
+
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            shu.append_to_manifest(self.path, {'categories': categories})
+
+    def add_image(self, image_entry, annotations):
+        shu.append_to_manifest(self.path, {
+            'image': image_entry,
+            'annotations': annotations
+        })
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_coco_dataset(input_paths, output_path, file_name_prefixes=None):
+    """
+    Merge COCO JSON Lines files (e.g. one for each shard of a dataset)
+    into a single COCO JSON file. If `file_name_prefixes` is given, the
+    i-th prefix is prepended to the file names of the images in the
+    i-th file (e.g. the directory of the shard). Categories are merged
+    by ID. If the same image ID appears more than once (e.g. because an
+    image has been labelled again after an interruption), only the last
+    entry is kept. Annotation IDs are assigned sequentially, starting
+    from 1.
+
+    Returns the number of images and annotations written.
+    """
+
+    if file_name_prefixes is None:
+        file_name_prefixes = [''] * len(input_paths)
+
+    # First pass: find categories and the last entry of each image
+    categories = {}
+    last_entries = {}
+    for path_index, path in enumerate(input_paths):
+        for record_index, record in enumerate(shu.iterate_manifest(path)):
+            if 'categories' in record:
+                for category in record['categories']:
+                    categories.setdefault(category['id'], category)
+            else:
+                last_entries[record['image']['id']] = (path_index, record_index)
+
+    def iterate_kept_images():
+        for path_index, path in enumerate(input_paths):
+            for record_index, record in enumerate(shu.iterate_manifest(path)):
+                image_id = record.get('image', {}).get('id')
+                if last_entries.get(image_id) == (path_index, record_index):
+                    yield file_name_prefixes[path_index], record
+
+    n_images = 0
+    n_annotations = 0
+    with open(output_path, 'w') as file_pointer:
+        file_pointer.write('{"images": [')
+        for prefix, record in iterate_kept_images():
+            image_entry = dict(record['image'])
+            image_entry['file_name'] = prefix + image_entry['file_name']
+            if n_images:
+                file_pointer.write(',')
+            file_pointer.write('\n' + json.dumps(image_entry))
+            n_images += 1
+
+        file_pointer.write('\n], "annotations": [')
+        for _, record in iterate_kept_images():
+            for annotation in record['annotations']:
+                if n_annotations:
+                    file_pointer.write(',')
+                n_annotations += 1
+                file_pointer.write(
+                    '\n' + json.dumps(dict(annotation, id=n_annotations))
+                )
+
+        file_pointer.write('\n], "categories": ')
+        json.dump(sorted(categories.values(), key=lambda c: c['id']), file_pointer)
+        file_pointer.write('}\n')
+
+    return n_images, n_annotations
@@ -0,0 +1,282 @@
+"""
+A compositing node graph that outputs the masks and outlines of objects
+as images (i.e. the text annotation format), built once and reused for
+every frame of a batch.
+
+For each pass index, an 'ID Mask' node (and, for outlines, a 'Laplace'
+filter fed by it) is created the first time the pass index is seen.
+For each kind of outputs (the visible masks and/or outlines of all
+objects, or the complete ones of a group of objects rendered on their
+own), a 'File Output' node is created the first time it is needed, with
+one slot per mask and outline, linked to those nodes. When the same kind
+of outputs is needed for other objects (e.g. another group, since groups
+change with the layout), the slots of the node are rebuilt and relinked
+rather than creating another node. Only the 'File Output' node being
+rendered is active, while the others are muted, so that the number of
+nodes in the tree is bounded by the number of kinds of outputs and of
+pass indices, however many frames are rendered.
+
+Outputs are either:
+    - 'png': one PNG image per slot, as Blender names them (e.g.
+      `<object>_mask_visible0001.png`).
+    - 'exr': one multilayer OpenEXR file per set, with one layer per
+      slot (e.g. `mask_visible0001.exr`, with layers
+      `<object>_mask_visible`, `<object>_outline_visible`, ...).
+    - 'index_png' and 'index_exr': no masks nor outlines at all, but the
+      raw object index pass, as a single 16-bit PNG image or a single
+      32-bit float OpenEXR file per set (e.g. `index_visible0001.png`,
+      `index_complete_<first object>0001.png`), from which the mask and
+      outline of any object can be derived on demand (see 
+      `index_images.py`). No 'ID Mask' and 'Laplace' nodes are needed.
+"""
+
+from pathlib import Path
+
+import index_images as ii
+
+OUTPUT_FORMATS = ['png', 'exr', 'index_png', 'index_exr']
+
+
+class CompositorGraph:
+    """
+    Masks and outlines pipelines (see the module docstring) in the
+    compositing tree whose nodes and links are given.
+    """
+
+    def __init__(self, nodes, links, output_format='png'):
+
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f'Unknown output format: {output_format}')
+
+        self.nodes = nodes
+        self.links = links
+        self.output_format = output_format
+        self.base_path = None
+
+        # ID Mask and Laplace nodes by pass index, File Output nodes by
+        # kind of outputs, and names of the objects their slots are for
+        self._id_mask_nodes = {}
+        self._filter_nodes = {}
+        self._file_output_nodes = {}
+        self._slot_objects = {}
+
+        # Node scaling pass indices to the [0, 1] range of 16-bit PNGs
+        self._scale_node = None
+
+    def _get_id_mask_node(self, pass_index):
+
+        if pass_index not in self._id_mask_nodes:
+            id_mask_node = self.nodes.new(type='CompositorNodeIDMask')
+            id_mask_node.index = pass_index
+
+            # Connect 'Render Layers' to 'ID Mask'
+            self.links.new(
+                self.nodes.get('Render Layers').outputs.get('IndexOB'),
+                id_mask_node.inputs[0]
+            )
+            self._id_mask_nodes[pass_index] = id_mask_node
+
+        return self._id_mask_nodes[pass_index]
+
+    def _get_filter_node(self, pass_index):
+
+        if pass_index not in self._filter_nodes:
+            filter_node = self.nodes.new(type='CompositorNodeFilter')
+            filter_node.filter_type = 'LAPLACE'
+
+            # Connect 'ID Mask' to 'Laplace'
+            self.links.new(
+                self._get_id_mask_node(pass_index).outputs[0],
+                filter_node.inputs.get('Image')
+            )
+            self._filter_nodes[pass_index] = filter_node
+
+        return self._filter_nodes[pass_index]
+
+    def _get_index_output_socket(self):
+
+        index_output_socket = self.nodes.get('Render Layers').outputs.get('IndexOB')
+        if self.output_format == 'index_exr':
+            return index_output_socket
+
+        if self._scale_node is None:
+            self._scale_node = self.nodes.new(type='CompositorNodeMath')
+            self._scale_node.operation = 'DIVIDE'
+            self._scale_node.inputs[1].default_value = ii.INDEX_PNG_MAX_VALUE
+            self.links.new(index_output_socket, self._scale_node.inputs[0])
+
+        return self._scale_node.outputs[0]
+
+    def _create_index_output_node(self):
+
+        file_output_node = self.nodes.new(type='CompositorNodeOutputFile')
+        image_format = file_output_node.format
+        image_format.color_mode = 'BW'
+        if self.output_format == 'index_exr':
+            image_format.file_format = 'OPEN_EXR'
+            image_format.color_depth = '32'
+            image_format.exr_codec = 'ZIP'
+        else:
+            image_format.file_format = 'PNG'
+            image_format.color_depth = '16'
+            image_format.compression = 100
+            # Pass indices must be saved as they are, without any view
+            # transform, which can only be overridden since Blender 3.x:
+            # before that, PNGs would go through the view transform of
+            # the scene and hold wrong pass indices
+            if not hasattr(image_format, 'color_management'):
+                self.nodes.remove(file_output_node)
+                raise ValueError(
+                    'The index_png output format needs Blender 3.x or '
+                    'later, use index_exr instead'
+                )
+            image_format.color_management = 'OVERRIDE'
+            image_format.view_settings.view_transform = 'Raw'
+
+        file_output_node.file_slots.clear()
+        file_output_node.file_slots.new('index')
+        self.links.new(
+            self._get_index_output_socket(),
+            file_output_node.inputs[0]
+        )
+
+        return file_output_node
+
+    def _create_file_output_node(self):
+
+        if self.output_format.startswith('index'):
+            return self._create_index_output_node()
+
+        file_output_node = self.nodes.new(type='CompositorNodeOutputFile')
+        if self.output_format == 'exr':
+            file_output_node.format.file_format = 'OPEN_EXR_MULTILAYER'
+            file_output_node.format.color_depth = '16'
+            file_output_node.format.exr_codec = 'ZIP'
+
+        return file_output_node
+
+    def _set_slots(self, file_output_node, objects, output_masks, output_outlines, filename_suffix):
+        """
+        Make the slots of a 'File Output' node output the masks and/or
+        outlines of `objects`, replacing any previous ones.
+        """
+
+        if self.output_format.startswith('index'):
+            # The only slot holds the whole index pass: just rename it
+            file_output_node.file_slots[0].path = ii.get_index_image_name(
+                filename_suffix,
+                objects[0].name if filename_suffix != 'visible' else None
+            )
+            return
+
+        if self.output_format == 'exr':
+            slots = file_output_node.layer_slots
+        else:
+            slots = file_output_node.file_slots
+        # Removing slots removes their links too
+        slots.clear()
+
+        for obj in objects:
+            if output_masks:
+                slot_name = f'{obj.name}_mask_{filename_suffix}'
+                slots.new(slot_name)
+                # Connect 'ID Mask' to 'File Output'
+                self.links.new(
+                    self._get_id_mask_node(obj.pass_index).outputs[0],
+                    file_output_node.inputs.get(slot_name)
+                )
+
+            if output_outlines:
+                slot_name = f'{obj.name}_outline_{filename_suffix}'
+                slots.new(slot_name)
+                # Connect 'Laplace' to 'File Output'
+                self.links.new(
+                    self._get_filter_node(obj.pass_index).outputs[0],
+                    file_output_node.inputs.get(slot_name)
+                )
+
+    def _get_file_output_path(self, objects, filename_suffix):
+
+        if self.output_format != 'exr':
+            return self.base_path
+
+        # Multilayer files are named after the set of outputs, since
+        # their base path is a file name prefix rather than a directory
+        if filename_suffix == 'visible':
+            filename = f'mask_{filename_suffix}'
+        else:
+            filename = f'mask_{filename_suffix}_{objects[0].name}'
+
+        return str(Path(self.base_path) / filename)
+
+    def set_base_path(self, base_path):
+        """
+        Set the directory where the outputs of the next renders go.
+        """
+
+        self.base_path = str(base_path)
+
+    def activate(self, objects, output_masks=True, output_outlines=True, filename_suffix='visible'):
+        """
+        Make the next render output masks and/or outlines of `objects`
+        (Blender objects) only, with file names ending in
+        `filename_suffix`, creating any nodes that are missing.
+        """
+
+        if self.output_format.startswith('index'):
+            # The index pass holds all masks and outlines, so only the 
+            # name of the file depends on the objects
+            key = filename_suffix
+        else:
+            key = (output_masks, output_outlines, filename_suffix)
+        if key not in self._file_output_nodes:
+            self._file_output_nodes[key] = self._create_file_output_node()
+            self._slot_objects[key] = None
+
+        active_node = self._file_output_nodes[key]
+        object_names = tuple(obj.name for obj in objects)
+        if self._slot_objects[key] != object_names:
+            self._set_slots(
+                active_node,
+                objects,
+                output_masks,
+                output_outlines,
+                filename_suffix
+            )
+            self._slot_objects[key] = object_names
+
+        for other_key, file_output_node in self._file_output_nodes.items():
+            file_output_node.mute = other_key != key
+
+        active_node.base_path = self._get_file_output_path(objects, filename_suffix)
+
+    def deactivate(self):
+        """
+        Make the next renders output nothing.
+        """
+
+        for file_output_node in self._file_output_nodes.values():
+            file_output_node.mute = True
+
+    def get_nodes(self):
+
+        return [
+            *self._id_mask_nodes.values(),
+            *self._filter_nodes.values(),
+            *self._file_output_nodes.values(),
+            *([self._scale_node] if self._scale_node is not None else [])
+        ]
+
+    def remove(self):
+        """
+        Remove all the nodes of the graph from the tree.
+        """
+
+        for node in self.get_nodes():
+            self.nodes.remove(node)
+
+        self._id_mask_nodes = {}
+        self._filter_nodes = {}
+        self._file_output_nodes = {}
+        self._slot_objects = {}
+        self._scale_node = None
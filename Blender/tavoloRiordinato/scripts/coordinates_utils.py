@@ -2,7 +2,6 @@
 # https://stackoverflow.com/questions/2477774/correcting-fisheye-distortion-programmatically#answers
 
 import numpy as np
-import mathutils
 
 def numpy_to_blender(x, y, image_height):
     """
@@ -27,6 +26,22 @@ def convert_coordinates(coords, new_origin):
     return coords - new_origin
 
 
+def transform_points(matrix, coords):
+    """
+    Apply a 4x4 affine transformation matrix to an (N, 3) array of 3D 
+    points.
+
+    This is the vectorized equivalent of `matrix @ vector` in Blender's 
+    `mathutils`, where a 3D vector multiplied by a 4x4 matrix is treated 
+    as a point (i.e. translation is applied as well).
+    """
+
+    matrix = np.asarray(matrix, dtype=np.float64)
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+
+    return coords @ matrix[:3, :3].T + matrix[:3, 3]
+
+
 def world_to_camera_view_with_projection(
     camera_sensor_width, 
     camera_sensor_height, 
@@ -107,4 +122,181 @@ def fisheye_equisolid_to_camera_view_with_projection(
     x_camera_space = (r_new * np.cos(phi) / camera_sensor_width) + 0.5
     y_camera_space = (r_new * np.sin(phi) / camera_sensor_height) + 0.5
 
-    return x_camera_space, y_camera_space
\ No newline at end of file
+    return x_camera_space, y_camera_space
+
+
+def world_to_camera_view_with_projection_batch(
+    camera_sensor_width, 
+    camera_sensor_height, 
+    lens_focal_length, 
+    camera_matrix_world, 
+    coords,
+    projection=lambda f, theta: f * np.tan(theta)
+):
+    """
+    Map an array of 3D world coordinates to 2D coordinates of a camera 
+    view, all at once.
+
+    This is the vectorized counterpart of 
+    `world_to_camera_view_with_projection`: `coords` is an (N, 3) array 
+    of points in world space and `camera_matrix_world` is the camera's 
+    4x4 world matrix (e.g. `np.array(camera_obj.matrix_world)`), which 
+    is inverted only once for the whole batch. Returns an (N, 2) array 
+    whose columns are the x and y coordinates of each point in the 
+    [0, 1] range (relative to the bottom left corner of the image), 
+    provided that the point is within the camera's scope. 
+
+    Neither `bpy` nor `mathutils` are needed, so this function can also 
+    be used outside Blender.
+    """
+
+    # Convert `coords` from world space to camera space
+    world_to_camera_matrix = np.linalg.inv(
+        np.asarray(camera_matrix_world, dtype=np.float64)
+    )
+    coords_camera_space = transform_points(world_to_camera_matrix, coords)
+
+    return camera_space_to_camera_view_with_projection_batch(
+        camera_sensor_width,
+        camera_sensor_height,
+        lens_focal_length,
+        coords_camera_space,
+        projection
+    )
+
+
+def camera_space_to_camera_view_with_projection_batch(
+    camera_sensor_width, 
+    camera_sensor_height, 
+    lens_focal_length, 
+    coords_camera_space,
+    projection=lambda f, theta: f * np.tan(theta)
+):
+    """
+    Same as `world_to_camera_view_with_projection_batch`, but for an 
+    (N, 3) array of points that are already in camera space (e.g. 
+    transformed with the product of the inverse camera matrix and the 
+    world matrix of the object they belong to).
+    """
+
+    coords_camera_space = np.asarray(coords_camera_space, dtype=np.float64)
+    x_camera_space = coords_camera_space[:, 0]
+    y_camera_space = coords_camera_space[:, 1]
+
+    # Calculate projection parameters (see 
+    # `world_to_camera_view_with_projection` for their meaning)
+    phi = np.arctan2(y_camera_space, x_camera_space)
+    l = np.hypot(x_camera_space, y_camera_space)
+    l_normalized = l / np.linalg.norm(coords_camera_space, axis=1)
+    theta = np.arcsin(np.clip(l_normalized, 0.0, 1.0))
+
+    # Distance of each point from the center of the image
+    r = projection(lens_focal_length, theta)
+
+    camera_view_coords = np.empty((len(coords_camera_space), 2))
+    camera_view_coords[:, 0] = (r * np.cos(phi) / camera_sensor_width) + 0.5
+    camera_view_coords[:, 1] = (r * np.sin(phi) / camera_sensor_height) + 0.5
+
+    return camera_view_coords
+
+
+def camera_view_to_pixel_coordinates(
+    camera_view_coords, 
+    render_width, 
+    render_height
+):
+    """
+    Map an (N, 2) array of camera view coordinates in the [0, 1] range 
+    (as returned by `world_to_camera_view_with_projection_batch`) to 
+    integer pixel coordinates in NumPy format, i.e. (row, column) pairs 
+    where (0, 0) is at the top left of the image.
+    """
+
+    camera_view_coords = np.asarray(camera_view_coords)
+
+    # Map the coordinates in the [0, render_width] and [0, render_height]
+    # ranges, truncating them like `int()` does
+    x = np.trunc(camera_view_coords[:, 0] * render_width).astype(np.int64)
+    y = np.trunc(camera_view_coords[:, 1] * render_height).astype(np.int64)
+
+    # Convert pixel coordinates from Blender format (where (0, 0) is at 
+    # the bottom left of the image) to NumPy format
+    row, col = blender_to_numpy(x, y, render_height)
+
+    return np.stack([row, col], axis=1)
+
+
+def world_to_pixel_coordinates(
+    camera_sensor_width, 
+    camera_sensor_height, 
+    lens_focal_length, 
+    camera_matrix_world, 
+    coords,
+    render_width,
+    render_height,
+    projection=lambda f, theta: f * np.tan(theta)
+):
+    """
+    Map an (N, 3) array of 3D world coordinates to an (N, 2) array of 
+    pixel coordinates, in NumPy format, of the rendered image.
+    """
+
+    camera_view_coords = world_to_camera_view_with_projection_batch(
+        camera_sensor_width, 
+        camera_sensor_height, 
+        lens_focal_length, 
+        camera_matrix_world, 
+        coords,
+        projection
+    )
+
+    return camera_view_to_pixel_coordinates(
+        camera_view_coords, 
+        render_width, 
+        render_height
+    )
+
+
+def pixel_coordinates_to_camera_rays(
+    camera_sensor_width, 
+    camera_sensor_height, 
+    lens_focal_length, 
+    pixel_coords,
+    render_width,
+    render_height,
+    inverse_projection=lambda f, r: np.arctan(r / f)
+):
+    """
+    Map an (N, 2) array of pixel coordinates, in NumPy format, to an 
+    (N, 3) array with the direction (of unit length, in camera space) of
+    the ray going through the center of each pixel. 
+
+    This is the inverse of `world_to_pixel_coordinates`, up to the 
+    distance of each point from the camera: `inverse_projection` is the 
+    inverse of the projection used there (see `lens_projections`), i.e.
+    a function that takes the focal length, `f`, and the distance `r` of
+    a point from the center of the image, and returns the angle that the
+    point forms with the optical axis. Rays point towards the negative 
+    z-axis, which is where Blender cameras look.
+    """
+
+    pixel_coords = np.asarray(pixel_coords).reshape(-1, 2)
+
+    # Convert pixel coordinates to Blender format and take the center of
+    # each pixel
+    x, y = numpy_to_blender(pixel_coords[:, 0], pixel_coords[:, 1], render_height)
+    x_cartesian = ((x + 0.5) / render_width - 0.5) * camera_sensor_width
+    y_cartesian = ((y + 0.5) / render_height - 0.5) * camera_sensor_height
+
+    # Go from cartesian to polar coordinates, and from the distance from 
+    # the center of the image to the angle with the optical axis
+    r = np.hypot(x_cartesian, y_cartesian)
+    phi = np.arctan2(y_cartesian, x_cartesian)
+    theta = inverse_projection(lens_focal_length, r)
+
+    rays = np.empty((len(pixel_coords), 3))
+    rays[:, 0] = np.sin(theta) * np.cos(phi)
+    rays[:, 1] = np.sin(theta) * np.sin(phi)
+    rays[:, 2] = -np.cos(theta)
+
+    return rays
@@ -0,0 +1,204 @@
+"""
+A content-addressed cache of what is expensive to compute for a frame:
+the object index pass and the projections of the objects (bounding boxes
+and, optionally, vertices and complete masks and outlines).
+
+Entries are keyed by a hash of everything they depend on, i.e. the
+state of the scene (see `compute_key`): re-labelling a frame whose
+scene hasn't changed (e.g. after changing only how annotations are
+derived or which categories objects belong to) reuses the cached index
+pass instead of rendering it again. Each entry is an .npz file in the
+cache directory, named after its key; entries are written to a
+temporary file first, so other processes never read incomplete ones.
+
+The cache is kept within a disk budget by evicting the least recently
+used entries, where "used" means written or read (reading an entry
+updates its modification time). The sizes and modification times of the
+entries are scanned once, when the cache is opened, so processes sharing
+a cache directory only see each other's entries after reopening it.
+Neither `bpy` nor `mathutils` are needed.
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import annotation_store as ans
+
+# Bump this when the content of entries changes, so that old entries are
+# never read
+CACHE_VERSION = 1
+
+
+def _update_hash(hasher, value):
+
+    if isinstance(value, dict):
+        hasher.update(b'{')
+        for key in sorted(value):
+            _update_hash(hasher, key)
+            _update_hash(hasher, value[key])
+        hasher.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        hasher.update(b'[')
+        for item in value:
+            _update_hash(hasher, item)
+        hasher.update(b']')
+    elif isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        hasher.update(f'{array.dtype.str}{array.shape}'.encode())
+        hasher.update(array.tobytes())
+    else:
+        hasher.update(json.dumps(value).encode())
+
+
+def compute_key(state):
+    """
+    Hash the state a frame depends on, given as any nesting of dicts,
+    lists, NumPy arrays and JSON-serializable values. Arrays are hashed
+    by their exact content, so the same transforms always give the same
+    key. Returns a hexadecimal string.
+    """
+
+    hasher = hashlib.sha1()
+    _update_hash(hasher, {'cache_version': CACHE_VERSION, 'state': state})
+
+    return hasher.hexdigest()
+
+
+class FrameCache:
+    """
+    Read and write cache entries (see the module docstring) in
+    `directory`, keeping the total size of the entries within
+    `max_size` bytes.
+    """
+
+    def __init__(self, directory, max_size=10 * 2**30):
+
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Size and last use of each entry, by key
+        self._entries = {}
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz') and not entry.name.endswith('.tmp.npz'):
+                stat = entry.stat()
+                self._entries[entry.name[:-4]] = [stat.st_size, stat.st_mtime]
+        self._total_size = sum(size for size, _ in self._entries.values())
+
+    def _get_path(self, key):
+        return self.directory / f'{key}.npz'
+
+    def get(self, key):
+        """
+        Get the arrays stored for `key`, as a dict, or None if there is
+        no such entry.
+        """
+
+        path = self._get_path(key)
+        if key not in self._entries or not path.exists():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+        with np.load(path) as npz_file:
+            arrays = dict(npz_file)
+
+        # Mark the entry as used
+        os.utime(path)
+        self._entries[key][1] = path.stat().st_mtime
+        self.hits += 1
+
+        return arrays
+
+    def put(self, key, arrays):
+        """
+        Store a dict of arrays for `key`, replacing any previous entry,
+        then evict the least recently used entries if the cache exceeds
+        its budget.
+        """
+
+        path = self._get_path(key)
+        temporary_path = path.with_suffix('.tmp.npz')
+        np.savez_compressed(temporary_path, **arrays)
+        temporary_path.replace(path)
+
+        if key in self._entries:
+            self._total_size -= self._entries[key][0]
+        stat = path.stat()
+        self._entries[key] = [stat.st_size, stat.st_mtime]
+        self._total_size += stat.st_size
+
+        self._evict(keep=key)
+
+    def _evict(self, keep=None):
+
+        if self._total_size <= self.max_size:
+            return
+
+        for key in sorted(self._entries, key=lambda key: self._entries[key][1]):
+            if self._total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            size, _ = self._entries.pop(key)
+            self._get_path(key).unlink(missing_ok=True)
+            self._total_size -= size
+            self.evictions += 1
+
+    def get_stats(self):
+
+        return {
+            'entries': len(self._entries),
+            'size': self._total_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def print_stats(self):
+
+        stats = self.get_stats()
+        print(
+            f'Frame cache: {stats["hits"]} hits, {stats["misses"]} misses, '
+            f'{stats["evictions"]} evictions, {stats["entries"]} entries '
+            f'({stats["size"] / 2**20:.0f} MB)'
+        )
+
+
+def pack_frame_entry(index_buffer, annotations, masks=None, outlines=None, metadata=None):
+    """
+    Pack what is cached for a frame: its index pass (in NumPy format)
+    and the annotations computed by projecting the objects (see
+    `label_utils.compute_annotations`), along with complete masks and
+    outlines, if any, as in `annotation_store.pack_frame_annotations`.
+    """
+
+    arrays = ans.pack_frame_annotations(
+        annotations,
+        masks,
+        outlines,
+        mask_size=index_buffer.shape,
+        metadata=metadata
+    )
+    arrays['index_buffer'] = np.asarray(index_buffer, dtype=np.int32)
+
+    return arrays
+
+
+def unpack_frame_entry(arrays):
+    """
+    Unpack a cache entry packed with `pack_frame_entry`. Returns the
+    index pass, a list of dicts (one for each object, see
+    `annotation_store.unpack_frame_annotations`) and the metadata.
+    """
+
+    annotations, metadata = ans.unpack_frame_annotations(arrays)
+
+    return arrays['index_buffer'], annotations, metadata
@@ -0,0 +1,446 @@
+"""
+Generate a whole dataset inside a single Blender process.
+
+For each sample, the balls are scrambled over the table, the scene is
+rendered and annotations are saved, without ever saving or reloading
+the .blend file. Usage:
+
+    blender tavolo.blend -b --python generate_dataset.py -- \
+        -n 500 -o ../dataset -c T0_Palle -cid 0 -cs Panno
+
+For each sample ID (a zero-padded number), the render is saved to
+`<output dir>/<sample ID>.png` and the raw annotations to
+`<output dir>/<sample ID>/`, i.e. the same layout used by
+`create_dataset.sh`, so they can be refined with
+`format_annotations.ipy`. With `--annotation-format binary` or `coco`,
+all annotations go to a single annotation store or COCO JSON Lines file
+in `<output dir>/annotations` instead, with the sample index as frame or
+image ID (see `annotation_store.py` and `coco_utils.py`).
+Each completed sample is also recorded in
+`<output dir>/manifest.jsonl`, along with the seed it was generated 
+with: running this script again with the same `--seed`, `--start-index`
+equal to the sample's index and `--n-samples 1` regenerates it. To split
+a job across several processes, see `launch_shards.py`.
+"""
+
+from pathlib import Path
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+import bpy
+
+scripts_folder = Path(__file__).parent
+sys.path.insert(0, str(scripts_folder))
+import label_utils as lu
+import layout_cache as lac
+import layout_utils as lyu
+import placement_utils as pu
+import profiling as prof
+import randomization as rnd
+import render_profiles as rp
+import scramble_utils as scu
+import sharding_utils as shu
+
+this_script_name = Path(__file__).stem
+parser = argparse.ArgumentParser(this_script_name)
+lu.add_labelling_arguments(parser)
+parser.add_argument(
+    '-n', '--n-samples',
+    type=int,
+    default=500
+)
+parser.add_argument(
+    '-s', '--start-index',
+    type=int,
+    default=1
+)
+parser.add_argument(
+    '-o', '--output-dir',
+    default=str(Path.home() / 'dataset')
+)
+parser.add_argument(
+    '--seed',
+    type=int,
+    default=None
+)
+parser.add_argument(
+    '--resume',
+    action='store_true',
+    default=False
+)
+parser.add_argument(
+    '-nr', '--no-render',
+    action='store_true',
+    default=False
+)
+parser.add_argument(
+    '-bc', '--balls-collection',
+    default='T0_Palle'
+)
+parser.add_argument(
+    '-pc', '--pins-collection',
+    default='T0_Birilli'
+)
+parser.add_argument(
+    '-ga', '--game-area',
+    default='Panno'
+)
+parser.add_argument(
+    '-ph', '--physics',
+    choices=['bullet', 'numpy'],
+    default='bullet'
+)
+parser.add_argument(
+    '-pl', '--placement',
+    choices=['rows'] + pu.distributions,
+    default='rows',
+    help='rows: place balls on two rows and let physics scramble them; '
+         'any other choice: sample non-overlapping positions with the '
+         'given distribution, without running any physics simulation'
+)
+parser.add_argument(
+    '-lf', '--layouts-file',
+    default=None,
+    help='pool of layouts generated with generate_layouts.py: if given, '
+         'the balls are not scrambled, and sample i uses layout i - 1'
+)
+parser.add_argument(
+    '-li', '--layout-indices-file',
+    default=None,
+    help='.npy file with the indices of the layouts to use (e.g. after '
+         'deduplication): if given, sample i uses the layout whose index '
+         'is the (i - 1)-th element of this file'
+)
+parser.add_argument(
+    '-sf', '--simulation-frames',
+    type=int,
+    default=300
+)
+parser.add_argument(
+    '-st', '--settle-threshold',
+    type=float,
+    default=None,
+    help='stop the rigid body simulation as soon as no ball or pin has '
+         'moved by more than this many meters per frame for '
+         '--settle-frames consecutive frames (--simulation-frames is then '
+         'only an upper bound): by default, all frames are simulated'
+)
+parser.add_argument(
+    '-sfr', '--settle-frames',
+    type=int,
+    default=10
+)
+parser.add_argument(
+    '-lc', '--layout-cache',
+    default=None,
+    help='.npz index of settled layouts (see layout_cache.py), keyed by '
+         'sample seed, initial layout and physics parameters: layouts '
+         'settled by the physics are stored in it, and reused instead of '
+         'being simulated again (requires --seed)'
+)
+parser.add_argument(
+    '-lcs', '--layout-cache-size',
+    type=float,
+    default=256,
+    help='maximum size of the layout cache, in MB'
+)
+parser.add_argument(
+    '-rc', '--randomization-config',
+    default=None,
+    help='JSON file with the distributions of the lights, materials, '
+         'camera, ... parameters to randomize for each sample (see '
+         'randomization.py): sampled values are logged in the manifest'
+)
+
+if '--' in sys.argv:
+    args = parser.parse_args(sys.argv[sys.argv.index('--') + 1:])
+else:
+    # Stick to default values for each parameter
+    args = parser.parse_args([])
+
+if args.layout_cache is not None and args.seed is None:
+    parser.error('--layout-cache requires --seed')
+
+output_dir = Path(args.output_dir)
+output_dir.mkdir(parents=True, exist_ok=True)
+manifest_path = output_dir / shu.MANIFEST_FILENAME
+
+lu.enable_profiling(args)
+
+if args.resume:
+    completed_sample_ids = shu.get_completed_sample_ids(manifest_path)
+else:
+    completed_sample_ids = set()
+
+scene = bpy.context.scene
+
+palle = bpy.data.collections[args.balls_collection].all_objects[:]
+birilli = bpy.data.collections[args.pins_collection].all_objects[:]
+game_area = bpy.data.objects[args.game_area]
+
+objects = lu.get_objects(args.collections, args.category_ids)
+
+# Rendering settings (and devices) are configured only once for all
+# samples
+nodes, links = lu.configure_rendering(
+    scene,
+    args.render_width,
+    args.render_height,
+    args.render_samples,
+    args.render_profile,
+    args.render_threads,
+    mask_only=args.no_render
+)
+
+# In binary and COCO formats, annotations of all samples are appended to
+# the same store or file
+annotation_writer = lu.create_annotation_writer(args, output_dir / 'annotations')
+frame_cache = lu.create_frame_cache(args)
+
+# With the text format, the nodes that output masks and outlines are
+# created once and reused for all samples, and so is the 'Viewer' node
+# the object index pass is read from with the other formats
+compositor_graph = lu.create_compositor_graph(args, nodes, links)
+if compositor_graph is None and args.mask_renderer == 'cycles':
+    lu.create_viewer_node(nodes, links)
+
+# With `--background-writes`, annotations (and then manifest records) are
+# written while the next sample is being prepared
+background_writer = lu.create_background_writer(args)
+
+
+def record_sample(record, annotations_output_dir, render_output_path):
+    """
+    Record a sample in the manifest, along with the files written for it.
+    """
+
+    if annotation_writer is None:
+        files = sorted(
+            str(path.relative_to(output_dir))
+            for path in annotations_output_dir.iterdir()
+        )
+    else:
+        files = []
+    if render_output_path is not None:
+        files.insert(0, Path(render_output_path).name)
+    record['files'] = files
+    shu.append_to_manifest(manifest_path, record)
+
+
+if args.layouts_file is not None:
+    layouts, layout_parameters = lyu.load_layouts(args.layouts_file)
+    if args.layout_indices_file is not None:
+        layout_indices = np.load(args.layout_indices_file, mmap_mode='r')
+    else:
+        layout_indices = np.arange(len(layouts))
+
+# Remember where balls and pins are in the original scene, so that each
+# sample starts from the very same state without reloading the file
+initial_transforms = scu.save_object_transforms(palle + birilli)
+
+# Settled layouts depend on the initial scene (including the game area,
+# which balls are scrambled over) and on the physics parameters, which
+# are the same for all samples
+if args.layout_cache is not None:
+    layout_cache = lac.LayoutCache(
+        args.layout_cache,
+        max_size=int(args.layout_cache_size * 2**20)
+    )
+    initial_layout = scu.get_settled_layout(palle + birilli + [game_area])
+    physics_parameters = scu.get_physics_parameters(
+        scene,
+        physics=args.physics,
+        n_frames=args.simulation_frames,
+        settle_threshold=args.settle_threshold,
+        settle_frames=args.settle_frames
+    )
+else:
+    layout_cache = None
+
+if args.randomization_config is not None:
+    randomizer = rnd.Randomizer(rnd.load_config(args.randomization_config))
+else:
+    randomizer = None
+
+sample_indices = [
+    i for i in range(args.start_index, args.start_index + args.n_samples)
+    if f'{i:06d}' not in completed_sample_ids
+]
+if len(sample_indices) < args.n_samples:
+    print(f'Skipping {args.n_samples - len(sample_indices)} completed samples')
+
+start_time = time.perf_counter()
+for n_done, i in enumerate(sample_indices, 1):
+
+    sample_id = f'{i:06d}'
+    sample_start_time = time.perf_counter()
+    prof.profiler.start_frame(i)
+
+    # Seed the random number generators used for scrambling the balls, 
+    # so that the sample can be regenerated
+    if args.seed is not None:
+        sample_seed = shu.derive_seed(args.seed, i)
+        np.random.seed(sample_seed)
+        random.seed(sample_seed)
+    else:
+        sample_seed = None
+
+    # Reset the scene to its original state
+    with prof.profiler.stage('scene_setup'):
+        scu.restore_object_transforms(initial_transforms)
+        scene.frame_set(scene.frame_start)
+
+    # Scramble the balls, either taking a pre-generated layout, sampling 
+    # non-overlapping positions or letting the physics settle them
+    simulation_frames = None
+    with prof.profiler.stage('layout'):
+        if args.layouts_file is not None:
+            layout_index = int(layout_indices[i - 1])
+            scu.apply_layout(
+                layouts[layout_index],
+                layout_parameters['ball_names'],
+                layout_parameters['pin_names']
+            )
+        elif args.placement != 'rows':
+            scu.place_balls(palle, birilli, game_area, distribution=args.placement)
+        else:
+            if layout_cache is not None:
+                layout_key = lac.compute_key(
+                    sample_seed,
+                    initial_layout,
+                    physics_parameters
+                )
+                cached_layout = layout_cache.get(layout_key)
+                prof.profiler.count(layout_cache_hits=int(cached_layout is not None))
+            else:
+                cached_layout = None
+
+            if cached_layout is not None:
+                settled_layout, simulation_frames = cached_layout
+                scu.apply_settled_layout(settled_layout)
+            elif args.physics == 'numpy':
+                simulation_frames = scu.scramble_balls_numpy(palle, birilli, game_area)
+            else:
+                simulation_frames = scu.scramble_balls(
+                    palle,
+                    birilli,
+                    game_area,
+                    n_frames=args.simulation_frames,
+                    settle_threshold=args.settle_threshold,
+                    settle_frames=args.settle_frames
+                )
+
+            if layout_cache is not None and cached_layout is None:
+                layout_cache.put(
+                    layout_key,
+                    scu.get_settled_layout(palle + birilli),
+                    simulation_frames
+                )
+        prof.profiler.count(objects=len(palle) + len(birilli))
+
+    # Randomize lights, materials, camera, ... (touching only what 
+    # changes from the previous sample). Values are drawn from their own
+    # generator, so that they don't depend on whether the layout has 
+    # been simulated or taken from the cache
+    if randomizer is not None:
+        with prof.profiler.stage('randomization'):
+            if sample_seed is not None:
+                rng = np.random.default_rng(shu.derive_seed(sample_seed, 1))
+            else:
+                rng = np.random
+            randomization = randomizer.sample(rng)
+            changed_parameters = randomizer.apply(randomization)
+            prof.profiler.count(changed_parameters=len(changed_parameters))
+    else:
+        randomization = None
+
+    # Render and label the scene
+    annotations_output_dir = output_dir / sample_id
+    if annotation_writer is None:
+        annotations_output_dir.mkdir(exist_ok=True)
+    if args.no_render:
+        render_output_path = None
+    else:
+        render_output_path = str(output_dir / f'{sample_id}.png')
+
+    created_nodes = lu.label_image(
+        scene,
+        objects,
+        nodes,
+        links,
+        args,
+        str(annotations_output_dir),
+        render_output_path,
+        annotation_writer,
+        frame_id=i,
+        frame_cache=frame_cache,
+        background_writer=background_writer,
+        compositor_graph=compositor_graph
+    )
+
+    # Remove the compositing nodes created for this sample, so that the
+    # node tree doesn't grow from one sample to the next
+    for node in created_nodes:
+        nodes.remove(node)
+
+    # Record the sample in the manifest only once all of its files have
+    # been written (by the background writer, if any, which runs jobs in
+    # order)
+    with prof.profiler.stage('manifest'):
+        record_args = (
+            {
+                'sample_id': sample_id,
+                'sample_index': i,
+                'seed': args.seed,
+                'sample_seed': sample_seed,
+                'layout_index': layout_index if args.layouts_file else None,
+                'simulation_frames': simulation_frames,
+                'randomization': randomization,
+                'render_settings': rp.get_render_settings(scene)
+            },
+            annotations_output_dir,
+            render_output_path
+        )
+        if background_writer is not None:
+            background_writer.submit(record_sample, *record_args)
+        else:
+            record_sample(*record_args)
+    prof.profiler.end_frame()
+
+    elapsed_time = time.perf_counter() - start_time
+    if simulation_frames is not None:
+        simulation_info = f'{simulation_frames} simulation frames, '
+    else:
+        simulation_info = ''
+    print(
+        f'Sample {sample_id} done in '
+        f'{time.perf_counter() - sample_start_time:.1f} s '
+        f'({simulation_info}{n_done}/{len(sample_indices)}, '
+        f'{n_done / elapsed_time * 3600:.0f} samples/hour)'
+    )
+
+# Wait for pending annotations before closing the files they go to
+if background_writer is not None:
+    background_writer.close()
+    print(
+        f'Background writer: {background_writer.n_jobs} jobs, blocked '
+        f'for {background_writer.blocked_time:.1f} s'
+    )
+if annotation_writer is not None:
+    annotation_writer.close()
+
+elapsed_time = time.perf_counter() - start_time
+print(
+    f'Generated {len(sample_indices)} samples in {elapsed_time:.1f} s '
+    f'({len(sample_indices) / max(elapsed_time, 1e-9) * 3600:.0f} '
+    f'samples/hour)'
+)
+if frame_cache is not None:
+    frame_cache.print_stats()
+if layout_cache is not None:
+    layout_cache.close()
+    layout_cache.print_stats()
+prof.profiler.print_report()
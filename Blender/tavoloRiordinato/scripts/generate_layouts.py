@@ -0,0 +1,95 @@
+"""
+Generate a pool of table layouts for the scene that is currently open,
+without rendering anything (see `layout_utils`). Usage:
+
+    blender tavolo.blend -b --python generate_layouts.py -- \
+        -n 1000000 -o ../layouts.npy
+
+Layouts can then be used by `scramble_balls.py` and
+`generate_dataset.py` through their `--layouts-file` option.
+"""
+
+from pathlib import Path
+import argparse
+import sys
+import time
+
+import bpy
+
+scripts_folder = Path(__file__).parent
+sys.path.insert(0, str(scripts_folder))
+import layout_utils as lyu
+import scramble_utils as scu
+
+this_script_name = Path(__file__).stem
+parser = argparse.ArgumentParser(this_script_name)
+parser.add_argument(
+    '-n', '--n-layouts',
+    type=int,
+    default=1000000
+)
+parser.add_argument(
+    '-o', '--output-path',
+    default=str(Path.home() / 'layouts.npy')
+)
+parser.add_argument(
+    '--seed',
+    type=int,
+    default=0
+)
+parser.add_argument(
+    '-pd', '--pin-down-probability',
+    type=float,
+    default=0.1
+)
+parser.add_argument(
+    '-b', '--batch-size',
+    type=int,
+    default=100000
+)
+parser.add_argument(
+    '-bc', '--balls-collection',
+    default='T0_Palle'
+)
+parser.add_argument(
+    '-pc', '--pins-collection',
+    default='T0_Birilli'
+)
+parser.add_argument(
+    '-ga', '--game-area',
+    default='Panno'
+)
+
+if '--' in sys.argv:
+    args = parser.parse_args(sys.argv[sys.argv.index('--') + 1:])
+else:
+    # Stick to default values for each parameter
+    args = parser.parse_args([])
+
+palle = bpy.data.collections[args.balls_collection].all_objects[:]
+birilli = bpy.data.collections[args.pins_collection].all_objects[:]
+game_area = bpy.data.objects[args.game_area]
+
+start_time = time.perf_counter()
+lyu.generate_layouts(
+    args.output_path,
+    args.n_layouts,
+    scu.get_ball_limits(game_area),
+    ball_names=[palla.name for palla in palle],
+    pin_names=[birillo.name for birillo in birilli],
+    pin_positions=[
+        (birillo.location.x, birillo.location.y) for birillo in birilli
+    ],
+    pin_radius=max(
+        [birillo.dimensions.x / 2 for birillo in birilli],
+        default=0.0
+    ),
+    ball_diameter=max(palla.dimensions.x for palla in palle),
+    pin_down_probability=args.pin_down_probability,
+    seed=args.seed,
+    batch_size=args.batch_size
+)
+print(
+    f'Generated {args.n_layouts} layouts in '
+    f'{time.perf_counter() - start_time:.1f} s'
+)
@@ -0,0 +1,323 @@
+import numpy as np
+
+# Object index that the IndexOB pass assigns to pixels that don't belong
+# to any object (i.e. the background)
+BACKGROUND_PASS_INDEX = 0
+
+
+def group_pixels_by_pass_index(
+    values,
+    coordinates,
+    pass_indices=None,
+    background_pass_index=BACKGROUND_PASS_INDEX
+):
+    """
+    Split an (N, 2) array of pixel `coordinates` into one array per
+    object, according to the pass index of each pixel, given by
+    `values`.
+
+    The grouping is done with a single stable sort, so the coordinates
+    of each object keep the order they had in `coordinates`. Returns a
+    dict mapping each pass index to a (K, 2) array of coordinates. If
+    `pass_indices` is given, the dict will contain exactly those pass
+    indices (with an empty array for objects that have no pixels);
+    otherwise it will contain every pass index found in `values`,
+    except for `background_pass_index`.
+    """
+
+    values = np.rint(values).astype(np.int64)
+
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order]
+    sorted_coordinates = coordinates[order]
+
+    unique_values, start_indices = np.unique(sorted_values, return_index=True)
+    groups = np.split(sorted_coordinates, start_indices[1:])
+
+    pixels_by_pass_index = {
+        int(value): group for value, group in zip(unique_values, groups)
+    }
+
+    if pass_indices is None:
+        pixels_by_pass_index.pop(background_pass_index, None)
+        return pixels_by_pass_index
+
+    empty = np.empty((0, 2), dtype=coordinates.dtype)
+    return {
+        int(pass_index): pixels_by_pass_index.get(int(pass_index), empty)
+        for pass_index in pass_indices
+    }
+
+
+def get_outline_pixels(index_buffer):
+    """
+    Given a 2D array of object pass indices (such as the IndexOB pass of
+    a render), get the pixels lying on the outline of any object.
+
+    A pixel is part of an outline if at least one of its 4 neighbours
+    has a different pass index. Pixels on the border of the image are
+    never considered part of an outline, since they don't have all 4
+    neighbours. Instead of looping over each pixel, the comparison with
+    each neighbour is done at once by comparing the image with a copy of
+    itself shifted by one pixel.
+
+    Returns a tuple containing an (N, 2) array of (row, column)
+    coordinates of the outline pixels, in row-major order, and an array
+    containing the N corresponding pass indices.
+    """
+
+    index_buffer = np.asarray(index_buffer)
+
+    center = index_buffer[1:-1, 1:-1]
+    is_outline = (
+        (center != index_buffer[1:-1, :-2]) |  # Left neighbour
+        (center != index_buffer[:-2, 1:-1]) |  # Top neighbour
+        (center != index_buffer[1:-1, 2:]) |   # Right neighbour
+        (center != index_buffer[2:, 1:-1])     # Bottom neighbour
+    )
+
+    # Account for the 1-pixel border that has been left out
+    coordinates = np.argwhere(is_outline) + 1
+
+    return coordinates, center[is_outline]
+
+
+def get_outlines(
+    index_buffer,
+    pass_indices=None,
+    background_pass_index=BACKGROUND_PASS_INDEX
+):
+    """
+    Given a 2D array of object pass indices (such as the IndexOB pass of
+    a render), get the outlines of all objects in a single pass.
+
+    Returns a dict mapping each pass index to a (K, 2) array with the
+    (row, column) coordinates of the pixels on that object's outline.
+    See `group_pixels_by_pass_index` for the meaning of `pass_indices`
+    and `background_pass_index`.
+    """
+
+    coordinates, values = get_outline_pixels(index_buffer)
+
+    return group_pixels_by_pass_index(
+        values,
+        coordinates,
+        pass_indices,
+        background_pass_index
+    )
+
+
+def encode_rle(positions, n_pixels):
+    """
+    Run-length encode a binary mask, given the sorted `positions` of its
+    nonzero pixels in the flattened mask, which has `n_pixels` pixels in
+    total.
+
+    Following the COCO convention, the first count is the number of
+    zeros the mask starts with (possibly 0), and counts then alternate
+    between runs of ones and runs of zeros.
+    """
+
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(positions) == 0:
+        return np.array([n_pixels], dtype=np.int64)
+
+    # A new run of ones starts wherever two consecutive positions are
+    # not adjacent
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    run_starts = positions[np.r_[0, breaks]]
+    run_ends = positions[np.r_[breaks - 1, len(positions) - 1]] + 1
+
+    boundaries = np.empty(2 * len(run_starts) + 2, dtype=np.int64)
+    boundaries[0] = 0
+    boundaries[1:-1:2] = run_starts
+    boundaries[2:-1:2] = run_ends
+    boundaries[-1] = n_pixels
+    counts = np.diff(boundaries)
+
+    # Don't end with an empty run of zeros
+    if counts[-1] == 0:
+        counts = counts[:-1]
+
+    return counts
+
+
+def decode_rle(counts, height, width):
+    """
+    Decode a run-length encoded mask (see `encode_rle`) into a
+    `height` x `width` boolean array. Pixels are assumed to be in
+    column-major order, as in COCO.
+    """
+
+    counts = np.asarray(counts, dtype=np.int64)
+    values = np.arange(len(counts)) % 2 == 1
+    flat_mask = np.repeat(values, counts)
+    flat_mask = np.pad(flat_mask, (0, height * width - len(flat_mask)))
+
+    return flat_mask.reshape(width, height).T
+
+
+def compress_rle(counts):
+    """
+    Compress RLE counts (see `encode_rle`) into a string, in the same
+    format as `pycocotools.mask.encode`: each count, after the first 
+    two, is stored as the difference from the count two positions 
+    before, as a variable-length sequence of 5-bit groups, each
+    written as a printable character.
+    """
+
+    characters = []
+    for i, count in enumerate(counts):
+        x = int(count)
+        if i > 2:
+            x -= int(counts[i - 2])
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            # The sign bit (0x10) of the last group must match the sign
+            # of the number
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            characters.append(chr(c + 48))
+
+    return ''.join(characters)
+
+
+def decompress_rle(string):
+    """
+    Decompress RLE counts compressed with `compress_rle`.
+    """
+
+    counts = []
+    position = 0
+    while position < len(string):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(string[position]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = c & 0x20
+            position += 1
+            k += 1
+            if not more and c & 0x10:
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+
+    return np.array(counts, dtype=np.int64)
+
+
+def decode_cropped_mask(cropped_mask, height, width):
+    """
+    Decode a bounding-box-cropped mask (see `get_masks`) into a
+    `height` x `width` boolean array.
+    """
+
+    mask = np.zeros((height, width), dtype=bool)
+    if cropped_mask['bbox'] is None:
+        return mask
+
+    min_row, min_col, bbox_width, bbox_height = cropped_mask['bbox']
+    crop = np.unpackbits(
+        cropped_mask['bits'],
+        count=bbox_height * bbox_width
+    ).reshape(bbox_height, bbox_width)
+    mask[min_row:min_row + bbox_height, min_col:min_col + bbox_width] = crop
+
+    return mask
+
+
+def _crop_mask(positions, height):
+    """
+    Given the sorted column-major `positions` of the pixels of a mask in
+    an image with `height` rows, crop the mask to its bounding box and
+    pack it into bits.
+    """
+
+    if len(positions) == 0:
+        return {'bbox': None, 'bits': np.empty(0, dtype=np.uint8)}
+
+    cols, rows = np.divmod(positions, height)
+    min_row, max_row = rows.min(), rows.max()
+    min_col, max_col = cols.min(), cols.max()
+    bbox_width = int(max_col - min_col + 1)
+    bbox_height = int(max_row - min_row + 1)
+
+    crop = np.zeros((bbox_height, bbox_width), dtype=bool)
+    crop[rows - min_row, cols - min_col] = True
+
+    return {
+        # Same layout as the bounding boxes saved by `label_image.py`
+        'bbox': [int(min_row), int(min_col), bbox_width, bbox_height],
+        'bits': np.packbits(crop)
+    }
+
+
+def get_masks(
+    index_buffer,
+    pass_indices=None,
+    encoding='rle',
+    background_pass_index=BACKGROUND_PASS_INDEX
+):
+    """
+    Given a 2D array of object pass indices (such as the IndexOB pass of
+    a render), get the pixel masks of all objects in a single pass.
+
+    Only the foreground pixels are sorted by pass index (with a stable
+    sort, so that each object's pixels stay in order) and split using
+    the counts given by `np.bincount`, so time and memory don't depend
+    on the number of objects. Returns a dict mapping each pass index to
+    its mask, encoded according to `encoding`:
+        - 'rle': a dict in COCO format, with keys 'size' (i.e. 
+          [height, width]) and 'counts' (see `encode_rle`).
+        - 'bbox': a dict with keys 'bbox' (i.e. [min_row, min_col, 
+          width, height], or None for empty masks) and 'bits' (the mask 
+          cropped to the bounding box, packed with `np.packbits`).
+    See `group_pixels_by_pass_index` for the meaning of `pass_indices`
+    and `background_pass_index`.
+    """
+
+    if encoding not in ('rle', 'bbox'):
+        raise ValueError(f'Unknown mask encoding: {encoding}')
+
+    index_buffer = np.asarray(index_buffer)
+    height, width = index_buffer.shape
+
+    # Flatten the image in column-major order, as required by COCO RLE
+    values = np.rint(index_buffer.T.ravel()).astype(np.int32)
+
+    foreground_positions = np.flatnonzero(values != background_pass_index)
+    foreground_values = values[foreground_positions]
+    order = np.argsort(foreground_values, kind='stable')
+    sorted_positions = foreground_positions[order]
+
+    counts = np.bincount(foreground_values)
+    start_indices = np.cumsum(counts) - counts
+
+    if pass_indices is None:
+        pass_indices = np.flatnonzero(counts)
+        pass_indices = pass_indices[pass_indices != background_pass_index]
+
+    masks = {}
+    for pass_index in pass_indices:
+        pass_index = int(pass_index)
+        if 0 <= pass_index < len(counts) \
+           and pass_index != background_pass_index:
+            start = start_indices[pass_index]
+            positions = sorted_positions[start:start + counts[pass_index]]
+        else:
+            positions = sorted_positions[:0]
+
+        if encoding == 'rle':
+            masks[pass_index] = {
+                'size': [height, width],
+                'counts': encode_rle(positions, height * width)
+            }
+        else:
+            masks[pass_index] = _crop_mask(positions, height)
+
+    return masks
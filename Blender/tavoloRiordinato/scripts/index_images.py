@@ -0,0 +1,175 @@
+"""
+Read the object index pass saved as an image (see the 'index_png' and
+'index_exr' output formats of `compositor_graph.py`) and derive the mask
+or outline of any object from it, on demand.
+
+A single index image holds the visible masks and outlines of all the
+objects in a frame, instead of up to four mostly black images per
+object. 16-bit PNGs store pass indices divided by `INDEX_PNG_MAX_VALUE`
+(so that they fit the [0, 1] range Blender saves), which reading undoes
+exactly; OpenEXR files store them as 32-bit floats. With individual
+renders, there is one more index image per render group, holding the
+complete masks of the objects in that group (which don't overlap).
+
+Reading images needs OpenCV, as in `format_annotations.ipy`, but not
+`bpy`: this module can be imported inside Blender (e.g. for the names
+of the images) without OpenCV being installed.
+"""
+
+from pathlib import Path
+import os
+
+import numpy as np
+
+import index_buffer_utils as ibu
+
+INDEX_PNG_MAX_VALUE = 65535
+
+
+def get_index_image_name(filename_suffix='visible', object_name=None):
+    """
+    Get the name (without frame number and extension) of an index image
+    for the visible masks of a frame, or, given the name of the first
+    object of a render group, for the complete masks of that group.
+    """
+
+    if object_name is None:
+        return f'index_{filename_suffix}'
+
+    return f'index_{filename_suffix}_{object_name}'
+
+
+def read_index_image(path):
+    """
+    Read an index image into an int32 array of pass indices, in NumPy
+    format (row 0 is the top row of the render).
+    """
+
+    # OpenEXR support must be enabled before OpenCV is imported
+    os.environ.setdefault('OPENCV_IO_ENABLE_OPENEXR', '1')
+    import cv2
+
+    image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise FileNotFoundError(f'Cannot read index image: {path}')
+    if image.ndim == 3:
+        image = image[:, :, 0]
+
+    if image.dtype == np.uint16 or image.dtype == np.uint8:
+        return image.astype(np.int32)
+
+    return np.rint(image).astype(np.int32)
+
+
+def find_index_images(directory, frame=None):
+    """
+    Find the index images in `directory` (for the given frame number, as
+    appended by Blender, if there is more than one frame). Returns the
+    path of the image with the visible masks, or None, and a sorted list
+    of the paths of the images with complete masks.
+    """
+
+    directory = Path(directory)
+    frame_suffix = f'{frame:04d}' if frame is not None else ''
+
+    visible_paths = sorted(directory.glob(
+        f'{get_index_image_name("visible")}{frame_suffix}*'
+    ))
+    complete_paths = sorted(directory.glob(
+        f'{get_index_image_name("complete", "")}*{frame_suffix}.*'
+    ))
+
+    return (visible_paths[0] if visible_paths else None), complete_paths
+
+
+class IndexImageReader:
+    """
+    Derive masks and outlines from the index images of a frame (see
+    `find_index_images`). Images are read the first time they are
+    needed. Masks are encoded as in `index_buffer_utils.get_masks`, and
+    outlines are (K, 2) arrays of (row, column) coordinates.
+    """
+
+    def __init__(self, visible_path=None, complete_paths=()):
+
+        self.visible_path = visible_path
+        self.complete_paths = list(complete_paths)
+        self._visible_index_buffer = None
+        self._complete_index_buffers = None
+        self._complete_buffer_by_pass_index = None
+
+    @classmethod
+    def from_directory(cls, directory, frame=None):
+
+        return cls(*find_index_images(directory, frame))
+
+    @property
+    def index_buffer(self):
+        """
+        The index pass with the visible portion of every object.
+        """
+
+        if self._visible_index_buffer is None:
+            if self.visible_path is None:
+                raise FileNotFoundError('No index image with visible masks')
+            self._visible_index_buffer = read_index_image(self.visible_path)
+
+        return self._visible_index_buffer
+
+    def get_pass_indices(self):
+        """
+        Get the pass indices of the objects that are visible.
+        """
+
+        pass_indices = np.unique(self.index_buffer)
+
+        return pass_indices[pass_indices != ibu.BACKGROUND_PASS_INDEX].tolist()
+
+    def get_masks(self, pass_indices=None, encoding='rle'):
+
+        return ibu.get_masks(self.index_buffer, pass_indices, encoding)
+
+    def get_mask(self, pass_index, encoding='rle'):
+
+        return self.get_masks([pass_index], encoding)[pass_index]
+
+    def get_outlines(self, pass_indices=None):
+
+        return ibu.get_outlines(self.index_buffer, pass_indices)
+
+    def get_outline(self, pass_index):
+
+        return self.get_outlines([pass_index])[pass_index]
+
+    def _get_complete_index_buffer(self, pass_index):
+
+        if self._complete_buffer_by_pass_index is None:
+            self._complete_index_buffers = [
+                read_index_image(path) for path in self.complete_paths
+            ]
+            self._complete_buffer_by_pass_index = {}
+            for index_buffer in self._complete_index_buffers:
+                for index in np.unique(index_buffer).tolist():
+                    if index != ibu.BACKGROUND_PASS_INDEX:
+                        self._complete_buffer_by_pass_index[index] = index_buffer
+
+        if pass_index not in self._complete_buffer_by_pass_index:
+            raise KeyError(f'No complete mask for pass index {pass_index}')
+
+        return self._complete_buffer_by_pass_index[pass_index]
+
+    def get_complete_mask(self, pass_index, encoding='rle'):
+        """
+        Get the mask of an object including its occluded portions (only
+        available with individual renders).
+        """
+
+        index_buffer = self._get_complete_index_buffer(pass_index)
+
+        return ibu.get_masks(index_buffer, [pass_index], encoding)[pass_index]
+
+    def get_complete_outline(self, pass_index):
+
+        index_buffer = self._get_complete_index_buffer(pass_index)
+
+        return ibu.get_outlines(index_buffer, [pass_index])[pass_index]
@@ -0,0 +1,1254 @@
+from pathlib import Path
+import argparse
+import json
+
+import numpy as np
+import bpy
+
+import annotation_store as ans
+import background_writer as bw
+import coco_utils as cocu
+import compositor_graph as cg
+import frame_cache as fc
+import index_buffer_utils as ibu
+import profiling as prof
+import render_profiles as rp
+import segmentation_utils as su
+import silhouette_utils as silu
+import coordinates_utils as cu
+import lens_projections as lp
+
+projections = {
+    'rectilinear': lp.rectilinear,
+    'fisheye_equisolid': lp.fisheye_equisolid,
+    'fisheye_equidistant': lp.fisheye_equidistant
+}
+
+# Labelling arguments that can change from one view to another (see 
+# `load_views`)
+view_arguments = [
+    'camera_name',
+    'camera_sensor_width',
+    'camera_sensor_height',
+    'lens_focal_length',
+    'lens_projection'
+]
+
+
+def add_labelling_arguments(parser):
+    """
+    Add to `parser` the command line arguments that control how images
+    are rendered and labelled.
+    """
+
+    parser.add_argument(
+        '-rw', '--render-width',
+        type=int,
+        default=2048
+    )
+    parser.add_argument(
+        '-rh', '--render-height',
+        type=int,
+        default=1536
+    )
+    parser.add_argument(
+        '-rs', '--render-samples',
+        type=int,
+        default=64
+    )
+    parser.add_argument(
+        '-rp', '--render-profile',
+        choices=['auto'] + list(rp.render_profiles),
+        default='auto',
+        help='see render_profiles.py'
+    )
+    parser.add_argument(
+        '-rt', '--render-threads',
+        type=int,
+        default=0,
+        help='number of render threads (0 means one per CPU core)'
+    )
+    parser.add_argument(
+        '-cn', '--camera-name',
+        type=str,
+        default='Camera'
+    )
+    parser.add_argument(
+        '-csw', '--camera-sensor-width',
+        type=float,
+        default=18.0
+    )
+    parser.add_argument(
+        '-csh', '--camera-sensor-height',
+        type=float,
+        default=13.5
+    )
+    parser.add_argument(
+        '-f', '--lens-focal-length',
+        type=float,
+        default=8.90999984741211
+    )
+    parser.add_argument(
+        '-p', '--lens-projection',
+        choices=list(projections),
+        default='fisheye_equisolid'
+    )
+    parser.add_argument(
+        '-c', '--collections',
+        nargs='+',
+        default=['Balls']
+    )
+    parser.add_argument(
+        '-cid', '--category-ids',
+        nargs='+',
+        type=int,
+        default=[0]
+    )
+    parser.add_argument(
+        '-cs', '--reference-coordinate-system',
+        type=str,
+        default=None
+    )
+    parser.add_argument(
+        '-nm', '--no-masks',
+        action='store_true',
+        default=False
+    )
+    parser.add_argument(
+        '-no', '--no-outlines',
+        action='store_true',
+        default=False
+    )
+    parser.add_argument(
+        '-i', '--individual-renders',
+        action='store_true',
+        default=False
+    )
+    parser.add_argument(
+        '-ig', '--individual-render-grouping',
+        choices=['object', 'bbox'],
+        default='object',
+        help='with --individual-renders, render each object on its own '
+             '(object) or render together objects whose bounding boxes '
+             "don't overlap (bbox), which gives the same complete masks "
+             'and outlines with far fewer renders'
+    )
+    parser.add_argument(
+        '-v', '--vertex-coordinates',
+        action='store_true',
+        default=False
+    )
+    parser.add_argument(
+        '-sc', '--sphere-collections',
+        nargs='*',
+        default=[],
+        help='collections of spheres (e.g. balls), whose bounding boxes '
+             'are computed analytically rather than from their vertices, '
+             'and so are their complete masks with --individual-renders '
+             '(binary and coco annotation formats only), rather than '
+             'rendered'
+    )
+    parser.add_argument(
+        '-hc', '--hull-collections',
+        nargs='*',
+        default=[],
+        help='collections of convex objects, whose bounding boxes are '
+             'computed from the vertices of their convex hulls only'
+    )
+    parser.add_argument(
+        '-mof', '--mask-output-format',
+        choices=cg.OUTPUT_FORMATS,
+        default='png',
+        help='with `--annotation-format text`, how masks and outlines are '
+             'saved: png: one image per mask or outline; exr: one '
+             'multilayer OpenEXR file per render, with one layer per mask '
+             'or outline; index_png, index_exr: only the object index '
+             'pass, as one 16-bit PNG or 32-bit OpenEXR image per render, '
+             'to derive masks and outlines from when reading (see '
+             'compositor_graph.py and index_images.py; index_png needs '
+             'Blender 3.x or later)'
+    )
+    parser.add_argument(
+        '-mr', '--mask-renderer',
+        choices=['cycles', 'rasterizer'],
+        default='cycles',
+        help='how the object index pass is obtained: from a Cycles '
+             'render or from the software rasterizer (see '
+             'rasterizer.py), which needs no render at all when no '
+             'render output path is given (binary and coco annotation '
+             'formats only)'
+    )
+    parser.add_argument(
+        '-oc', '--occluder-collections',
+        nargs='*',
+        default=[],
+        help='with `--mask-renderer rasterizer`, collections of objects '
+             'that are not labelled but can occlude labelled ones'
+    )
+    parser.add_argument(
+        '-af', '--annotation-format',
+        choices=['text', 'binary', 'coco'],
+        default='text',
+        help='text: one text file per annotation and one PNG image per '
+             'mask or outline; binary: one record per frame in an '
+             'annotation store (see annotation_store.py); coco: one line '
+             'per frame in a COCO JSON Lines file (see coco_utils.py)'
+    )
+    parser.add_argument(
+        '-fc', '--frame-cache-dir',
+        default=None,
+        help='directory of a cache of the object index pass and object '
+             'projections of each frame, keyed by the state of the '
+             'scene: the index pass of frames whose scene is unchanged '
+             'is not rendered again, unlike the image, if requested '
+             '(binary and coco annotation formats only, see '
+             'frame_cache.py)'
+    )
+    parser.add_argument(
+        '-fcs', '--frame-cache-size',
+        type=float,
+        default=10,
+        help='disk budget of the frame cache, in GB: the least recently '
+             'used frames are evicted beyond it'
+    )
+    parser.add_argument(
+        '-bw', '--background-writes',
+        action='store_true',
+        default=False,
+        help='derive masks and outlines and write annotations on a '
+             'background thread, while the next frame is prepared and '
+             'rendered'
+    )
+    parser.add_argument(
+        '-wq', '--write-queue-size',
+        type=int,
+        default=8,
+        help='with `--background-writes`, how many frames can wait to be '
+             'written before rendering blocks'
+    )
+    parser.add_argument(
+        '-pr', '--profile',
+        action='store_true',
+        default=False,
+        help='time each stage of each frame and print a report at the '
+             'end (see profiling.py)'
+    )
+    parser.add_argument(
+        '-pfl', '--profile-log',
+        default=None,
+        help='JSON Lines file where the profile of each frame is '
+             'appended (implies `--profile`)'
+    )
+    parser.add_argument(
+        '-tm', '--trace-memory',
+        action='store_true',
+        default=False,
+        help='with `--profile`, also measure the peak memory of each '
+             'stage (slower)'
+    )
+
+    return parser
+
+
+def enable_profiling(args):
+    """
+    Enable the profiler (see `profiling.py`) if requested with the 
+    labelling arguments in `args` (see `add_labelling_arguments`).
+    """
+
+    if args.profile or args.profile_log is not None:
+        prof.profiler.enable(args.profile_log, args.trace_memory)
+
+
+def get_object_shapes(sphere_collections=(), hull_collections=()):
+    """
+    Map the names of the objects in the given collections to the shape
+    used for computing their bounding boxes (see 
+    `segmentation_utils.get_bounding_box_in_rendered_image`). Objects 
+    that are missing are meant to be handled as arbitrary meshes.
+    """
+
+    shapes = {}
+    for shape, collection_names in [
+        ('hull', hull_collections),
+        ('sphere', sphere_collections)
+    ]:
+        for collection_name in collection_names:
+            for obj in bpy.data.collections[collection_name].all_objects:
+                shapes[obj.name] = shape
+
+    return shapes
+
+
+def compute_sphere_complete_masks(
+    objects,
+    annotations,
+    camera_args,
+    object_shapes,
+    output_masks=True,
+    output_outlines=True
+):
+    """
+    Compute analytically the complete masks and outlines of the objects
+    whose shape is 'sphere' (see `get_object_shapes`), instead of
+    rendering them on their own. `camera_args` are the camera arguments
+    of `segmentation_utils.get_sphere_complete_mask` (from the camera 
+    object to the projection) and `annotations`
+    those computed for `objects` by `compute_annotations`.
+
+    Returns two dicts mapping pass indices to, respectively, RLE counts
+    and outline coordinates, and the list of the indices of the objects
+    (in `objects`) that still have to be rendered, i.e. those that are
+    not spheres, or that the camera is inside of.
+    """
+
+    render_width, render_height = camera_args[4:6]
+
+    complete_masks = {}
+    complete_outlines = {}
+    remaining_indices = []
+    for i, ((obj, _), annotation) in enumerate(zip(objects, annotations)):
+        if object_shapes.get(obj.name) != 'sphere':
+            remaining_indices.append(i)
+            continue
+
+        try:
+            counts = su.get_sphere_complete_mask(
+                obj,
+                *camera_args,
+                bbox=annotation['bbox']
+            )
+        except ValueError:
+            remaining_indices.append(i)
+            continue
+
+        if output_masks:
+            complete_masks[obj.pass_index] = counts
+        if output_outlines:
+            # Outlines are found as in an index pass with this object only
+            mask = ibu.decode_rle(counts, render_height, render_width)
+            complete_outlines.update(ibu.get_outlines(
+                np.where(mask, obj.pass_index, ibu.BACKGROUND_PASS_INDEX),
+                [obj.pass_index]
+            ))
+
+    return complete_masks, complete_outlines, remaining_indices
+
+
+def create_annotation_writer(args, output_dir):
+    """
+    Create the writer that `label_image` needs for the annotation format
+    in `args` (see `add_labelling_arguments`), appending to 
+    `output_dir`, or return None if annotations are saved as separate 
+    files.
+    """
+
+    if args.annotation_format == 'binary':
+        return ans.AnnotationWriter(output_dir)
+
+    if args.annotation_format == 'coco':
+        return cocu.CocoWriter(
+            Path(output_dir) / cocu.COCO_LINES_FILENAME,
+            cocu.make_categories(args.collections, args.category_ids)
+        )
+
+    return None
+
+
+def create_frame_cache(args):
+    """
+    Open the frame cache requested with the labelling arguments in 
+    `args` (see `add_labelling_arguments`), or return None.
+    """
+
+    if args.frame_cache_dir is None:
+        return None
+
+    return fc.FrameCache(
+        args.frame_cache_dir,
+        max_size=int(args.frame_cache_size * 2**30)
+    )
+
+
+def create_background_writer(args):
+    """
+    Start the background writer requested with the labelling arguments 
+    in `args` (see `add_labelling_arguments`), or return None.
+    """
+
+    if not args.background_writes:
+        return None
+
+    return bw.BackgroundWriter(args.write_queue_size)
+
+
+def get_scene_state(scene, camera_obj, args):
+    """
+    Get the state of the scene that the object index pass and the 
+    projections of the objects depend on, to be hashed with 
+    `frame_cache.compute_key`: the transform, pass index and mesh of 
+    every mesh object that can be rendered (any of them can occlude the
+    labelled objects), the camera and the render settings.
+    """
+
+    return {
+        'objects': [
+            [
+                obj.name,
+                obj.pass_index,
+                obj.data.name,
+                len(obj.data.vertices),
+                np.array(obj.matrix_world)
+            ]
+            for obj in scene.objects
+            if obj.type == 'MESH' and not obj.hide_render
+        ],
+        'camera': np.array(camera_obj.matrix_world),
+        'lens': [
+            args.camera_sensor_width,
+            args.camera_sensor_height,
+            args.lens_focal_length,
+            args.lens_projection
+        ],
+        'resolution': [args.render_width, args.render_height],
+        'mask_renderer': args.mask_renderer,
+        'occluder_collections': args.occluder_collections,
+        'render_settings': rp.get_render_settings(scene)
+    }
+
+
+def load_views(views_path):
+    """
+    Load the views of a scene from a JSON file holding a list of dicts,
+    one for each view, with an optional 'name' and any of 
+    `view_arguments` (e.g. `{"name": "left", "camera_name": 
+    "Camera_sinistra", "lens_projection": "rectilinear"}`): arguments 
+    that are missing are taken from the labelling arguments.
+    """
+
+    with open(views_path) as views_file:
+        views = json.load(views_file)
+
+    for view in views:
+        unknown_keys = set(view) - set(view_arguments) - {'name'}
+        if unknown_keys:
+            raise ValueError(f'Unknown view arguments: {sorted(unknown_keys)}')
+        if view.get('lens_projection', 'rectilinear') not in projections:
+            raise ValueError(f'Unknown lens projection: {view["lens_projection"]}')
+
+    return views
+
+
+def get_view_name(view, view_index):
+
+    return view.get('name', f'view{view_index:02d}')
+
+
+def get_view_args(args, view):
+    """
+    Get the labelling arguments `args` (see `add_labelling_arguments`) 
+    with those given by `view` (see `load_views`) in place of the 
+    defaults.
+    """
+
+    return argparse.Namespace(**{
+        **vars(args),
+        **{key: value for key, value in view.items() if key in view_arguments}
+    })
+
+
+def get_view_output_path(path, view_name):
+    """
+    Add the name of a view to a file path (e.g. `render.png` becomes 
+    `render_left.png`).
+    """
+
+    path = Path(path)
+
+    return str(path.with_name(f'{path.stem}_{view_name}{path.suffix}'))
+
+
+def get_objects(collection_names, category_ids):
+    """
+    Get a list of (object, category ID) pairs for all objects in the
+    given collections, where objects in the i-th collection are given
+    the i-th category ID.
+    """
+
+    objects = []
+    for collection_name, category_id in zip(collection_names, category_ids):
+        objects.extend([
+            (obj, category_id)
+            for obj in bpy.data.collections[collection_name].all_objects[:]
+        ])
+
+    return objects
+
+
+def configure_rendering(
+    scene,
+    render_width,
+    render_height,
+    render_samples,
+    render_profile='auto',
+    render_threads=0,
+    mask_only=False
+):
+    """
+    Set rendering settings, according to a render profile (see 
+    `render_profiles`), and enable the object index pass, which is
+    needed for computing masks and outlines. Set `mask_only` if no image
+    is going to be rendered, but only masks and outlines. Returns the 
+    nodes and links of the compositing tree.
+    """
+
+    # Set rendering settings
+    scene.render.engine = 'CYCLES'
+    scene.render.resolution_x = render_width
+    scene.render.resolution_y = render_height
+    scene.render.resolution_percentage = 100
+
+    # Set device, threads, tiles, sampling, bounces and denoising
+    rp.apply_render_profile(
+        scene,
+        render_profile,
+        render_samples,
+        render_threads,
+        mask_only
+    )
+
+    # Use nodes in compositing
+    scene.use_nodes = True
+
+    # Deliver objects' pass indexes to the rendering engine
+    scene.view_layers['View Layer'].use_pass_object_index = True
+
+    # Get access to the compositing tree
+    tree = scene.node_tree
+
+    return tree.nodes, tree.links
+
+
+def create_compositor_graph(args, nodes, links):
+    """
+    Create the compositing graph that outputs masks and outlines for the
+    labelling arguments in `args` (see `add_labelling_arguments`), to be
+    reused across frames, or return None if they are not output through
+    the compositor.
+    """
+
+    if args.annotation_format != 'text':
+        return None
+
+    return cg.CompositorGraph(nodes, links, args.mask_output_format)
+
+
+def create_viewer_node(nodes, links):
+    """
+    Make sure that a 'Viewer' node is connected to the 'IndexOB' output 
+    of the 'Render Layers' node, so that the object index pass can be 
+    read after rendering (see `segmentation_utils.read_index_buffer`). 
+    Returns the 'Viewer' node if it has been created, None otherwise.
+    """
+
+    render_layers_node = nodes.get('Render Layers')
+
+    viewer_node = nodes.get('Viewer')
+    created = viewer_node is None
+    if created:
+        viewer_node = nodes.new(type='CompositorNodeViewer')
+
+    links.new(
+        render_layers_node.outputs.get('IndexOB'),
+        viewer_node.inputs.get('Image')
+    )
+
+    return viewer_node if created else None
+
+
+def render_complete_masks(
+    scene,
+    objects,
+    compositor_graph=None,
+    output_masks=True,
+    output_outlines=True,
+    groups=None
+):
+    """
+    Perform a separate render for each group of objects (by default, 
+    each object on its own), where objects in such group are the only 
+    visible ones, so as to output masks and outlines that include any 
+    portions of the objects that are occluded by other objects. Objects
+    in the same group must not occlude each other (see 
+    `silhouette_utils.group_non_overlapping_boxes`). `groups` is a list
+    of lists of indices into `objects`.
+
+    Masks and outlines are saved as images through `compositor_graph` 
+    (see `compositor_graph.CompositorGraph`), whose base path must have
+    been set. If it is None, they are read from the object index pass 
+    after each render instead (which requires a 'Viewer' node, see 
+    `create_viewer_node`), and returned as two dicts mapping pass 
+    indices to, respectively, RLE counts and outline coordinates. 
+    """
+
+    if groups is None:
+        groups = [[i] for i in range(len(objects))]
+
+    complete_masks = {}
+    complete_outlines = {}
+
+    # Hide all objects
+    for obj, _ in objects:
+        obj.cycles_visibility.camera = False
+
+    # We don't care about the quality of this render: all we care about
+    # is knowing which pixels in the render belong to a given object.
+    # Let's then switch to the fastest settings (1 render sample, no 
+    # bounces and no denoising) so that the rendering can be carried out
+    # as quickly as possible
+    with rp.mask_render_settings(scene):
+        for group in groups:
+            group_objects = [objects[i][0] for i in group]
+
+            # Make the objects in this group (and only those) visible
+            for obj in group_objects:
+                obj.cycles_visibility.camera = True
+
+            if compositor_graph is not None:
+                # Output a pixel mask as well as an outline of each object
+                # in the render (including any non-visible portions of it)
+                compositor_graph.activate(
+                    group_objects,
+                    output_masks,
+                    output_outlines,
+                    filename_suffix='complete'
+                )
+
+            # Render the scene (objects in `group` will be the only
+            # visible ones)
+            bpy.ops.render.render(use_viewport=False, write_still=False)
+            prof.profiler.count(renders=1)
+
+            if compositor_graph is not None:
+                compositor_graph.deactivate()
+            else:
+                pass_indices = [obj.pass_index for obj in group_objects]
+                masks, outlines = su.get_visible_masks_and_outlines_in_rendered_image(
+                    scene.render.resolution_x,
+                    scene.render.resolution_y,
+                    pass_indices,
+                    output_masks,
+                    output_outlines
+                )
+                if masks is not None:
+                    for pass_index in pass_indices:
+                        complete_masks[pass_index] = masks[pass_index]['counts']
+                if outlines is not None:
+                    complete_outlines.update(outlines)
+
+            # Make the objects invisible again
+            for obj in group_objects:
+                obj.cycles_visibility.camera = False
+
+    return complete_masks, complete_outlines
+
+
+def render(scene, render_output_path=None):
+    """
+    Render the scene, saving the render to `render_output_path`. If no
+    path is given, only the passes needed for masks and outlines are
+    computed, as quickly as possible.
+    """
+
+    if render_output_path is not None:
+        # Render the scene
+        scene.render.image_settings.file_format = 'PNG'
+        scene.render.filepath = render_output_path
+        bpy.ops.render.render(use_viewport=False, write_still=True)
+
+    else:
+        # The user doesn't want to perform a complete render, but only
+        # retrieve a pixel and/or an outline mask of the objects
+        with rp.mask_render_settings(scene):
+            bpy.ops.render.render(use_viewport=False, write_still=False)
+
+
+def get_top_left_corner(reference_obj):
+    """
+    Compute the x and y coordinates of the top-left corner of the
+    reference object (for example, the table).
+    """
+
+    top_left_corner_x = reference_obj.location.x                        \
+                        - reference_obj.dimensions.x / 2
+
+    top_left_corner_y = reference_obj.location.y                        \
+                        + reference_obj.dimensions.y / 2
+
+    return np.array([
+        top_left_corner_x,
+        top_left_corner_y
+    ])
+
+
+def compute_annotations(
+    objects,
+    camera_obj,
+    camera_sensor_width,
+    camera_sensor_height,
+    lens_focal_length,
+    render_width,
+    render_height,
+    projection,
+    top_left_corner=None,
+    output_vertex_coordinates=False,
+    object_shapes=None,
+    cached_annotations=None
+):
+    """
+    Compute the location and bounding box (and, optionally, the pixel 
+    coordinates of the vertices) of each object. If `top_left_corner` is
+    given, locations will be relative to it. `object_shapes` maps object
+    names to how their bounding boxes are computed (see 
+    `get_object_shapes`); by default, all vertices are projected. 
+    Bounding boxes and vertices found in `cached_annotations` (a list of
+    annotations previously computed for the same scene, see 
+    `frame_cache`) are reused instead of being projected again.
+
+    Returns a list of dicts, one for each object, with keys 'name', 
+    'category_id', 'pass_index', 'location', 'bbox' and, optionally, 
+    'vertices'.
+    """
+
+    if object_shapes is None:
+        object_shapes = {}
+
+    cached_annotations = {
+        annotation['name']: annotation
+        for annotation in cached_annotations or []
+    }
+
+    annotations = []
+    for obj, category_id in objects:
+
+        # Location of the object in the 3D scene
+        location = np.array([
+            obj.location.x,
+            obj.location.y
+        ])
+
+        if top_left_corner is not None:
+            # Compute location relative to a given reference object
+            location = cu.convert_coordinates(location, top_left_corner)
+
+        # Make the y-coordinate grow downwards
+        location[1] = -location[1]
+
+        cached_annotation = cached_annotations.get(obj.name, {})
+
+        # Bounding box of `obj` in the render
+        if 'bbox' in cached_annotation:
+            bbox = cached_annotation['bbox']
+        else:
+            bbox = su.get_bounding_box_in_rendered_image(
+                obj,
+                camera_obj,
+                camera_sensor_width,
+                camera_sensor_height,
+                lens_focal_length,
+                render_width,
+                render_height,
+                projection,
+                shape=object_shapes.get(obj.name, 'mesh')
+            )
+
+        annotation = {
+            'name': obj.name,
+            'category_id': category_id,
+            'pass_index': obj.pass_index,
+            'location': location,
+            'bbox': bbox
+        }
+        if output_vertex_coordinates and 'vertices' in cached_annotation:
+            annotation['vertices'] = cached_annotation['vertices']
+        elif output_vertex_coordinates:
+            # Coordinates of `obj`'s vertices in the render
+            annotation['vertices'] = su.get_vertex_coordinates_in_rendered_image(
+                obj,
+                camera_obj,
+                camera_sensor_width,
+                camera_sensor_height,
+                lens_focal_length,
+                render_width,
+                render_height,
+                projection
+            )
+
+        annotations.append(annotation)
+
+    return annotations
+
+
+def save_annotations(annotations, output_dir):
+    """
+    Save annotations computed with `compute_annotations` to 
+    `output_dir`, with a text file for each annotation of each object.
+    """
+
+    output_dir = Path(output_dir)
+    for annotation in annotations:
+
+        name = annotation['name']
+        np.savetxt(str(output_dir / f'{name}_category_id'), np.array([annotation['category_id']]))
+        np.savetxt(str(output_dir / f'{name}_location'), annotation['location'])
+        np.savetxt(str(output_dir / f'{name}_bbox'), annotation['bbox'])
+
+        if 'vertices' in annotation:
+            np.savetxt(
+                str(output_dir / f'{name}_vertices'),
+                annotation['vertices']
+            )
+
+
+def label_image(
+    scene,
+    objects,
+    nodes,
+    links,
+    args,
+    annotations_output_dir,
+    render_output_path=None,
+    annotation_writer=None,
+    frame_id=0,
+    frame_cache=None,
+    background_writer=None,
+    compositor_graph=None,
+    metadata=None
+):
+    """
+    Render the scene and save annotations for the given objects,
+    according to the labelling arguments in `args` (see
+    `add_labelling_arguments`). `configure_rendering` must have been
+    called beforehand.
+
+    If `annotation_writer` is given, `annotations_output_dir` is ignored
+    and all annotations of the frame are written to it, either as a 
+    single record for `frame_id` (an `annotation_store.AnnotationWriter`,
+    with `--annotation-format binary`) or as a COCO image with ID 
+    `frame_id` (a `coco_utils.CocoWriter`, with `--annotation-format 
+    coco`). Otherwise, they are saved as separate files in 
+    `annotations_output_dir`, masks and outlines through 
+    `compositor_graph` (see `create_compositor_graph`): pass the same
+    one for every frame, so that the compositing tree is built only 
+    once. If it is not given, a graph is created for this frame only.
+
+    If `frame_cache` (a `frame_cache.FrameCache`, which requires an
+    `annotation_writer`) is given and has an entry for the current state
+    of the scene, the object index pass and the projections are taken 
+    from it, and the scene is only rendered if `render_output_path` is
+    given. Otherwise, they are added to it.
+
+    If `background_writer` (a `background_writer.BackgroundWriter`) is
+    given, masks and outlines are derived and annotations are written 
+    by it (see `write_frame_annotations`), while this function returns
+    as soon as the object index pass is available.
+
+    `metadata` (a dict of JSON-serializable values, e.g. describing the
+    view) is added to the metadata of the frame in the annotation store.
+
+    Returns the compositing nodes that have been created for this frame
+    only, so that the caller can remove them if the same scene is going
+    to be labelled again.
+    """
+
+    output_masks = not args.no_masks
+    output_outlines = not args.no_outlines
+    rasterize = args.mask_renderer == 'rasterizer'
+
+    if annotation_writer is None:
+        if rasterize or frame_cache is not None:
+            raise ValueError(
+                'The rasterizer and the frame cache can only be used with '
+                'the binary and coco annotation formats'
+            )
+        if compositor_graph is None:
+            compositor_graph = cg.CompositorGraph(nodes, links, args.mask_output_format)
+            created_nodes = None
+        else:
+            created_nodes = []
+        compositor_graph.set_base_path(annotations_output_dir)
+    elif rasterize:
+        # Masks and outlines will be computed from the rasterized object 
+        # index pass
+        compositor_graph = None
+        created_nodes = []
+    else:
+        # Masks and outlines will be computed from the object index pass
+        compositor_graph = None
+        created_nodes = [create_viewer_node(nodes, links)]
+
+    camera_obj = bpy.data.objects[args.camera_name]
+    object_shapes = get_object_shapes(args.sphere_collections, args.hull_collections)
+
+    # Look for what has already been computed for the same scene
+    cached_entry = None
+    if frame_cache is not None:
+        with prof.profiler.stage('cache_lookup'):
+            cache_key = fc.compute_key(get_scene_state(scene, camera_obj, args))
+            cached_entry = frame_cache.get(cache_key)
+            prof.profiler.count(cache_hits=int(cached_entry is not None))
+
+    if cached_entry is not None:
+        index_buffer, cached_annotations, cached_metadata = fc.unpack_frame_entry(
+            cached_entry
+        )
+        cached_by_pass_index = {
+            annotation['pass_index']: annotation
+            for annotation in cached_annotations
+        }
+        if cached_metadata.get('object_shapes') != object_shapes:
+            # Bounding boxes were computed differently
+            cached_annotations = None
+    else:
+        index_buffer = None
+        cached_annotations = None
+        cached_by_pass_index = {}
+
+    if args.reference_coordinate_system is not None:
+        # The user wants x and y coordinates of the objects to be
+        # relative to another object in the scene. For example, in the
+        # case of balls on a pool table, the user might want balls'
+        # coordinates relative to the table, so that they will be fixed
+        # regardless of the location of the table in the 3D scene.
+        top_left_corner = get_top_left_corner(
+            bpy.data.objects[args.reference_coordinate_system]
+        )
+    else:
+        top_left_corner = None
+
+    with prof.profiler.stage('projection'):
+        annotations = compute_annotations(
+            objects,
+            camera_obj,
+            args.camera_sensor_width,
+            args.camera_sensor_height,
+            args.lens_focal_length,
+            args.render_width,
+            args.render_height,
+            projections[args.lens_projection],
+            top_left_corner,
+            args.vertex_coordinates,
+            object_shapes,
+            cached_annotations
+        )
+        prof.profiler.count(objects=len(objects))
+
+    camera_args = (
+        camera_obj,
+        args.camera_sensor_width,
+        args.camera_sensor_height,
+        args.lens_focal_length,
+        args.render_width,
+        args.render_height,
+        projections[args.lens_projection]
+    )
+    occluders = [
+        obj
+        for collection_name in args.occluder_collections
+        for obj in bpy.data.collections[collection_name].all_objects
+    ]
+
+    # Complete masks and outlines can be reused only if the cache has
+    # all of those that are needed
+    pass_indices = [obj.pass_index for obj, _ in objects]
+    needed_kinds = []
+    if args.individual_renders and output_masks:
+        needed_kinds.append('mask_complete')
+    if args.individual_renders and output_outlines:
+        needed_kinds.append('outline_complete')
+    complete_cached = needed_kinds and all(
+        kind in cached_by_pass_index.get(pass_index, {})
+        for pass_index in pass_indices
+        for kind in needed_kinds
+    )
+
+    # Check if the user has requested to perform a separate render for
+    # each object (this comes in handy when some objects are occluded by
+    # others)
+    if complete_cached:
+        complete_masks = {}
+        complete_outlines = {}
+        for pass_index in pass_indices:
+            cached_annotation = cached_by_pass_index[pass_index]
+            if output_masks:
+                complete_masks[pass_index] = cached_annotation['mask_complete']['counts']
+            if output_outlines:
+                complete_outlines[pass_index] = cached_annotation['outline_complete']
+
+    elif args.individual_renders and rasterize:
+        # Rasterizing each object on its own is cheap enough, but 
+        # spheres don't even need that
+        with prof.profiler.stage('complete_masks'):
+            complete_masks, complete_outlines, remaining_indices = (
+                compute_sphere_complete_masks(
+                    objects,
+                    annotations,
+                    camera_args,
+                    object_shapes,
+                    output_masks,
+                    output_outlines
+                )
+            )
+            for obj, _ in [objects[i] for i in remaining_indices]:
+                object_index_buffer = su.rasterize_objects([obj], *camera_args)
+                if output_masks:
+                    complete_masks[obj.pass_index] = ibu.get_masks(
+                        object_index_buffer,
+                        [obj.pass_index]
+                    )[obj.pass_index]['counts']
+                if output_outlines:
+                    complete_outlines.update(
+                        ibu.get_outlines(object_index_buffer, [obj.pass_index])
+                    )
+
+    elif args.individual_renders:
+        with prof.profiler.stage('complete_masks'):
+            if compositor_graph is None:
+                # Masks of spheres are computed analytically, while 
+                # other objects are rendered
+                complete_masks, complete_outlines, remaining_indices = (
+                    compute_sphere_complete_masks(
+                        objects,
+                        annotations,
+                        camera_args,
+                        object_shapes,
+                        output_masks,
+                        output_outlines
+                    )
+                )
+            else:
+                # Masks are saved as images by the compositor
+                complete_masks = {}
+                complete_outlines = {}
+                remaining_indices = list(range(len(objects)))
+            objects_to_render = [objects[i] for i in remaining_indices]
+
+            if args.individual_render_grouping == 'bbox':
+                # Objects that can't occlude each other are rendered 
+                # together
+                groups = silu.group_non_overlapping_boxes(
+                    [annotations[i]['bbox'] for i in remaining_indices]
+                )
+            else:
+                groups = None
+
+            if objects_to_render:
+                rendered_masks, rendered_outlines = render_complete_masks(
+                    scene,
+                    objects_to_render,
+                    compositor_graph,
+                    output_masks,
+                    output_outlines,
+                    groups
+                )
+                complete_masks.update(rendered_masks)
+                complete_outlines.update(rendered_outlines)
+
+    for obj, _ in objects:
+        obj.cycles_visibility.camera = True
+
+    if compositor_graph is not None:
+        # Output a pixel mask as well as an outline of the visible 
+        # portion of each object in the render
+        compositor_graph.activate(
+            [obj for obj, _ in objects],
+            output_masks,
+            output_outlines,
+            filename_suffix='visible'
+        )
+
+    # With the rasterizer or a cached index pass, Cycles is only needed 
+    # for the image itself, which is always rendered again: the cache key
+    # only covers what the index pass depends on, not lights, materials
+    # or the world. With the text format, rendering includes writing 
+    # masks and outlines through the File Output node
+    if index_buffer is None and not rasterize:
+        render_needed = True
+    else:
+        render_needed = render_output_path is not None
+    if render_needed:
+        with prof.profiler.stage('render'):
+            render(scene, render_output_path)
+            prof.profiler.count(
+                renders=1,
+                pixels=args.render_width * args.render_height
+            )
+
+    if compositor_graph is not None:
+        compositor_graph.deactivate()
+        if created_nodes is None:
+            created_nodes = compositor_graph.get_nodes()
+
+    if annotation_writer is not None:
+        if index_buffer is None:
+            with prof.profiler.stage('index_pass'):
+                if rasterize:
+                    index_buffer = su.rasterize_objects(
+                        [obj for obj, _ in objects],
+                        *camera_args,
+                        occluders=occluders
+                    )
+                else:
+                    index_buffer = su.get_index_buffer_in_rendered_image(
+                        args.render_width,
+                        args.render_height
+                    )
+                prof.profiler.count(pixels=index_buffer.size)
+
+    if frame_cache is not None and (
+        cached_entry is None or
+        cached_annotations is None or
+        (args.vertex_coordinates and not all(
+            'vertices' in cached_annotation
+            for cached_annotation in cached_annotations
+        )) or
+        (needed_kinds and not complete_cached)
+    ):
+        # Something new has been computed for this scene
+        with prof.profiler.stage('cache_store'):
+            masks = {}
+            outlines = {}
+            if args.individual_renders and output_masks:
+                masks['mask_complete'] = complete_masks
+            if args.individual_renders and output_outlines:
+                outlines['outline_complete'] = complete_outlines
+            frame_cache.put(cache_key, fc.pack_frame_entry(
+                index_buffer,
+                annotations,
+                masks,
+                outlines,
+                metadata={'object_shapes': object_shapes}
+            ))
+
+    if not args.individual_renders:
+        complete_masks = complete_outlines = None
+
+    if render_output_path is not None:
+        file_name = Path(render_output_path).name
+    else:
+        file_name = f'{frame_id:06d}.png'
+
+    # Anything that needs `bpy` must be read here, not by the job
+    job_args = (
+        annotation_writer,
+        args,
+        frame_id,
+        annotations,
+        index_buffer,
+        complete_masks,
+        complete_outlines,
+        file_name,
+        {
+            'frame_id': frame_id,
+            'render_settings': rp.get_render_settings(scene),
+            'mask_renderer': args.mask_renderer,
+            'render_output_path': render_output_path,
+            'render_width': args.render_width,
+            'render_height': args.render_height,
+            'camera_name': args.camera_name,
+            'lens_projection': args.lens_projection,
+            **(metadata or {})
+        },
+        annotations_output_dir
+    )
+    with prof.profiler.stage('write_annotations'):
+        if background_writer is not None:
+            background_writer.submit(write_frame_annotations, *job_args)
+        else:
+            write_frame_annotations(*job_args)
+
+    return [node for node in created_nodes if node is not None]
+
+
+def write_frame_annotations(
+    annotation_writer,
+    args,
+    frame_id,
+    annotations,
+    index_buffer=None,
+    complete_masks=None,
+    complete_outlines=None,
+    file_name=None,
+    metadata=None,
+    annotations_output_dir=None
+):
+    """
+    Derive visible masks and outlines from the object index pass 
+    `index_buffer` (in NumPy format) and write all the annotations of a
+    frame, as `label_image` does. Doesn't need `bpy`, so it can be run 
+    by a `background_writer.BackgroundWriter`: arrays passed to it must
+    not be modified afterwards.
+    """
+
+    if annotation_writer is None:
+        save_annotations(annotations, annotations_output_dir)
+        return
+
+    output_masks = not args.no_masks
+    output_outlines = not args.no_outlines
+    pass_indices = [annotation['pass_index'] for annotation in annotations]
+
+    # COCO annotations always come with a segmentation
+    with prof.profiler.stage('masks_outlines'):
+        if output_masks or args.annotation_format == 'coco':
+            visible_masks = ibu.get_masks(index_buffer, pass_indices)
+        if output_outlines and args.annotation_format == 'binary':
+            visible_outlines = ibu.get_outlines(index_buffer, pass_indices)
+
+    if args.annotation_format == 'coco':
+        image_entry = cocu.make_image_entry(
+            frame_id,
+            file_name,
+            args.render_width,
+            args.render_height
+        )
+        # Views of the same scene can be told apart, and grouped back
+        for key in ['view_name', 'view_index', 'scene_frame_id']:
+            if key in (metadata or {}):
+                image_entry[key] = metadata[key]
+        annotation_writer.add_image(
+            image_entry,
+            [
+                cocu.make_object_annotation(
+                    annotation,
+                    visible_masks[annotation['pass_index']]['counts'],
+                    frame_id,
+                    args.render_width,
+                    args.render_height
+                )
+                for annotation in annotations
+            ]
+        )
+
+    else:
+        masks = {}
+        outlines = {}
+        if output_masks:
+            masks['mask_visible'] = {
+                pass_index: mask['counts']
+                for pass_index, mask in visible_masks.items()
+            }
+        if output_outlines:
+            outlines['outline_visible'] = visible_outlines
+        if complete_masks is not None and output_masks:
+            masks['mask_complete'] = complete_masks
+        if complete_outlines is not None and output_outlines:
+            outlines['outline_complete'] = complete_outlines
+
+        annotation_writer.write(frame_id, ans.pack_frame_annotations(
+            annotations,
+            masks,
+            outlines,
+            mask_size=(args.render_height, args.render_width),
+            metadata=metadata
+        ))
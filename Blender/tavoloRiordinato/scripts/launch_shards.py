@@ -0,0 +1,188 @@
+"""
+Split a dataset generation job across several headless Blender workers.
+
+Each worker runs `generate_dataset.py` on its own contiguous range of
+sample indices, with its own seed (derived from the job seed and the
+shard index) and its own output subdirectory. Usage:
+
+    python3 launch_shards.py -b ../tavolo.blend -n 100000 -k 16 \
+        -o ../dataset --seed 42 -- -c T0_Palle -cid 0 -cs Panno
+
+Arguments after `--` are passed on to `generate_dataset.py`. Running the
+same command again resumes interrupted shards, skipping the samples that
+are already listed in their manifests. Once all workers are done, the
+manifests of all shards are merged into `<output dir>/manifest.jsonl`
+and, with `--annotation-format coco`, their COCO annotations into
+`<output dir>/coco.json` (see `merge_coco.py`).
+"""
+
+from pathlib import Path
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+scripts_folder = Path(__file__).parent
+sys.path.insert(0, str(scripts_folder))
+import coco_utils as cocu
+import sharding_utils as shu
+
+this_script_name = Path(__file__).stem
+parser = argparse.ArgumentParser(this_script_name)
+parser.add_argument(
+    '-b', '--blend-file',
+    required=True
+)
+parser.add_argument(
+    '-n', '--n-samples',
+    type=int,
+    required=True
+)
+parser.add_argument(
+    '-k', '--n-workers',
+    type=int,
+    default=4
+)
+parser.add_argument(
+    '-o', '--output-dir',
+    required=True
+)
+parser.add_argument(
+    '--seed',
+    type=int,
+    default=0
+)
+parser.add_argument(
+    '-s', '--start-index',
+    type=int,
+    default=1
+)
+parser.add_argument(
+    '-t', '--threads-per-worker',
+    type=int,
+    default=None,
+    help='by default, the CPU cores are split evenly among workers; 0 '
+         'means as many threads as there are CPU cores (in each worker)'
+)
+parser.add_argument(
+    '--blender',
+    default='blender'
+)
+
+if '--' in sys.argv:
+    args = parser.parse_args(sys.argv[1:sys.argv.index('--')])
+    generator_args = sys.argv[sys.argv.index('--') + 1:]
+else:
+    args = parser.parse_args()
+    generator_args = []
+
+if args.threads_per_worker is None:
+    # Workers running with one thread per core each would oversubscribe
+    # the CPU as many times as there are workers
+    args.threads_per_worker = max((os.cpu_count() or 1) // args.n_workers, 1)
+
+output_dir = Path(args.output_dir)
+output_dir.mkdir(parents=True, exist_ok=True)
+
+shards = shu.split_into_shards(args.start_index, args.n_samples, args.n_workers)
+
+# Keep track of how the job has been split, so that any sample can be
+# traced back to its shard and seed
+with open(output_dir / 'job.json', 'w') as file_pointer:
+    json.dump({
+        'seed': args.seed,
+        'blend_file': str(Path(args.blend_file).resolve()),
+        'generator_args': generator_args,
+        'shards': [
+            {
+                'shard_index': shard_index,
+                'seed': shu.derive_seed(args.seed, shard_index),
+                'start_index': start_index,
+                'n_samples': n_samples
+            }
+            for shard_index, (start_index, n_samples) in enumerate(shards)
+        ]
+    }, file_pointer, indent=4)
+
+workers = []
+for shard_index, (start_index, n_samples) in enumerate(shards):
+
+    shard_dir = output_dir / f'shard_{shard_index:03d}'
+    shard_dir.mkdir(exist_ok=True)
+
+    completed_sample_ids = shu.get_completed_sample_ids(
+        shard_dir / shu.MANIFEST_FILENAME
+    )
+    n_completed = sum(
+        f'{i:06d}' in completed_sample_ids
+        for i in range(start_index, start_index + n_samples)
+    )
+    if n_completed == n_samples:
+        print(f'Shard {shard_index} is already complete')
+        continue
+
+    command = [
+        args.blender,
+        args.blend_file,
+        '-b',
+        '-t', str(args.threads_per_worker),
+        '--python', str(scripts_folder / 'generate_dataset.py'),
+        '--',
+        '-n', str(n_samples),
+        '-s', str(start_index),
+        '-o', str(shard_dir),
+        '--seed', str(shu.derive_seed(args.seed, shard_index)),
+        '--resume',
+        *generator_args
+    ]
+    print(
+        f'Starting shard {shard_index} ({n_samples - n_completed} samples '
+        f'left, starting from {start_index})'
+    )
+    with open(shard_dir / 'worker.log', 'a') as log_file:
+        workers.append((shard_index, subprocess.Popen(
+            command,
+            stdout=log_file,
+            stderr=subprocess.STDOUT
+        )))
+
+failed_shards = []
+for shard_index, worker in workers:
+    if worker.wait() != 0:
+        failed_shards.append(shard_index)
+
+# Merge the manifests of all shards, adding the shard each sample belongs
+# to, so that files can be found from the output directory
+with open(output_dir / shu.MANIFEST_FILENAME, 'w') as file_pointer:
+    for shard_index in range(len(shards)):
+        shard_dir = output_dir / f'shard_{shard_index:03d}'
+        for record in shu.read_manifest(shard_dir / shu.MANIFEST_FILENAME):
+            record['shard_index'] = shard_index
+            record['files'] = [
+                str(Path(shard_dir.name) / path) for path in record['files']
+            ]
+            file_pointer.write(json.dumps(record) + '\n')
+
+# Merge the COCO annotations of all shards, if any
+shard_dirs = [
+    output_dir / f'shard_{shard_index:03d}' for shard_index in range(len(shards))
+]
+coco_paths = [
+    shard_dir / 'annotations' / cocu.COCO_LINES_FILENAME
+    for shard_dir in shard_dirs
+]
+if any(path.exists() for path in coco_paths):
+    n_images, n_annotations = cocu.write_coco_dataset(
+        coco_paths,
+        output_dir / 'coco.json',
+        [f'{shard_dir.name}/' for shard_dir in shard_dirs]
+    )
+    print(f'Merged {n_images} images and {n_annotations} COCO annotations')
+
+if failed_shards:
+    print(
+        f'Shards {failed_shards} failed (see their worker.log): run the '
+        f'same command again to resume them'
+    )
+    sys.exit(1)
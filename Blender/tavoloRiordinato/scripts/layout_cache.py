@@ -0,0 +1,313 @@
+"""
+A cache of settled layouts, i.e. the world matrices of balls and pins
+after the physics has scrambled and settled them, so that the same
+layout can be rendered under many lighting, camera and material
+variations without running the simulation again.
+
+Entries are keyed by a hash of everything the settled layout depends on
+(see `compute_key`): the seed the balls are scrambled with, the initial
+transforms of the objects and the physics parameters. They are tiny (a
+4x4 matrix per object), so the cache is made of two files:
+    - a compact index, an .npz file holding the matrices of all entries
+      in one array, along with the names of the objects they belong to
+      and when each entry was last used;
+    - a log next to it (same name, .log extension), to which each new
+      entry is appended as a JSON line, so adding an entry doesn't
+      rewrite anything.
+Both are read when the cache is opened. When the cache is closed, the
+log is compacted into the index: the log is first renamed, so that
+other processes sharing the cache start a new one meanwhile, then the
+index is merged with the entries written to it (by any process) and
+written to a temporary file unique to the process, which replaces it.
+Compactions by different processes are serialized by a lock file (where
+`fcntl` is available); entries appended to a log while it is being
+renamed can still be lost, and are then simply simulated again.
+
+The index is kept within a size budget by evicting the least recently
+used entries, where "used" means written or read, when it is compacted.
+Neither `bpy` nor `mathutils` are needed.
+"""
+
+from pathlib import Path
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+
+import frame_cache as fc
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows
+    fcntl = None
+
+# Bump this when the way layouts are settled changes, so that old
+# entries are never read
+LAYOUT_CACHE_VERSION = 1
+
+
+def compute_key(seed, initial_transforms, physics_parameters):
+    """
+    Hash what a settled layout depends on: the seed the balls are
+    scrambled with, the initial world matrices of the objects, as a
+    dict mapping object names to 4x4 arrays, and the physics parameters,
+    as a dict of JSON-serializable values. Returns a hexadecimal string.
+    """
+
+    return fc.compute_key({
+        'layout_cache_version': LAYOUT_CACHE_VERSION,
+        'seed': seed,
+        'initial_transforms': [
+            [name, np.asarray(matrix, dtype=np.float32)]
+            for name, matrix in sorted(initial_transforms.items())
+        ],
+        'physics_parameters': physics_parameters
+    })
+
+
+def _get_entry_size(entry):
+
+    return (
+        entry['matrices'].nbytes +
+        sum(len(name) for name in entry['object_names']) +
+        64
+    )
+
+
+def _read_index(path):
+    """
+    Read the entries of an index, as a dict mapping keys to dicts with
+    keys 'object_names', 'matrices', 'simulation_frames' and
+    'last_used'.
+    """
+
+    with np.load(path) as npz_file:
+        keys = npz_file['keys'].tolist()
+        offsets = npz_file['offsets']
+        object_names = npz_file['object_names'].tolist()
+        matrices = npz_file['matrices']
+        simulation_frames = npz_file['simulation_frames'].tolist()
+        last_used = npz_file['last_used'].tolist()
+
+    entries = {}
+    for i, key in enumerate(keys):
+        start, end = offsets[i], offsets[i + 1]
+        entries[key] = {
+            'object_names': object_names[start:end],
+            'matrices': matrices[start:end],
+            'simulation_frames': (
+                simulation_frames[i] if simulation_frames[i] >= 0 else None
+            ),
+            'last_used': last_used[i]
+        }
+
+    return entries
+
+
+def _write_index(path, entries):
+
+    keys = list(entries)
+    lengths = [len(entries[key]['object_names']) for key in keys]
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    object_names = [name for key in keys for name in entries[key]['object_names']]
+    if keys:
+        matrices = np.concatenate([entries[key]['matrices'] for key in keys])
+    else:
+        matrices = np.empty((0, 4, 4), dtype=np.float32)
+
+    temporary_path = path.with_name(f'{path.stem}.{os.getpid()}.{uuid.uuid4().hex}.tmp.npz')
+    np.savez_compressed(
+        temporary_path,
+        keys=np.array(keys, dtype='U40'),
+        offsets=offsets,
+        object_names=np.array(object_names, dtype=str),
+        matrices=matrices.astype(np.float32),
+        simulation_frames=np.array([
+            entries[key]['simulation_frames']
+            if entries[key]['simulation_frames'] is not None else -1
+            for key in keys
+        ], dtype=np.int64),
+        last_used=np.array(
+            [entries[key]['last_used'] for key in keys],
+            dtype=np.float64
+        )
+    )
+    temporary_path.replace(path)
+
+
+def _make_log_line(key, entry):
+
+    return json.dumps({
+        'key': key,
+        'object_names': entry['object_names'],
+        'matrices': entry['matrices'].tolist(),
+        'simulation_frames': (
+            int(entry['simulation_frames'])
+            if entry['simulation_frames'] is not None else None
+        ),
+        'last_used': entry['last_used']
+    }) + '\n'
+
+
+def _read_log(path):
+    """
+    Read the entries appended to a log, in the same format as
+    `_read_index`, ignoring an incomplete last line.
+    """
+
+    entries = {}
+    try:
+        with open(path) as log_file:
+            lines = log_file.readlines()
+    except FileNotFoundError:
+        return entries
+
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        entries[record.pop('key')] = {
+            **record,
+            'matrices': np.array(record['matrices'], dtype=np.float32)
+        }
+
+    return entries
+
+
+class LayoutCache:
+    """
+    Read and write settled layouts (see the module docstring) in the
+    index at `path`, keeping its size within `max_size` bytes.
+    """
+
+    def __init__(self, path, max_size=256 * 2**20):
+
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.log_path = self.path.with_suffix('.log')
+
+        self._entries = {}
+        if self.path.exists():
+            self._entries = _read_index(self.path)
+        self._entries.update(_read_log(self.log_path))
+
+    def get(self, key):
+        """
+        Get the settled layout stored for `key`, as a dict mapping object
+        names to 4x4 world matrices, and the number of frames it took to
+        settle it (or None), or None if there is no such entry.
+        """
+
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        entry = self._entries[key]
+        entry['last_used'] = time.time()
+        self.hits += 1
+
+        return (
+            dict(zip(entry['object_names'], entry['matrices'])),
+            entry['simulation_frames']
+        )
+
+    def put(self, key, world_matrices, simulation_frames=None):
+        """
+        Store a settled layout for `key`, given as a dict mapping object
+        names to 4x4 world matrices, by appending it to the log.
+        """
+
+        entry = {
+            'object_names': list(world_matrices),
+            'matrices': np.array(list(world_matrices.values()), dtype=np.float32),
+            'simulation_frames': simulation_frames,
+            'last_used': time.time()
+        }
+        self._entries[key] = entry
+
+        # A single write, so that lines appended by different processes 
+        # don't interleave
+        with open(self.log_path, 'a') as log_file:
+            log_file.write(_make_log_line(key, entry))
+
+    def close(self):
+        """
+        Compact the log into the index (see the module docstring),
+        evicting the least recently used entries if the cache exceeds
+        its budget.
+        """
+
+        with open(self.path.with_suffix('.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._compact()
+
+    def _compact(self):
+
+        log_path = self.log_path.with_name(
+            f'{self.log_path.stem}.{os.getpid()}.{uuid.uuid4().hex}.compacting.log'
+        )
+        try:
+            self.log_path.rename(log_path)
+        except FileNotFoundError:
+            log_path = None
+
+        entries = _read_index(self.path) if self.path.exists() else {}
+        if log_path is not None:
+            entries.update(_read_log(log_path))
+        for key, entry in self._entries.items():
+            # Entries known to this process carry their last use by it
+            if key not in entries or entries[key]['last_used'] < entry['last_used']:
+                entries[key] = entry
+        self._entries = entries
+
+        self._evict()
+        _write_index(self.path, self._entries)
+        if log_path is not None:
+            log_path.unlink()
+
+    def get_size(self):
+
+        return sum(_get_entry_size(entry) for entry in self._entries.values())
+
+    def _evict(self):
+
+        total_size = self.get_size()
+        if total_size <= self.max_size:
+            return
+
+        for key in sorted(self._entries, key=lambda key: self._entries[key]['last_used']):
+            if total_size <= self.max_size:
+                break
+            total_size -= _get_entry_size(self._entries.pop(key))
+            self.evictions += 1
+
+    def get_stats(self):
+
+        return {
+            'entries': len(self._entries),
+            'size': self.get_size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def print_stats(self):
+
+        stats = self.get_stats()
+        print(
+            f'Layout cache: {stats["hits"]} hits, {stats["misses"]} misses, '
+            f'{stats["evictions"]} evictions, {stats["entries"]} entries '
+            f'({stats["size"] / 2**10:.0f} KB)'
+        )
@@ -0,0 +1,241 @@
+"""
+Generate large pools of table layouts, i.e. positions and rotations of
+the balls and states of the pins, without rendering anything.
+
+Layouts are stored as rows of a structured NumPy array, in a .npy file
+that is written (and can be read) as a memory map, so pools don't need
+to fit in memory. Each row has the following fields:
+    - 'seed': the seed of the batch the layout was generated in.
+    - 'ball_positions': (n_balls, 2) x and y coordinates, in meters.
+    - 'ball_rotations': (n_balls, 3) Euler angles, in radians.
+    - 'pins_up': (n_pins,) flags telling whether each pin is up.
+A JSON file with the same name holds the parameters used to generate
+the pool (including the names of the balls and pins each column refers
+to). Neither `bpy` nor `mathutils` are needed.
+"""
+
+from pathlib import Path
+import json
+
+import numpy as np
+
+import placement_utils as pu
+import sharding_utils as shu
+
+
+def make_layout_dtype(n_balls, n_pins):
+    """
+    Get the structured dtype of a layout with `n_balls` balls and
+    `n_pins` pins.
+    """
+
+    return np.dtype([
+        ('seed', np.uint32),
+        ('ball_positions', np.float32, (n_balls, 2)),
+        ('ball_rotations', np.float32, (n_balls, 3)),
+        ('pins_up', np.bool_, (n_pins,))
+    ])
+
+
+def _sample_non_overlapping_positions(
+    rng,
+    n_layouts,
+    n_balls,
+    limits,
+    min_distance,
+    exclusion_zones,
+    max_attempts=10000
+):
+    """
+    Sample ball positions for `n_layouts` layouts at once, uniformly
+    within `limits`. Layouts where any two balls overlap, or a ball
+    overlaps an exclusion zone, are sampled again (and only those).
+    Raises a `ValueError` if some layouts are still invalid after 
+    `max_attempts` rounds, i.e. if the balls (most likely) don't fit.
+    """
+
+    low = np.array([limits['x_min'], limits['y_min']])
+    high = np.array([limits['x_max'], limits['y_max']])
+    first, second = np.triu_indices(n_balls, k=1)
+
+    positions = np.empty((n_layouts, n_balls, 2))
+    to_sample = np.arange(n_layouts)
+    for _ in range(max_attempts):
+        if not len(to_sample):
+            break
+        candidates = rng.uniform(low, high, size=(len(to_sample), n_balls, 2))
+
+        ball_distances = np.linalg.norm(
+            candidates[:, first] - candidates[:, second],
+            axis=2
+        )
+        valid = np.all(ball_distances >= min_distance, axis=1)
+
+        if len(exclusion_zones):
+            zone_distances = np.linalg.norm(
+                candidates[:, :, None, :] - exclusion_zones[None, None, :, :2],
+                axis=3
+            )
+            valid &= np.all(
+                zone_distances >= exclusion_zones[:, 2],
+                axis=(1, 2)
+            )
+
+        positions[to_sample[valid]] = candidates[valid]
+        to_sample = to_sample[~valid]
+
+    if len(to_sample):
+        raise ValueError(
+            f'Could not place {n_balls} non-overlapping balls in '
+            f'{len(to_sample)} out of {n_layouts} layouts'
+        )
+
+    return positions
+
+
+def generate_layouts(
+    output_path,
+    n_layouts,
+    limits,
+    ball_names,
+    pin_names=(),
+    pin_positions=None,
+    pin_radius=0.0,
+    ball_diameter=pu.BALL_DIAMETER,
+    pin_down_probability=0.1,
+    seed=0,
+    batch_size=100000
+):
+    """
+    Generate `n_layouts` layouts and save them to `output_path` (a .npy
+    file), along with a JSON file with the generation parameters.
+
+    Balls are placed uniformly within `limits` (see `placement_utils`),
+    so that no two balls overlap and no ball overlaps a pin, and are
+    rotated at random. Each pin is knocked down with probability
+    `pin_down_probability`. Layouts are generated in vectorized batches
+    of `batch_size` layouts, each with its own seed, derived from `seed`
+    and the index of the batch.
+
+    Returns the layouts, as a read-only memory map.
+    """
+
+    output_path = Path(output_path)
+    n_balls = len(ball_names)
+    n_pins = len(pin_names)
+    if pin_positions is None:
+        pin_positions = np.empty((0, 2))
+    pin_positions = np.asarray(pin_positions, dtype=np.float64).reshape(-1, 2)
+
+    # Balls can't get closer to a pin than the sum of their radii
+    exclusion_zones = np.column_stack([
+        pin_positions,
+        np.full(len(pin_positions), pin_radius + ball_diameter / 2)
+    ])
+
+    layouts = np.lib.format.open_memmap(
+        output_path,
+        mode='w+',
+        dtype=make_layout_dtype(n_balls, n_pins),
+        shape=(n_layouts,)
+    )
+
+    for batch_index, start in enumerate(range(0, n_layouts, batch_size)):
+        end = min(start + batch_size, n_layouts)
+        batch_seed = shu.derive_seed(seed, batch_index)
+        rng = np.random.default_rng(batch_seed)
+
+        batch = layouts[start:end]
+        batch['seed'] = batch_seed
+        batch['ball_positions'] = _sample_non_overlapping_positions(
+            rng,
+            end - start,
+            n_balls,
+            limits,
+            ball_diameter,
+            exclusion_zones
+        )
+        batch['ball_rotations'] = rng.uniform(
+            0,
+            2 * np.pi,
+            size=(end - start, n_balls, 3)
+        )
+        batch['pins_up'] = rng.random((end - start, n_pins)) >= pin_down_probability
+
+    layouts.flush()
+    del layouts
+
+    with open(output_path.with_suffix('.json'), 'w') as file_pointer:
+        json.dump({
+            'n_layouts': n_layouts,
+            'ball_names': list(ball_names),
+            'pin_names': list(pin_names),
+            'limits': {key: float(value) for key, value in limits.items()},
+            'pin_positions': pin_positions.tolist(),
+            'pin_radius': pin_radius,
+            'ball_diameter': ball_diameter,
+            'pin_down_probability': pin_down_probability,
+            'seed': seed,
+            'batch_size': batch_size
+        }, file_pointer, indent=4)
+
+    return load_layouts(output_path)[0]
+
+
+def load_layouts(layouts_path):
+    """
+    Load a pool of layouts as a read-only memory map, so that any layout
+    can be accessed by index without reading the whole file. Returns
+    the layouts and the parameters used to generate them.
+    """
+
+    layouts_path = Path(layouts_path)
+    layouts = np.load(layouts_path, mmap_mode='r')
+    with open(layouts_path.with_suffix('.json')) as file_pointer:
+        parameters = json.load(file_pointer)
+
+    return layouts, parameters
+
+
+def deduplicate_layouts(layouts, resolution=0.01):
+    """
+    Get the indices of the layouts that are unique once ball positions
+    are rounded to a grid of `resolution` meters (and pin states are
+    taken into account). Only the first layout of each group of
+    duplicates is kept. Balls are not interchangeable, i.e. swapping two
+    balls gives a different layout.
+    """
+
+    keys = np.concatenate([
+        np.round(
+            layouts['ball_positions'] / resolution
+        ).astype(np.int32).reshape(len(layouts), -1),
+        layouts['pins_up'].reshape(len(layouts), -1).astype(np.int32)
+    ], axis=1)
+
+    _, unique_indices = np.unique(keys, axis=0, return_index=True)
+
+    return np.sort(unique_indices)
+
+
+def select_stratified(strata, n_per_stratum, seed=0):
+    """
+    Given the stratum of each layout (e.g. the number of pins that are
+    down, or the number of balls in some region of the table), randomly
+    select up to `n_per_stratum` layouts from each stratum. Returns the
+    sorted indices of the selected layouts.
+    """
+
+    rng = np.random.default_rng(seed)
+    strata = np.asarray(strata)
+
+    selected = []
+    for stratum in np.unique(strata):
+        indices = np.flatnonzero(strata == stratum)
+        selected.append(rng.choice(
+            indices,
+            size=min(n_per_stratum, len(indices)),
+            replace=False
+        ))
+
+    return np.sort(np.concatenate(selected))
@@ -13,4 +13,31 @@ def fisheye_equisolid(f, theta):
     return 2.0 * f * np.sin(theta / 2)
 
 def fisheye_orthogonal(f, theta):
-    return f * np.sin(theta)
\ No newline at end of file
+    return f * np.sin(theta)
+
+# Inverse projections, i.e. functions that take the focal length, `f`, 
+# and the distance of a point from the center of the image, `r`, and 
+# return the angle `theta` that the point forms with the optical axis
+
+def rectilinear_inverse(f, r):
+    return np.arctan(r / f)
+
+def fisheye_stereographic_inverse(f, r):
+    return 2.0 * np.arctan(r / (2.0 * f))
+
+def fisheye_equidistant_inverse(f, r):
+    return r / f
+
+def fisheye_equisolid_inverse(f, r):
+    return 2.0 * np.arcsin(np.clip(r / (2.0 * f), -1.0, 1.0))
+
+def fisheye_orthogonal_inverse(f, r):
+    return np.arcsin(np.clip(r / f, -1.0, 1.0))
+
+inverses = {
+    rectilinear: rectilinear_inverse,
+    fisheye_stereographic: fisheye_stereographic_inverse,
+    fisheye_equidistant: fisheye_equidistant_inverse,
+    fisheye_equisolid: fisheye_equisolid_inverse,
+    fisheye_orthogonal: fisheye_orthogonal_inverse
+}
@@ -0,0 +1,58 @@
+"""
+Merge the COCO JSON Lines files written with `--annotation-format coco`
+(e.g. by the workers of a sharded job) into a single COCO JSON file. 
+Usage:
+
+    python3 merge_coco.py -i ../dataset/shard_*/annotations/coco.jsonl \
+        -p -o ../dataset/coco.json
+
+See `coco_utils.write_coco_dataset` for how duplicates are handled.
+"""
+
+from pathlib import Path
+import argparse
+import sys
+
+scripts_folder = Path(__file__).parent
+sys.path.insert(0, str(scripts_folder))
+import coco_utils as cocu
+
+this_script_name = Path(__file__).stem
+parser = argparse.ArgumentParser(this_script_name)
+parser.add_argument(
+    '-i', '--input-paths',
+    nargs='+',
+    required=True,
+    help='COCO JSON Lines files, or directories containing a '
+         f'`{cocu.COCO_LINES_FILENAME}` file'
+)
+parser.add_argument(
+    '-o', '--output-path',
+    required=True
+)
+parser.add_argument(
+    '-p', '--prefix-with-dir',
+    action='store_true',
+    default=False,
+    help='prepend to image file names the directory the annotations of '
+         'each input belong to (i.e. the shard directory, for '
+         '`<shard dir>/annotations/coco.jsonl`)'
+)
+args = parser.parse_args()
+
+input_paths = [
+    path / cocu.COCO_LINES_FILENAME if path.is_dir() else path
+    for path in map(Path, args.input_paths)
+]
+
+if args.prefix_with_dir:
+    file_name_prefixes = [f'{path.parent.parent.name}/' for path in input_paths]
+else:
+    file_name_prefixes = None
+
+n_images, n_annotations = cocu.write_coco_dataset(
+    input_paths,
+    args.output_path,
+    file_name_prefixes
+)
+print(f'Wrote {n_images} images and {n_annotations} annotations to {args.output_path}')
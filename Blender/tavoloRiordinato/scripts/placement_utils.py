@@ -0,0 +1,258 @@
+"""
+Place balls on the table so that they don't overlap each other or the
+pins, without running any physics simulation.
+
+Positions are kept at least `min_distance` apart with a grid hash whose
+cells are small enough to contain at most one position each, so that
+checking a candidate position against all those accepted so far takes
+constant time. How candidates are generated depends on the
+distribution:
+    - 'bridson': Bridson's algorithm. A list of active balls is kept,
+      starting from one placed uniformly at random; candidates are
+      drawn in the annulus between `min_distance` and twice that around
+      a random active ball, which is retired once `n_candidates` of
+      them in a row have been rejected. This gives tightly packed
+      groups, and the work done is bounded by `n_candidates` per ball,
+      however dense the layout. When no ball is active any more (e.g.
+      when a group is walled in by pins), a new group is started from a
+      ball placed uniformly at random.
+    - 'uniform': dart throwing, i.e. candidates drawn anywhere within
+      the limits, and rejected if they are too close to any accepted
+      position.
+    - 'clustered': dart throwing as well, with candidates drawn around
+      a few randomly chosen cluster centers.
+Dart throwing (including the first ball of each Bridson group) can't
+tell when there's no room left, so it gives up after a fixed number of
+attempts per ball: in dense layouts this can fail even though the balls
+would fit.
+
+Limits are given as a dict with keys 'x_min', 'x_max', 'y_min' and
+'y_max' (the same format as `scramble_utils.get_ball_limits`). Neither
+`bpy` nor `mathutils` are needed.
+"""
+
+import numpy as np
+
+BALL_DIAMETER = 0.059  # m
+
+distributions = ['uniform', 'clustered', 'bridson']
+
+
+def _make_candidate_sampler(
+    distribution,
+    limits,
+    rng,
+    n_clusters=3,
+    cluster_std=0.1
+):
+    """
+    Return a function that takes no arguments and returns a new
+    candidate position for dart throwing, according to `distribution`.
+    """
+
+    low = np.array([limits['x_min'], limits['y_min']])
+    high = np.array([limits['x_max'], limits['y_max']])
+
+    def sample_uniform():
+        return rng.uniform(low, high)
+
+    if distribution == 'uniform':
+        return sample_uniform
+
+    if distribution == 'clustered':
+        cluster_centers = rng.uniform(low, high, size=(n_clusters, 2))
+
+        def sample_clustered():
+            center = cluster_centers[rng.integers(n_clusters)]
+            return rng.normal(center, cluster_std)
+
+        return sample_clustered
+
+    raise ValueError(f'Unknown distribution: {distribution}')
+
+
+class _PositionGrid:
+    """
+    The positions accepted so far, hashed into a grid whose cells can
+    contain at most one position each, so that all positions closer than
+    `min_distance` to a given one are within 2 cells from it.
+    """
+
+    def __init__(self, limits, min_distance, exclusion_zones):
+
+        self.limits = limits
+        self.min_distance = min_distance
+        self.exclusion_zones = exclusion_zones
+
+        self.cell_size = min_distance / np.sqrt(2)
+        self.origin = np.array([limits['x_min'], limits['y_min']])
+        self.grid = np.full((
+            int(np.ceil((limits['x_max'] - limits['x_min']) / self.cell_size)) + 1,
+            int(np.ceil((limits['y_max'] - limits['y_min']) / self.cell_size)) + 1
+        ), -1, dtype=np.int64)
+        self.points = []
+
+    def fits(self, candidate):
+        """
+        Check whether `candidate` is within the limits, outside all
+        exclusion zones and far enough from all accepted positions.
+        """
+
+        x, y = candidate
+        if not (self.limits['x_min'] <= x <= self.limits['x_max'] and
+                self.limits['y_min'] <= y <= self.limits['y_max']):
+            return False
+
+        # Check the exclusion zones
+        if len(self.exclusion_zones) and np.any(
+            np.hypot(
+                self.exclusion_zones[:, 0] - x,
+                self.exclusion_zones[:, 1] - y
+            ) < self.exclusion_zones[:, 2]
+        ):
+            return False
+
+        # Check the points in neighbouring cells
+        i, j = ((candidate - self.origin) // self.cell_size).astype(int)
+        neighbours = self.grid[
+            max(i - 2, 0):i + 3,
+            max(j - 2, 0):j + 3
+        ]
+        neighbours = neighbours[neighbours >= 0]
+        if len(neighbours) and np.any(
+            np.linalg.norm(np.asarray(self.points)[neighbours] - candidate, axis=1)
+            < self.min_distance
+        ):
+            return False
+
+        return True
+
+    def add(self, candidate):
+        """
+        Accept `candidate`, which must fit (see `fits`). Returns its
+        index in `points`.
+        """
+
+        i, j = ((candidate - self.origin) // self.cell_size).astype(int)
+        self.grid[i, j] = len(self.points)
+        self.points.append(candidate)
+
+        return len(self.points) - 1
+
+
+def _throw_darts(grid, n_points, sample_candidate, max_attempts):
+    """
+    Add positions drawn with `sample_candidate` to `grid` until it holds
+    `n_points` of them, or until `max_attempts` candidates have been
+    drawn.
+    """
+
+    for _ in range(max_attempts):
+        if len(grid.points) == n_points:
+            break
+
+        candidate = sample_candidate()
+        if grid.fits(candidate):
+            grid.add(candidate)
+
+
+def _sample_bridson(grid, n_points, limits, rng, max_attempts_per_point, n_candidates=30):
+    """
+    Add positions to `grid` with Bridson's algorithm (see the module
+    docstring) until it holds `n_points` of them, or until a new group
+    can't be started.
+    """
+
+    sample_uniform = _make_candidate_sampler('uniform', limits, rng)
+
+    active = []
+    while len(grid.points) < n_points:
+
+        if not active:
+            n_before = len(grid.points)
+            _throw_darts(grid, n_before + 1, sample_uniform, max_attempts_per_point)
+            if len(grid.points) == n_before:
+                return
+            active.append(n_before)
+            continue
+
+        k = rng.integers(len(active))
+        anchor = grid.points[active[k]]
+        radii = rng.uniform(grid.min_distance, 2 * grid.min_distance, n_candidates)
+        angles = rng.uniform(0, 2 * np.pi, n_candidates)
+        candidates = anchor + radii[:, None] * np.column_stack([np.cos(angles), np.sin(angles)])
+
+        for candidate in candidates:
+            if grid.fits(candidate):
+                active.append(grid.add(candidate))
+                break
+        else:
+            # No room left around this ball
+            active[k] = active[-1]
+            active.pop()
+
+
+def sample_positions(
+    n_points,
+    limits,
+    min_distance=BALL_DIAMETER,
+    exclusion_zones=None,
+    distribution='uniform',
+    rng=None,
+    max_attempts_per_point=1000,
+    **distribution_parameters
+):
+    """
+    Sample `n_points` 2D positions within `limits`, at least
+    `min_distance` away from each other and outside all
+    `exclusion_zones`, given as an (M, 3) array of (x, y, radius) rows.
+    See the module docstring for the available distributions; any
+    keyword argument is passed on to the chosen distribution (e.g.
+    `n_clusters` and `cluster_std` for 'clustered', `n_candidates` for
+    'bridson').
+
+    Returns an (n_points, 2) array. Raises a `ValueError` if the points
+    don't fit, i.e. if dart throwing has drawn
+    `max_attempts_per_point * n_points` candidates without placing all
+    of them or, for 'bridson', if there's no room around any placed ball
+    and `max_attempts_per_point` candidates for the first ball of a new
+    group have been rejected.
+    """
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    if exclusion_zones is None:
+        exclusion_zones = np.empty((0, 3))
+    exclusion_zones = np.asarray(exclusion_zones, dtype=np.float64).reshape(-1, 3)
+
+    grid = _PositionGrid(limits, min_distance, exclusion_zones)
+
+    if distribution == 'bridson':
+        _sample_bridson(
+            grid,
+            n_points,
+            limits,
+            rng,
+            max_attempts_per_point,
+            **distribution_parameters
+        )
+    else:
+        _throw_darts(
+            grid,
+            n_points,
+            _make_candidate_sampler(
+                distribution,
+                limits,
+                rng,
+                **distribution_parameters
+            ),
+            max_attempts_per_point * n_points
+        )
+
+    if len(grid.points) < n_points:
+        raise ValueError(
+            f'Could only place {len(grid.points)} out of {n_points} points'
+        )
+
+    return np.array(grid.points).reshape(-1, 2)
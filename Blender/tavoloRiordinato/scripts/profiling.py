@@ -0,0 +1,340 @@
+"""
+Per-stage profiling of the labelling pipeline.
+
+The pipeline is instrumented with the module-level `profiler`, which
+does nothing until it is enabled (see `Profiler.enable`), so stages can
+be timed unconditionally on the hot path:
+
+    with prof.profiler.stage('render'):
+        render(scene, render_output_path)
+        prof.profiler.count(pixels=render_width * render_height)
+
+For each frame (delimited by `start_frame` and `end_frame`), every stage
+gets its wall-clock time, the number of times it was entered, the counts
+of items it processed (objects, vertices, pixels, ...) and, if memory
+tracing is on, the peak memory allocated while it ran (as measured by
+`tracemalloc`, which slows Python code down noticeably, hence off by
+default). The maximum resident set size of the process is recorded for
+each frame regardless. Frame records are appended to a JSON Lines log
+and aggregated into a report at the end of the run; logs of several runs
+(e.g. shards) can be aggregated again with
+
+    python profiling.py <log> [<log> ...]
+
+Neither `bpy` nor `mathutils` are needed.
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+import argparse
+import json
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+def get_max_rss_mb():
+    """
+    Get the maximum resident set size of the process so far, in MB (or
+    None where it can't be measured).
+    """
+
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS bytes
+    if max_rss > 2**40:
+        return max_rss / 2**20
+    return max_rss / 2**10
+
+
+class Profiler:
+    """
+    Collect per-stage timings, counts and peak memory for each frame
+    (see the module docstring).
+    """
+
+    def __init__(self):
+
+        self.enabled = False
+        self.log_path = None
+        self.trace_memory = False
+        self.frame_records = []
+        self._frame = None
+        self._frame_start_time = None
+        self._stack = []
+
+    def enable(self, log_path=None, trace_memory=False):
+        """
+        Start profiling. Frame records are appended to `log_path`, if
+        given, as soon as each frame ends.
+        """
+
+        self.enabled = True
+        self.log_path = Path(log_path) if log_path is not None else None
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.log_path is not None:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def start_frame(self, frame_id):
+
+        if not self.enabled:
+            return
+
+        self._frame = {'frame_id': frame_id, 'stages': {}, 'counts': {}}
+        self._frame_start_time = time.perf_counter()
+
+    def _is_profiling(self):
+
+        return (
+            self.enabled and
+            self._frame is not None and
+            threading.current_thread() is threading.main_thread()
+        )
+
+    def _get_stage_record(self, name):
+
+        stages = self._frame['stages']
+        if name not in stages:
+            stages[name] = {'time': 0.0, 'calls': 0, 'counts': {}}
+            if self.trace_memory:
+                stages[name]['peak_memory_mb'] = 0.0
+
+        return stages[name]
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the code run within this context as stage `name` of the
+        current frame. Stages can be nested, and entering the same stage
+        several times in a frame adds up its time. Only the main thread
+        is profiled (e.g. not the jobs of `background_writer`).
+        """
+
+        if not self._is_profiling():
+            yield
+            return
+
+        if self.trace_memory:
+            # The peak reached so far belongs to the enclosing stage
+            if self._stack:
+                self._stack[-1]['peak'] = max(
+                    self._stack[-1]['peak'],
+                    tracemalloc.get_traced_memory()[1]
+                )
+            tracemalloc.reset_peak()
+
+        entry = {'name': name, 'peak': 0}
+        self._stack.append(entry)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_time = time.perf_counter() - start_time
+            self._stack.pop()
+
+            record = self._get_stage_record(name)
+            record['time'] += elapsed_time
+            record['calls'] += 1
+
+            if self.trace_memory:
+                peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+                record['peak_memory_mb'] = max(
+                    record['peak_memory_mb'],
+                    peak / 2**20
+                )
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+
+    def count(self, **counts):
+        """
+        Add counts of processed items (e.g. `vertices=5000`) to the
+        innermost stage being run, or to the frame if there is none.
+        """
+
+        if not self._is_profiling():
+            return
+
+        if self._stack:
+            target = self._get_stage_record(self._stack[-1]['name'])['counts']
+        else:
+            target = self._frame['counts']
+        for key, value in counts.items():
+            target[key] = target.get(key, 0) + int(value)
+
+    def end_frame(self):
+        """
+        Close the current frame, append its record to the log and
+        return it.
+        """
+
+        if not self.enabled or self._frame is None:
+            return None
+
+        record = self._frame
+        record['time'] = time.perf_counter() - self._frame_start_time
+        record['max_rss_mb'] = get_max_rss_mb()
+        self.frame_records.append(record)
+        self._frame = None
+
+        if self.log_path is not None:
+            with open(self.log_path, 'a') as log_file:
+                log_file.write(json.dumps(record) + '\n')
+
+        return record
+
+    def get_report(self):
+        """
+        Aggregate the records of the frames profiled so far (see
+        `aggregate_frame_records`).
+        """
+
+        return aggregate_frame_records(self.frame_records)
+
+    def print_report(self):
+
+        if self.enabled and self.frame_records:
+            print(format_report(self.get_report()))
+
+
+def aggregate_frame_records(frame_records):
+    """
+    Aggregate frame records (as written to profiling logs) into a dict
+    with the number of frames, the mean and total frame time, the
+    maximum resident set size and, for each stage, the total, mean,
+    median, 95th percentile and maximum time per frame, its share of the
+    total time, the maximum peak memory and the total counts.
+    """
+
+    frame_times = np.array([record['time'] for record in frame_records])
+    total_time = float(frame_times.sum())
+    max_rss = [
+        record['max_rss_mb'] for record in frame_records
+        if record.get('max_rss_mb') is not None
+    ]
+
+    stage_names = []
+    for record in frame_records:
+        for name in record['stages']:
+            if name not in stage_names:
+                stage_names.append(name)
+
+    stages = {}
+    for name in stage_names:
+        records = [
+            record['stages'][name] for record in frame_records
+            if name in record['stages']
+        ]
+        times = np.array([record['time'] for record in records])
+        counts = {}
+        for record in records:
+            for key, value in record['counts'].items():
+                counts[key] = counts.get(key, 0) + value
+        peaks = [
+            record['peak_memory_mb'] for record in records
+            if 'peak_memory_mb' in record
+        ]
+
+        stages[name] = {
+            'frames': len(records),
+            'calls': sum(record['calls'] for record in records),
+            'total_time': float(times.sum()),
+            'mean_time': float(times.mean()),
+            'median_time': float(np.median(times)),
+            'p95_time': float(np.percentile(times, 95)),
+            'max_time': float(times.max()),
+            'share': float(times.sum() / total_time) if total_time > 0 else 0.0,
+            'peak_memory_mb': max(peaks) if peaks else None,
+            'counts': counts
+        }
+
+    return {
+        'frames': len(frame_records),
+        'total_time': total_time,
+        'mean_frame_time': float(frame_times.mean()) if len(frame_times) else 0.0,
+        'max_rss_mb': max(max_rss) if max_rss else None,
+        'stages': stages
+    }
+
+
+def format_report(report):
+    """
+    Format a report (see `aggregate_frame_records`) as a table, with
+    times in milliseconds.
+    """
+
+    lines = [
+        f'{report["frames"]} frames, {report["total_time"]:.1f} s '
+        f'({report["mean_frame_time"] * 1000:.1f} ms/frame)',
+        f'{"stage":<20}{"mean":>10}{"median":>10}{"p95":>10}{"max":>10}'
+        f'{"share":>8}{"peak MB":>10}  counts/frame'
+    ]
+    for name, stage in report['stages'].items():
+        peak = stage['peak_memory_mb']
+        counts = ', '.join(
+            f'{key}={value / stage["frames"]:.0f}'
+            for key, value in stage['counts'].items()
+        )
+        lines.append(
+            f'{name:<20}'
+            f'{stage["mean_time"] * 1000:>10.1f}'
+            f'{stage["median_time"] * 1000:>10.1f}'
+            f'{stage["p95_time"] * 1000:>10.1f}'
+            f'{stage["max_time"] * 1000:>10.1f}'
+            f'{stage["share"] * 100:>7.1f}%'
+            f'{peak if peak is not None else float("nan"):>10.1f}'
+            f'  {counts}'
+        )
+    if report['max_rss_mb'] is not None:
+        lines.append(f'max RSS: {report["max_rss_mb"]:.0f} MB')
+
+    return '\n'.join(lines)
+
+
+def read_frame_records(log_paths):
+
+    frame_records = []
+    for log_path in log_paths:
+        with open(log_path) as log_file:
+            for line in log_file:
+                if line.strip():
+                    frame_records.append(json.loads(line))
+
+    return frame_records
+
+
+# Used to instrument the pipeline, see the module docstring
+profiler = Profiler()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(Path(__file__).stem)
+    parser.add_argument(
+        'log_paths',
+        nargs='+',
+        metavar='log_path'
+    )
+    parser.add_argument(
+        '-o', '--output-path',
+        default=None,
+        help='save the aggregated report as JSON too'
+    )
+    args = parser.parse_args()
+
+    report = aggregate_frame_records(read_frame_records(args.log_paths))
+    print(format_report(report))
+    if args.output_path is not None:
+        with open(args.output_path, 'w') as output_file:
+            json.dump(report, output_file, indent=4)
@@ -0,0 +1,212 @@
+"""
+Domain randomization of the scene (lights, cloth, table, cushions,
+walls, camera, ...) for each sample, driven by a JSON config.
+
+The config maps parameter names to what they change and how their
+values are drawn, e.g.:
+
+    {
+        "lamp_energy": {
+            "data_block": "lights", "name": "Lampada",
+            "property": "energy",
+            "distribution": "uniform", "min": 200, "max": 800
+        },
+        "lamp_off": {
+            "data_block": "objects", "name": "Lampada",
+            "property": "hide_render",
+            "distribution": "bernoulli", "p": 0.2
+        },
+        "cloth_color": {
+            "data_block": "materials", "name": "Panno",
+            "node": "Principled BSDF", "input": "Base Color",
+            "distribution": "hsv",
+            "h": [0.28, 0.4], "s": [0.6, 0.9], "v": [0.2, 0.5]
+        },
+        "camera_location": {
+            "data_block": "objects", "name": "Camera_sinistra",
+            "property": "location", "relative": true,
+            "distribution": "normal", "mean": [0, 0, 0],
+            "std": [0.02, 0.02, 0.01]
+        }
+    }
+
+Each parameter targets either a property of a data-block (`property`,
+which can be a dotted path such as "data.energy"), or the default value
+of an input of a node in its node tree (`node` and `input`). Values are
+drawn from one of `distributions`; with `relative`, they are added to
+the value the property had in the original scene.
+
+Values are written directly to the data-blocks, without operators, and
+only if they differ from the current ones: parameters that don't change
+leave the scene untouched, so Cycles can reuse what it has already
+built (e.g. shaders are only recompiled if a material has changed, and
+the BVH only if an object has moved).
+"""
+
+import colorsys
+import json
+
+import numpy as np
+import bpy
+
+distributions = ['uniform', 'normal', 'choice', 'bernoulli', 'hsv']
+
+
+def load_config(config_path):
+
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+
+    for name, parameter in config.items():
+        if parameter.get('distribution') not in distributions:
+            raise ValueError(
+                f'Unknown distribution for parameter {name}: '
+                f'{parameter.get("distribution")}'
+            )
+
+    return config
+
+
+def sample_value(parameter, rng=np.random):
+    """
+    Draw a value for a parameter of the config (see the module
+    docstring), with `rng` (either `np.random` or a NumPy `Generator`).
+    Returns a scalar or a list, ready to be logged as JSON.
+    """
+
+    distribution = parameter['distribution']
+
+    if distribution == 'uniform':
+        value = rng.uniform(parameter['min'], parameter['max'])
+    elif distribution == 'normal':
+        value = rng.normal(parameter['mean'], parameter['std'])
+    elif distribution == 'choice':
+        values = parameter['values']
+        weights = parameter.get('weights')
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64) / np.sum(weights)
+        return values[int(rng.choice(len(values), p=weights))]
+    elif distribution == 'bernoulli':
+        return bool(rng.uniform() < parameter['p'])
+    elif distribution == 'hsv':
+        hsv = [rng.uniform(*parameter[channel]) for channel in 'hsv']
+        value = [*colorsys.hsv_to_rgb(*hsv), parameter.get('alpha', 1.0)]
+    else:
+        raise ValueError(f'Unknown distribution: {distribution}')
+
+    return np.asarray(value).tolist()
+
+
+def _get_owner_and_attribute(parameter):
+    """
+    Get the object holding the property targeted by a parameter, and the
+    name of that property.
+    """
+
+    data_block = getattr(bpy.data, parameter['data_block'])[parameter['name']]
+
+    if 'node' in parameter:
+        node = data_block.node_tree.nodes[parameter['node']]
+        return node.inputs[parameter['input']], 'default_value'
+
+    *path, attribute = parameter['property'].split('.')
+    owner = data_block
+    for name in path:
+        owner = getattr(owner, name)
+
+    return owner, attribute
+
+
+def _to_plain_value(value):
+
+    if isinstance(value, (bool, int, float, str)):
+        return value
+
+    return list(value)
+
+
+def _values_equal(first, second):
+
+    if isinstance(first, (bool, str)) or isinstance(second, (bool, str)):
+        return first == second
+
+    return np.allclose(first, second, rtol=0, atol=1e-7)
+
+
+class Randomizer:
+    """
+    Apply the parameters of a randomization config (see the module
+    docstring) to the scene. The original values of the properties are
+    read when the randomizer is created, so that relative parameters
+    don't drift and the scene can be restored with `restore`.
+    """
+
+    def __init__(self, config):
+
+        self.config = config
+        self.original_values = {}
+        for name, parameter in config.items():
+            owner, attribute = _get_owner_and_attribute(parameter)
+            self.original_values[name] = _to_plain_value(getattr(owner, attribute))
+
+    def _write(self, parameters_and_values):
+        """
+        Write values to the properties of the given parameters, skipping
+        those that already have them. Returns the names of the
+        parameters that have been written.
+        """
+
+        written = []
+        moved_objects = False
+        for name, value in parameters_and_values:
+            parameter = self.config[name]
+            owner, attribute = _get_owner_and_attribute(parameter)
+            if _values_equal(_to_plain_value(getattr(owner, attribute)), value):
+                continue
+
+            setattr(owner, attribute, value)
+            written.append(name)
+            if parameter['data_block'] == 'objects' and 'node' not in parameter:
+                moved_objects = True
+
+        # World matrices (e.g. of the camera, which is needed for
+        # annotations) are only updated by a depsgraph evaluation
+        if moved_objects:
+            bpy.context.view_layer.update()
+
+        return written
+
+    def sample(self, rng=np.random):
+        """
+        Draw a value for each parameter (see `sample_value`). Returns a
+        dict mapping parameter names to values, meant to be logged and
+        passed to `apply`.
+        """
+
+        values = {}
+        for name, parameter in self.config.items():
+            value = sample_value(parameter, rng)
+            original_value = self.original_values[name]
+            if parameter.get('relative', False):
+                value = (np.asarray(original_value) + value).tolist()
+            if isinstance(original_value, int) and not isinstance(original_value, bool):
+                # Integer properties don't accept floats
+                value = int(round(value))
+            values[name] = value
+
+        return values
+
+    def apply(self, values):
+        """
+        Apply sampled values (see `sample`) to the scene. Returns the
+        names of the parameters whose properties have actually changed.
+        """
+
+        return self._write(values.items())
+
+    def restore(self):
+        """
+        Give all the properties back their original values.
+        """
+
+        return self._write(self.original_values.items())
@@ -0,0 +1,296 @@
+"""
+A software rasterizer that computes the object index pass (i.e. the
+pass index of the object visible at each pixel) of triangle meshes,
+without rendering anything with Cycles.
+
+Vertices are projected with the same camera model used for annotations
+(see `coordinates_utils.camera_space_to_camera_view_with_projection_batch`),
+fisheye projections included, and triangles are then filled in image
+space, which is accurate as long as triangles are small compared to the
+distortion of the lens (as they are for the balls and pins). All the
+triangles are rasterized at once, in chunks: triangles outside the image
+are culled, each of the others is expanded into the pixels of its 
+bounding box, pixels whose centers fall inside the triangle are kept, 
+and a z-buffer (on the distance from the camera) keeps the closest 
+triangle at each pixel. Neither `bpy` nor `mathutils` are needed.
+"""
+
+import numpy as np
+
+import coordinates_utils as cu
+import index_buffer_utils as ibu
+
+
+def make_mesh(vertices, triangles, matrix_world, pass_index):
+    """
+    Describe a mesh to rasterize: (N, 3) vertex coordinates in object
+    space, (M, 3) vertex indices of its triangles, the 4x4 world matrix
+    of the object and its pass index.
+    """
+
+    return {
+        'vertices': np.asarray(vertices, dtype=np.float64).reshape(-1, 3),
+        'triangles': np.asarray(triangles, dtype=np.int64).reshape(-1, 3),
+        'matrix_world': np.asarray(matrix_world, dtype=np.float64),
+        'pass_index': int(pass_index)
+    }
+
+
+def _project_meshes(
+    meshes,
+    camera_sensor_width,
+    camera_sensor_height,
+    lens_focal_length,
+    camera_matrix_world,
+    render_width,
+    render_height,
+    projection
+):
+    """
+    Project the triangles of all meshes at once. Returns (T, 3, 2)
+    continuous image coordinates (in Blender format, in pixels, where
+    the center of pixel (x, y) is at (x + 0.5, y + 0.5)), (T, 3)
+    distances from the camera and (T,) pass indices. Triangles with any
+    vertex behind the camera are dropped.
+    """
+
+    world_to_camera_matrix = np.linalg.inv(
+        np.asarray(camera_matrix_world, dtype=np.float64)
+    )
+
+    # Go straight from object space to camera space, with one matrix per
+    # mesh, and project the vertices of all meshes in one go
+    camera_coords = []
+    triangles = []
+    triangle_pass_indices = []
+    n_vertices = 0
+    for mesh in meshes:
+        if len(mesh['triangles']) == 0:
+            continue
+
+        camera_coords.append(cu.transform_points(
+            world_to_camera_matrix @ mesh['matrix_world'],
+            mesh['vertices']
+        ))
+        triangles.append(mesh['triangles'] + n_vertices)
+        triangle_pass_indices.append(
+            np.full(len(mesh['triangles']), mesh['pass_index'], dtype=np.int64)
+        )
+        n_vertices += len(mesh['vertices'])
+
+    if not triangles:
+        return np.empty((0, 3, 2)), np.empty((0, 3)), np.empty(0, dtype=np.int64)
+
+    camera_coords = np.concatenate(camera_coords)
+    triangles = np.concatenate(triangles)
+    triangle_pass_indices = np.concatenate(triangle_pass_indices)
+
+    # Cameras look towards the negative z-axis
+    in_front = np.all(camera_coords[triangles, 2] < 0, axis=1)
+    triangles = triangles[in_front]
+    triangle_pass_indices = triangle_pass_indices[in_front]
+
+    camera_view_coords = cu.camera_space_to_camera_view_with_projection_batch(
+        camera_sensor_width,
+        camera_sensor_height,
+        lens_focal_length,
+        camera_coords,
+        projection
+    )
+    image_coords = camera_view_coords * [render_width, render_height]
+    depths = np.linalg.norm(camera_coords, axis=1)
+
+    return image_coords[triangles], depths[triangles], triangle_pass_indices
+
+
+def _get_pixel_bounds(triangle_coords, render_width, render_height):
+    """
+    Get the bounding boxes of the pixels whose centers may fall inside
+    each projected triangle, clipped to the image, as (T, 2) minimum
+    pixel coordinates and (T, 2) sizes (zero for triangles that are
+    outside the image or that don't cover any pixel center).
+    """
+
+    a = triangle_coords[:, 0]
+    b = triangle_coords[:, 1]
+    c = triangle_coords[:, 2]
+    min_coords = np.floor(np.minimum(np.minimum(a, b), c) - 0.5).astype(np.int64) + 1
+    max_coords = np.ceil(np.maximum(np.maximum(a, b), c) - 0.5).astype(np.int64) - 1
+    min_coords = np.maximum(min_coords, 0)
+    max_coords = np.minimum(max_coords, [render_width - 1, render_height - 1])
+    sizes = np.maximum(max_coords - min_coords + 1, 0)
+
+    return min_coords, sizes
+
+
+def _rasterize_triangles(
+    triangle_coords,
+    triangle_depths,
+    triangle_pass_indices,
+    min_coords,
+    sizes,
+    index_buffer,
+    depth_buffer
+):
+    """
+    Rasterize a chunk of projected triangles (see `_project_meshes`),
+    given the bounds of their pixels (see `_get_pixel_bounds`), into the
+    given buffers (in Blender format, i.e. row 0 is the bottom row of 
+    the image), which are modified in place.
+    """
+
+    render_height, render_width = index_buffer.shape
+    n_pixels = sizes[:, 0] * sizes[:, 1]
+
+    a = triangle_coords[:, 0]
+    b = triangle_coords[:, 1]
+    c = triangle_coords[:, 2]
+    area = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+
+    keep = area != 0
+    if not np.any(keep):
+        return
+    a = a[keep]
+    b = b[keep]
+    c = c[keep]
+    area = area[keep]
+    triangle_depths = triangle_depths[keep]
+    triangle_pass_indices = triangle_pass_indices[keep]
+    min_coords = min_coords[keep]
+    sizes = sizes[keep]
+    n_pixels = n_pixels[keep]
+
+    # The barycentric coordinates of a point (px, py) with respect to
+    # each triangle are affine functions of it, whose coefficients are
+    # computed once per triangle: edges[i, j] holds, for all triangles,
+    # the coefficient of px, py or 1 (for j = 0, 1, 2) in the
+    # coordinate of a, b or c (for i = 0, 1, 2). Dividing by the signed
+    # area makes them all positive inside the triangle, whatever its 
+    # winding
+    edges = np.empty((3, 3, len(area)))
+    for i, (q, r) in enumerate([(b, c), (c, a), (a, b)]):
+        edges[i, 0] = q[:, 1] - r[:, 1]
+        edges[i, 1] = r[:, 0] - q[:, 0]
+        edges[i, 2] = q[:, 0] * r[:, 1] - q[:, 1] * r[:, 0]
+    edges /= area
+
+    # The distance from the camera is interpolated linearly as well
+    depth_planes = np.einsum('ti,ijt->jt', triangle_depths, edges)
+
+    # Expand each triangle into the pixels of its bounding box
+    triangle_ids = np.repeat(np.arange(len(n_pixels)), n_pixels)
+    starts = np.cumsum(n_pixels) - n_pixels
+    local_ids = np.arange(n_pixels.sum()) - np.repeat(starts, n_pixels)
+    widths = sizes[:, 0][triangle_ids]
+    y_offsets = local_ids // widths
+    x = min_coords[:, 0][triangle_ids] + local_ids - y_offsets * widths
+    y = min_coords[:, 1][triangle_ids] + y_offsets
+
+    # Keep the pixels whose centers are inside their triangle, one edge
+    # at a time, so that later edges are tested on fewer pixels
+    px = x + 0.5
+    py = y + 0.5
+    for k in range(3):
+        inside = (
+            edges[k, 0][triangle_ids] * px + 
+            edges[k, 1][triangle_ids] * py + 
+            edges[k, 2][triangle_ids]
+        ) >= 0
+        triangle_ids = triangle_ids[inside]
+        px = px[inside]
+        py = py[inside]
+
+    x = px.astype(np.int64)
+    y = py.astype(np.int64)
+    depths = (
+        depth_planes[0][triangle_ids] * px + 
+        depth_planes[1][triangle_ids] * py + 
+        depth_planes[2][triangle_ids]
+    )
+
+    # Z-buffer: keep the closest fragment at each pixel
+    pixel_ids = y * render_width + x
+    flat_depth_buffer = depth_buffer.reshape(-1)
+    np.minimum.at(flat_depth_buffer, pixel_ids, depths)
+    closest = depths == flat_depth_buffer[pixel_ids]
+    index_buffer.reshape(-1)[pixel_ids[closest]] = triangle_pass_indices[triangle_ids[closest]]
+
+
+def rasterize_index_buffer(
+    meshes,
+    camera_sensor_width,
+    camera_sensor_height,
+    lens_focal_length,
+    camera_matrix_world,
+    render_width,
+    render_height,
+    projection=lambda f, theta: f * np.tan(theta),
+    background_pass_index=ibu.BACKGROUND_PASS_INDEX,
+    max_pixels_per_chunk=2**22
+):
+    """
+    Compute the object index pass of the given meshes (see `make_mesh`),
+    as seen by the camera. Meshes that occlude the objects of interest
+    without being of interest themselves (e.g. the pins, when labelling
+    the balls) should be given `background_pass_index`.
+
+    Returns a `render_height` x `render_width` array of pass indices in
+    NumPy format (i.e. row 0 is the top row of the image, as for
+    `index_buffer_utils`), and the corresponding distances from the
+    camera (inf for the background).
+    """
+
+    triangle_coords, triangle_depths, triangle_pass_indices = _project_meshes(
+        meshes,
+        camera_sensor_width,
+        camera_sensor_height,
+        lens_focal_length,
+        camera_matrix_world,
+        render_width,
+        render_height,
+        projection
+    )
+
+    index_buffer = np.full(
+        (render_height, render_width),
+        background_pass_index,
+        dtype=np.int64
+    )
+    depth_buffer = np.full((render_height, render_width), np.inf)
+
+    # Cull the triangles that are outside the image, or that are too 
+    # small to cover the center of any pixel, before they are expanded
+    # into pixels
+    min_coords, sizes = _get_pixel_bounds(
+        triangle_coords,
+        render_width,
+        render_height
+    )
+    bbox_sizes = sizes[:, 0] * sizes[:, 1]
+    visible = bbox_sizes > 0
+    triangle_coords = triangle_coords[visible]
+    triangle_depths = triangle_depths[visible]
+    triangle_pass_indices = triangle_pass_indices[visible]
+    min_coords = min_coords[visible]
+    sizes = sizes[visible]
+    bbox_sizes = bbox_sizes[visible]
+
+    # Split triangles into chunks, so that the pixels of their bounding
+    # boxes don't take up too much memory
+    chunk_ids = (np.cumsum(bbox_sizes) // max_pixels_per_chunk).astype(np.int64)
+    chunk_starts = np.flatnonzero(np.r_[True, np.diff(chunk_ids) > 0])
+    chunk_ends = np.r_[chunk_starts[1:], len(triangle_coords)]
+
+    for start, end in zip(chunk_starts, chunk_ends):
+        _rasterize_triangles(
+            triangle_coords[start:end],
+            triangle_depths[start:end],
+            triangle_pass_indices[start:end],
+            min_coords[start:end],
+            sizes[start:end],
+            index_buffer,
+            depth_buffer
+        )
+
+    # Go from Blender format (row 0 at the bottom) to NumPy format
+    return np.flipud(index_buffer), np.flipud(depth_buffer)
@@ -0,0 +1,248 @@
+"""
+Convert images and points between lens projections (e.g. undistort
+renders of a fisheye camera into rectilinear images) with precomputed
+lookup tables.
+
+A remap table tells, for each pixel of an image taken with the target
+projection, where (in fractional pixel coordinates, in NumPy format) the
+same ray falls in an image taken with the source projection, with the
+same sensor and focal length. All the trigonometry is done once, when
+the table is built: converting an image is then a matter of bilinear
+sampling, and converting points a matter of looking them up in the
+inverse table. Tables are cached in memory and, optionally, on disk
+(as .npy files, memory-mapped when loaded), keyed by all the parameters
+they depend on. Neither `bpy` nor `mathutils` are needed.
+"""
+
+from pathlib import Path
+import hashlib
+import os
+import uuid
+
+import numpy as np
+
+import coordinates_utils as cu
+import lens_projections as lp
+
+# Remap tables built or loaded so far, by key (see `_get_table_key`)
+_remap_tables = {}
+
+
+def _get_table_key(
+    camera_sensor_width,
+    camera_sensor_height,
+    lens_focal_length,
+    source_projection,
+    target_projection,
+    render_width,
+    render_height
+):
+    return (
+        float(camera_sensor_width),
+        float(camera_sensor_height),
+        float(lens_focal_length),
+        source_projection.__name__,
+        target_projection.__name__,
+        int(render_width),
+        int(render_height)
+    )
+
+
+def build_remap_table(
+    camera_sensor_width,
+    camera_sensor_height,
+    lens_focal_length,
+    source_projection,
+    target_projection,
+    render_width,
+    render_height
+):
+    """
+    Build a `render_height` x `render_width` x 2 table, with the
+    fractional (row, column) coordinates in an image taken with
+    `source_projection` of the center of each pixel of an image taken
+    with `target_projection` (both functions in `lens_projections`).
+    """
+
+    rows, cols = np.indices((render_height, render_width))
+    pixel_coords = np.column_stack([rows.ravel(), cols.ravel()])
+
+    # Ray through the center of each pixel of the target image
+    rays = cu.pixel_coordinates_to_camera_rays(
+        camera_sensor_width,
+        camera_sensor_height,
+        lens_focal_length,
+        pixel_coords,
+        render_width,
+        render_height,
+        lp.inverses[target_projection]
+    )
+
+    # Where the same rays fall in the source image, in the [0, 1] range
+    camera_view_coords = cu.world_to_camera_view_with_projection_batch(
+        camera_sensor_width,
+        camera_sensor_height,
+        lens_focal_length,
+        np.eye(4),
+        rays,
+        source_projection
+    )
+
+    # Fractional pixel coordinates in NumPy format, where integer values
+    # are at the centers of the pixels
+    table = np.empty((render_height, render_width, 2), dtype=np.float32)
+    table[..., 0] = (
+        render_height - 0.5 - camera_view_coords[:, 1] * render_height
+    ).reshape(render_height, render_width)
+    table[..., 1] = (
+        camera_view_coords[:, 0] * render_width - 0.5
+    ).reshape(render_height, render_width)
+
+    return table
+
+
+def get_remap_table(
+    camera_sensor_width,
+    camera_sensor_height,
+    lens_focal_length,
+    source_projection,
+    target_projection,
+    render_width,
+    render_height,
+    cache_dir=None
+):
+    """
+    Get a remap table (see `build_remap_table`), building it only if it
+    is neither in memory nor, if `cache_dir` is given, on disk. Newly
+    built tables are saved to `cache_dir`.
+    """
+
+    key = _get_table_key(
+        camera_sensor_width,
+        camera_sensor_height,
+        lens_focal_length,
+        source_projection,
+        target_projection,
+        render_width,
+        render_height
+    )
+    if key in _remap_tables:
+        return _remap_tables[key]
+
+    if cache_dir is not None:
+        cache_path = (
+            Path(cache_dir) /
+            f'remap_{hashlib.sha1(repr(key).encode()).hexdigest()}.npy'
+        )
+    else:
+        cache_path = None
+
+    if cache_path is not None and cache_path.exists():
+        table = np.load(cache_path, mmap_mode='r')
+    else:
+        table = build_remap_table(
+            camera_sensor_width,
+            camera_sensor_height,
+            lens_focal_length,
+            source_projection,
+            target_projection,
+            render_width,
+            render_height
+        )
+        if cache_path is not None:
+            # Write to a temporary file first, so that other processes
+            # never load an incomplete table. Its name is unique, since
+            # other processes may be building the same table
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path = cache_path.with_name(
+                f'{cache_path.stem}.{os.getpid()}.{uuid.uuid4().hex}.tmp.npy'
+            )
+            np.save(temporary_path, table)
+            try:
+                temporary_path.replace(cache_path)
+            except OSError:
+                # Another process has just written the same table (e.g. 
+                # on Windows, where it can't be replaced while in use)
+                temporary_path.unlink(missing_ok=True)
+                if not cache_path.exists():
+                    raise
+
+    _remap_tables[key] = table
+
+    return table
+
+
+def sample_bilinear(image, coords, fill_value=0):
+    """
+    Sample `image` (with shape (H, W) or (H, W, C)) at fractional
+    (row, column) coordinates, given as an array of shape (..., 2), with
+    bilinear interpolation. Coordinates out of the image (or NaN) give
+    `fill_value`. Returns an array of shape `coords.shape[:-1]`, plus
+    the channel axis if `image` has one.
+    """
+
+    image = np.asarray(image)
+    height, width = image.shape[:2]
+    rows = np.asarray(coords[..., 0], dtype=np.float32)
+    cols = np.asarray(coords[..., 1], dtype=np.float32)
+
+    # Pixels extend half a pixel around their centers: samples within
+    # that distance from the border take the value of the border
+    valid = (
+        (rows >= -0.5) & (rows <= height - 0.5) &
+        (cols >= -0.5) & (cols <= width - 0.5)
+    )
+    rows = np.clip(np.where(valid, rows, 0), 0, height - 1)
+    cols = np.clip(np.where(valid, cols, 0), 0, width - 1)
+
+    # Top left neighbour of each sample, kept one pixel away from the
+    # bottom and right borders so that all four neighbours exist
+    top = np.minimum(rows.astype(np.int32), max(height - 2, 0))
+    left = np.minimum(cols.astype(np.int32), max(width - 2, 0))
+    row_weights = rows - top.astype(np.float32)
+    col_weights = cols - left.astype(np.float32)
+    row_step = width if height > 1 else 0
+    col_step = 1 if width > 1 else 0
+
+    # Gather the four neighbours from the flattened image
+    flat_image = image.reshape((height * width,) + image.shape[2:])
+    top_left = top * width + left
+    if image.ndim == 3:
+        row_weights = row_weights[..., None]
+        col_weights = col_weights[..., None]
+        valid = valid[..., None]
+
+    top_values = flat_image[top_left] * (1 - col_weights)
+    top_values += flat_image[top_left + col_step] * col_weights
+    bottom_values = flat_image[top_left + row_step] * (1 - col_weights)
+    bottom_values += flat_image[top_left + row_step + col_step] * col_weights
+    values = top_values * (1 - row_weights) + bottom_values * row_weights
+
+    values = np.where(valid, values, fill_value)
+    if np.issubdtype(image.dtype, np.integer):
+        values = np.rint(values)
+
+    return values.astype(image.dtype)
+
+
+def remap_image(image, table, fill_value=0):
+    """
+    Convert an image from the source to the target projection of a remap
+    table (see `get_remap_table`).
+    """
+
+    return sample_bilinear(image, table, fill_value)
+
+
+def remap_points(points, inverse_table):
+    """
+    Convert an (N, 2) array of fractional (row, column) coordinates in
+    an image taken with a given projection to an image taken with
+    another one, given the table that remaps images the other way round
+    (i.e. with the projections swapped). Points that don't end up in the
+    image are NaN.
+    """
+
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+
+    return sample_bilinear(inverse_table, points, fill_value=np.nan)
@@ -0,0 +1,246 @@
+"""
+Cycles settings tuned for the hardware rendering is done on.
+
+A render profile sets the device, the number of threads, the tile size,
+adaptive sampling, the number of light bounces and the denoiser:
+    - 'cpu': all CPU cores, with small tiles so that no core is left
+      idle at the end of a frame.
+    - 'gpu': every GPU found, with the fastest backend available (OptiX
+      first, then CUDA, HIP, Metal, oneAPI and OpenCL) and large tiles.
+    - 'mask': the fastest settings for renders whose only purpose is
+      the object index pass (1 sample, no bounces, no denoising), on the
+      CPU, which avoids loading GPU kernels for single-sample renders.
+    - 'preview': the fastest settings for images rendered with a few
+      samples (no adaptive sampling, no denoising), which the overhead
+      of those would outweigh, on the CPU as well.
+    - 'auto': 'mask' for mask-only renders, 'preview' for renders with
+      at most `PREVIEW_MAX_SAMPLES` samples, otherwise 'gpu' if a GPU is
+      found and 'cpu' if not.
+Both Blender 2.9x (where tiles are set in `scene.render`) and 3.x (where
+they are set in `scene.cycles`) are supported.
+"""
+
+from contextlib import contextmanager
+
+import bpy
+
+render_profiles = {
+    'cpu': {
+        'device': 'CPU',
+        'tile_size': 32,
+        'use_adaptive_sampling': True,
+        'adaptive_threshold': 0.01,
+        'max_bounces': 1,
+        'use_denoising': True
+    },
+    'gpu': {
+        'device': 'GPU',
+        'tile_size': 256,
+        'use_adaptive_sampling': True,
+        'adaptive_threshold': 0.01,
+        'max_bounces': 1,
+        'use_denoising': True
+    },
+    'mask': {
+        'device': 'CPU',
+        'tile_size': 64,
+        'samples': 1,
+        'use_adaptive_sampling': False,
+        'max_bounces': 0,
+        'use_denoising': False
+    },
+    'preview': {
+        'device': 'CPU',
+        'tile_size': 64,
+        'use_adaptive_sampling': False,
+        'max_bounces': 1,
+        'use_denoising': False
+    }
+}
+
+# Renders with this many samples or fewer get the 'preview' profile, 
+# when the profile is chosen automatically
+PREVIEW_MAX_SAMPLES = 4
+
+# GPU backends, fastest first
+GPU_DEVICE_TYPES = ['OPTIX', 'CUDA', 'HIP', 'METAL', 'ONEAPI', 'OPENCL']
+
+
+def detect_gpu_devices():
+    """
+    Find the fastest GPU backend with at least one device. Returns the
+    backend (e.g. 'CUDA') and its GPU devices, or None and an empty
+    list if there are no GPUs.
+    """
+
+    cycles_preferences = bpy.context.preferences.addons['cycles'].preferences
+
+    for device_type in GPU_DEVICE_TYPES:
+        try:
+            cycles_preferences.compute_device_type = device_type
+        except TypeError:
+            # This backend is not supported by this build of Blender
+            continue
+
+        if hasattr(cycles_preferences, 'refresh_devices'):
+            cycles_preferences.refresh_devices()
+        else:
+            cycles_preferences.get_devices()
+
+        devices = [
+            device
+            for device in cycles_preferences.get_devices_for_type(device_type)
+            if device.type != 'CPU'
+        ]
+        if devices:
+            return device_type, devices
+
+    return None, []
+
+
+def _set_tile_size(scene, tile_size):
+
+    if hasattr(scene.render, 'tile_x'):
+        scene.render.tile_x = tile_size
+        scene.render.tile_y = tile_size
+    else:
+        scene.cycles.tile_size = tile_size
+
+
+def _set_bounces(scene, max_bounces):
+
+    scene.cycles.max_bounces = max_bounces
+    scene.cycles.diffuse_bounces = min(scene.cycles.diffuse_bounces, max_bounces)
+    scene.cycles.glossy_bounces = min(scene.cycles.glossy_bounces, max_bounces)
+    scene.cycles.transmission_bounces = min(
+        scene.cycles.transmission_bounces,
+        max_bounces
+    )
+    scene.cycles.caustics_reflective = False
+    scene.cycles.caustics_refractive = False
+
+
+def apply_render_profile(
+    scene,
+    profile='auto',
+    render_samples=64,
+    render_threads=0,
+    mask_only=False
+):
+    """
+    Apply a render profile (see the module docstring) to `scene`.
+    `render_samples` is ignored by the 'mask' profile, and
+    `render_threads` set to 0 means one thread per CPU core. Returns the
+    name of the profile that has been applied (which is also stored in
+    the scene, see `get_render_settings`).
+    """
+
+    if profile in ['auto', 'gpu']:
+        gpu_device_type, gpu_devices = detect_gpu_devices()
+    else:
+        gpu_device_type, gpu_devices = None, []
+
+    if profile == 'auto':
+        if mask_only:
+            profile = 'mask'
+        elif render_samples <= PREVIEW_MAX_SAMPLES:
+            profile = 'preview'
+        elif gpu_devices:
+            profile = 'gpu'
+        else:
+            profile = 'cpu'
+    elif profile == 'gpu' and not gpu_devices:
+        print('No GPU found: falling back to the cpu render profile')
+        profile = 'cpu'
+
+    settings = render_profiles[profile]
+
+    scene.cycles.device = settings['device']
+    if settings['device'] == 'GPU':
+        for device in gpu_devices:
+            device.use = True
+
+    if render_threads > 0:
+        scene.render.threads_mode = 'FIXED'
+        scene.render.threads = render_threads
+    else:
+        scene.render.threads_mode = 'AUTO'
+
+    _set_tile_size(scene, settings['tile_size'])
+    scene.cycles.samples = settings.get('samples', render_samples)
+    scene.cycles.use_adaptive_sampling = settings['use_adaptive_sampling']
+    if settings['use_adaptive_sampling']:
+        scene.cycles.adaptive_threshold = settings['adaptive_threshold']
+    _set_bounces(scene, settings['max_bounces'])
+
+    scene.view_layers['View Layer'].cycles.use_denoising = settings['use_denoising']
+    if settings['use_denoising']:
+        # OptiX denoises on the GPU, OpenImageDenoise on the CPU
+        scene.cycles.denoiser = (
+            'OPTIX' if gpu_device_type == 'OPTIX' and settings['device'] == 'GPU'
+            else 'OPENIMAGEDENOISE'
+        )
+
+    scene['render_profile'] = profile
+
+    return profile
+
+
+def get_render_settings(scene):
+    """
+    Get the render settings of `scene` that render profiles change,
+    along with the name of the profile that was applied last, as a
+    JSON-serializable dict (e.g. for annotation metadata).
+    """
+
+    cycles_preferences = bpy.context.preferences.addons['cycles'].preferences
+
+    if hasattr(scene.render, 'tile_x'):
+        tile_size = scene.render.tile_x
+    else:
+        tile_size = scene.cycles.tile_size
+
+    view_layer_settings = scene.view_layers['View Layer'].cycles
+
+    return {
+        'profile': scene.get('render_profile'),
+        'device': scene.cycles.device,
+        'compute_device_type': cycles_preferences.compute_device_type,
+        'threads': scene.render.threads,
+        'tile_size': tile_size,
+        'samples': scene.cycles.samples,
+        'use_adaptive_sampling': scene.cycles.use_adaptive_sampling,
+        'max_bounces': scene.cycles.max_bounces,
+        'use_denoising': view_layer_settings.use_denoising,
+        'denoiser': scene.cycles.denoiser
+    }
+
+
+@contextmanager
+def mask_render_settings(scene):
+    """
+    Temporarily switch to the fastest settings for renders that are only
+    needed for the object index pass (see the 'mask' profile), restoring
+    the previous ones afterwards. The device is left unchanged, so that
+    the scene isn't reloaded onto a different device.
+    """
+
+    view_layer_settings = scene.view_layers['View Layer'].cycles
+    original_settings = {
+        'samples': scene.cycles.samples,
+        'use_adaptive_sampling': scene.cycles.use_adaptive_sampling,
+        'max_bounces': scene.cycles.max_bounces,
+        'use_denoising': view_layer_settings.use_denoising
+    }
+
+    scene.cycles.samples = 1
+    scene.cycles.use_adaptive_sampling = False
+    scene.cycles.max_bounces = 0
+    view_layer_settings.use_denoising = False
+    try:
+        yield
+    finally:
+        scene.cycles.samples = original_settings['samples']
+        scene.cycles.use_adaptive_sampling = original_settings['use_adaptive_sampling']
+        scene.cycles.max_bounces = original_settings['max_bounces']
+        view_layer_settings.use_denoising = original_settings['use_denoising']
@@ -6,11 +6,102 @@ import sys
 import numpy as np
 import bpy
 
+scripts_folder = Path(__file__).parent
+sys.path.insert(0, str(scripts_folder))
+import layout_cache as lac
+import layout_utils as lyu
+import placement_utils as pu
+import profiling as prof
+import randomization as rnd
+import scramble_utils as scu
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     '-o', '--output-path', 
     default=str(Path.home() / 'output.blend')
 )
+parser.add_argument(
+    '-ph', '--physics', 
+    choices=['bullet', 'numpy'],
+    default='bullet'
+)
+parser.add_argument(
+    '-sf', '--simulation-frames',
+    type=int,
+    default=300
+)
+parser.add_argument(
+    '-st', '--settle-threshold',
+    type=float,
+    default=None,
+    help='stop the rigid body simulation as soon as no ball or pin has '
+         'moved by more than this many meters per frame for '
+         '--settle-frames consecutive frames (--simulation-frames is then '
+         'only an upper bound): by default, all frames are simulated'
+)
+parser.add_argument(
+    '-sfr', '--settle-frames',
+    type=int,
+    default=10
+)
+parser.add_argument(
+    '-lf', '--layouts-file', 
+    default=None,
+    help='pool of layouts generated with generate_layouts.py: if given, '
+         'the balls are not scrambled, but placed according to the '
+         'layout given by --layout-index'
+)
+parser.add_argument(
+    '-li', '--layout-index', 
+    type=int,
+    default=0
+)
+parser.add_argument(
+    '-pl', '--placement', 
+    choices=['rows'] + pu.distributions,
+    default='rows',
+    help='rows: place balls on two rows and let physics scramble them; '
+         'any other choice: sample non-overlapping positions with the '
+         'given distribution, without running any physics simulation'
+)
+parser.add_argument(
+    '-s', '--seed',
+    type=int,
+    default=None
+)
+parser.add_argument(
+    '-lc', '--layout-cache',
+    default=None,
+    help='.npz index of settled layouts (see layout_cache.py), keyed by '
+         'seed, initial layout and physics parameters: layouts settled '
+         'by the physics are stored in it, and reused instead of being '
+         'simulated again (requires --seed)'
+)
+parser.add_argument(
+    '-lcs', '--layout-cache-size',
+    type=float,
+    default=256,
+    help='maximum size of the layout cache, in MB'
+)
+parser.add_argument(
+    '-rc', '--randomization-config',
+    default=None,
+    help='JSON file with the distributions of the lights, materials, '
+         'camera, ... parameters to randomize (see randomization.py)'
+)
+parser.add_argument(
+    '-pr', '--profile',
+    action='store_true',
+    default=False,
+    help='time each stage and print a report at the end (see '
+         'profiling.py)'
+)
+parser.add_argument(
+    '-pfl', '--profile-log',
+    default=None,
+    help='JSON Lines file where the profile is appended (implies '
+         '`--profile`)'
+)
 
 if '--' in sys.argv:
     args = parser.parse_args(sys.argv[sys.argv.index('--') + 1:])
@@ -18,183 +109,98 @@ else:
     # Stick to default values for each parameter
     args = parser.parse_args([])
 
+if args.layout_cache is not None and args.seed is None:
+    parser.error('--layout-cache requires --seed')
+
+if args.seed is not None:
+    np.random.seed(args.seed)
+    random.seed(args.seed)
+
+if args.profile or args.profile_log is not None:
+    prof.profiler.enable(args.profile_log)
+prof.profiler.start_frame(args.layout_index)
+
 palle = bpy.data.collections['T0_Palle'].all_objects[:]
 birilli = bpy.data.collections['T0_Birilli'].all_objects[:]
 
 game_area = bpy.data.objects['Panno']
-x_table_center = game_area.location.x
-y_table_center = game_area.location.y
 # limiti_palle = {
 #     'x_max': -1.0, 
 #     'x_min': -1.2, 
 #     'y_max': 0.10, 
 #     'y_min': -0.10825
 # }
-limiti_palle = {
-    'x_max': x_table_center + (game_area.dimensions.x / 2) - 0.295, 
-    'x_min': x_table_center - (game_area.dimensions.x / 2) + 0.295, 
-    'y_max': y_table_center + (game_area.dimensions.y / 2) - 0.295, 
-    'y_min': y_table_center - (game_area.dimensions.y / 2) + 0.295
-}
-
-## randomizzare luci (accendere  o meno il tavolo vicino)
-## mettere delle persone
-## posizione camera ??
-## palle
-## colore panno
-## colore tavolo
-## colore sponde
-## muri
-
-def select_single_object(obj):
-    bpy.ops.object.select_all(action='DESELECT')
-    bpy.context.view_layer.objects.active = obj
-    obj.select_set(True)
-
-
-def select_multiple_objects(objs):
-    bpy.ops.object.select_all(action='DESELECT')
-    bpy.context.view_layer.objects.active = objs[0]
-    for obj in objs:
-        obj.select_set(True)
-
-
-def enable_rigid_body_physics(
-    obj, 
-    collision_shape, 
-    rigid_body_type, 
-    mass, 
-    friction=1.0,
-    bounciness=0,
-    linear_damping=0.04, 
-    angular_damping=0.1):
-    
-    select_single_object(obj)
-    
-    bpy.ops.rigidbody.object_add()
-    obj.rigid_body.collision_shape = collision_shape
-    obj.rigid_body.type = rigid_body_type
-    obj.rigid_body.mass = mass
-    obj.rigid_body.friction = friction
-    obj.rigid_body.restitution = bounciness
-    obj.rigid_body.linear_damping = linear_damping
-    obj.rigid_body.angular_damping = angular_damping
-
-
-def disable_rigid_body_physics(obj):
-    select_single_object(obj)
-    bpy.ops.rigidbody.object_remove()
-
-
-def set_random_initial_velocity(obj, max_offset):
-    """
-    Set a random initial velocity (with only x and y components) for the 
-    given object, using keyframes. For a demonstration of how this works 
-    in practice, check this YouTube video:
-    https://www.youtube.com/watch?v=Xe5fiGrG_2s
-    """
-
-    offset_x, offset_y = np.random.uniform(
-        low=-max_offset, 
-        high=max_offset, 
-        size=2)
-
-    scene = bpy.context.scene
-
-    scene.frame_set(1)
-    obj.rigid_body.kinematic = True
-    obj.keyframe_insert('location')
-    obj.keyframe_insert('rigid_body.kinematic')
-
-    scene.frame_set(3)
-    obj.location.x += offset_x
-    obj.location.y += offset_y
-    obj.keyframe_insert('location')
-    obj.keyframe_insert('rigid_body.kinematic')
-
-    scene.frame_set(4)
-    obj.rigid_body.kinematic = False
-    obj.keyframe_insert('rigid_body.kinematic')
-
-
-def position_balls(balls, game_area, max_ball_diameter_m=0.059):
-
-    game_area_center = game_area.location
-    game_area_width = game_area.dimensions.x
-    game_area_height = game_area.dimensions.y
-    
-    x_min = game_area_center.x - (game_area_width / 2)
-    x_max = game_area_center.x + (game_area_width / 2)
-    # y_min = game_area_center.y - (game_area_height / 2)
-    # y_max = game_area_center.y + (game_area_height / 2)
-
-    n_balls_in_first_row = (len(balls) + 1) // 2
-    x_coordinates_first_row, step_x = np.linspace(
-        x_min, 
-        x_max, 
-        num=n_balls_in_first_row + 2, 
-        retstep=True)
-    x_coordinates_first_row = x_coordinates_first_row[1:-1]
-
-    n_balls_in_second_row = len(balls) // 2
-    x_coordinates_second_row = np.linspace(
-        x_min, 
-        x_max, 
-        num=n_balls_in_second_row + 2, 
-        retstep=False)
-    x_coordinates_second_row = x_coordinates_second_row[1:-1]
-
-    step_y = game_area_height / 2
-    y_coordinate_first_row = game_area_center.y + (step_y / 2)
-    y_coordinate_second_row = game_area_center.y - (step_y / 2)
-
-    permuted_ball_indices = np.random.permutation(len(balls))
-
-    for i, x_coord in enumerate(x_coordinates_first_row):
-        
-        balls[permuted_ball_indices[i]].location.x = x_coord
-        balls[permuted_ball_indices[i]].location.y = y_coordinate_first_row
-
-    for i, x_coord in enumerate(
-        x_coordinates_second_row, 
-        len(x_coordinates_first_row)):
-        
-        balls[permuted_ball_indices[i]].location.x = x_coord
-        balls[permuted_ball_indices[i]].location.y = y_coordinate_second_row
-    
-    # Set initial velocity
-    for ball in balls:
-        max_offset = min(step_x//2, step_y//2) - max_ball_diameter_m
-        set_random_initial_velocity(ball, max_offset=max_offset)
-
-
-def apply_visual_transform(objs):
-    select_multiple_objects(objs)
-    bpy.ops.object.visual_transform_apply()    
-
-
-# Enable rigid body physics for both balls and pins
-for palla in palle:
-    enable_rigid_body_physics(
-        palla, 
-        collision_shape='SPHERE', 
-        rigid_body_type='ACTIVE', 
-        mass=1,
-        bounciness=0.5
-    )
-for birillo in birilli:
-    enable_rigid_body_physics(
-        birillo, 
-        collision_shape='CONVEX_HULL', 
-        rigid_body_type='ACTIVE', 
-        mass=0.005,
-        linear_damping=0.5,
-        angular_damping=1.0
-    )
-
-# Scramble the balls (leaving the z-coordinate unchanged) and give them 
-# an initial velocity
-position_balls(palle, game_area)
+limiti_palle = scu.get_ball_limits(game_area)
+
+# Randomize lights (e.g. whether the nearby table is lit), camera 
+# position, cloth, table, cushions and walls colors, ... as described by
+# the config (people are still to be added to the scene)
+if args.randomization_config is not None:
+    with prof.profiler.stage('randomization'):
+        randomizer = rnd.Randomizer(rnd.load_config(args.randomization_config))
+        randomization = randomizer.sample()
+        randomizer.apply(randomization)
+    print(f'Randomization: {randomization}')
+
+# Scramble the balls, either taking a pre-generated layout, sampling 
+# non-overlapping positions or giving them an initial velocity and 
+# running the simulation to separate overlapping objects
+with prof.profiler.stage('layout'):
+    if args.layouts_file is not None:
+        layouts, layout_parameters = lyu.load_layouts(args.layouts_file)
+        scu.apply_layout(
+            layouts[args.layout_index],
+            layout_parameters['ball_names'],
+            layout_parameters['pin_names']
+        )
+    elif args.placement != 'rows':
+        scu.place_balls(palle, birilli, game_area, distribution=args.placement)
+    else:
+        if args.layout_cache is not None:
+            layout_cache = lac.LayoutCache(
+                args.layout_cache,
+                max_size=int(args.layout_cache_size * 2**20)
+            )
+            layout_key = lac.compute_key(
+                args.seed,
+                scu.get_settled_layout(palle + birilli + [game_area]),
+                scu.get_physics_parameters(
+                    physics=args.physics,
+                    n_frames=args.simulation_frames,
+                    settle_threshold=args.settle_threshold,
+                    settle_frames=args.settle_frames
+                )
+            )
+            cached_layout = layout_cache.get(layout_key)
+        else:
+            cached_layout = None
+
+        if cached_layout is not None:
+            settled_layout, simulation_frames = cached_layout
+            scu.apply_settled_layout(settled_layout)
+        elif args.physics == 'numpy':
+            simulation_frames = scu.scramble_balls_numpy(palle, birilli, game_area)
+        else:
+            simulation_frames = scu.scramble_balls(
+                palle,
+                birilli,
+                game_area,
+                n_frames=args.simulation_frames,
+                settle_threshold=args.settle_threshold,
+                settle_frames=args.settle_frames
+            )
+        print(f'Simulated {simulation_frames} frames')
+
+        if args.layout_cache is not None:
+            if cached_layout is None:
+                layout_cache.put(
+                    layout_key,
+                    scu.get_settled_layout(palle + birilli),
+                    simulation_frames
+                )
+            layout_cache.close()
+            layout_cache.print_stats()
+    prof.profiler.count(objects=len(palle) + len(birilli))
 
 # for palla in palle:
     # palla.location.x = random.uniform(
@@ -204,23 +210,9 @@ position_balls(palle, game_area)
     #     limiti_palle['y_min'], limiti_palle['y_max']
     # )
 
-# Run the simulation to separate overlapping objects
-bpy.context.scene.frame_end = 300
-for f in range(1, bpy.context.scene.frame_end):
-    bpy.context.scene.frame_set(f)
-
-# Apply transformations (location and rotation) made by the simulation
-all_objects = palle + birilli
-apply_visual_transform(all_objects)
-
-# Disable rigid body physics for all objects
-for obj in all_objects:
-    disable_rigid_body_physics(obj)
-
-# Remove animation data from balls that was used to give them an initial
-#  velocity
-for palla in palle:
-    palla.animation_data_clear()
-
 # Save the blend file
-bpy.ops.wm.save_as_mainfile(filepath=args.output_path)
\ No newline at end of file
+with prof.profiler.stage('save'):
+    bpy.ops.wm.save_as_mainfile(filepath=args.output_path)
+
+prof.profiler.end_frame()
+prof.profiler.print_report()
@@ -0,0 +1,526 @@
+import numpy as np
+import bpy
+
+import placement_utils as pu
+import profiling as prof
+import table_physics as tp
+
+
+def get_ball_limits(game_area, margin=0.295):
+    """
+    Get the limits, along the x and y axes, of the region of the game 
+    area where balls can be placed, i.e. the game area shrunk by 
+    `margin` meters on each side.
+    """
+
+    x_table_center = game_area.location.x
+    y_table_center = game_area.location.y
+
+    return {
+        'x_max': x_table_center + (game_area.dimensions.x / 2) - margin, 
+        'x_min': x_table_center - (game_area.dimensions.x / 2) + margin, 
+        'y_max': y_table_center + (game_area.dimensions.y / 2) - margin, 
+        'y_min': y_table_center - (game_area.dimensions.y / 2) + margin
+    }
+
+
+def get_rigid_body_collection(scene=None):
+    """
+    Get the collection holding the objects simulated by the rigid body 
+    world of the scene, creating the world if there is none yet (the 
+    only operator left, since worlds can't be created through data).
+    """
+
+    if scene is None:
+        scene = bpy.context.scene
+
+    if scene.rigidbody_world is None:
+        bpy.ops.rigidbody.world_add()
+
+    rigid_body_world = scene.rigidbody_world
+    if rigid_body_world.collection is None:
+        rigid_body_world.collection = bpy.data.collections.new('RigidBodyWorld')
+
+    return rigid_body_world.collection
+
+
+def add_rigid_body_objects(objs, scene=None):
+    """
+    Add objects to the rigid body world, all at once and without 
+    operators: linking an object to the collection of the world gives it
+    rigid body settings, which can then be changed with 
+    `set_rigid_body_settings`.
+    """
+
+    collection = get_rigid_body_collection(scene)
+    for obj in objs:
+        if collection.objects.get(obj.name) is None:
+            collection.objects.link(obj)
+
+    # Versions of Blender before 2.91 only create the settings when the
+    # world is evaluated
+    if any(obj.rigid_body is None for obj in objs):
+        bpy.context.view_layer.update()
+
+
+def set_rigid_body_settings(
+    objs, 
+    collision_shape, 
+    rigid_body_type, 
+    mass, 
+    friction=1.0,
+    bounciness=0,
+    linear_damping=0.04, 
+    angular_damping=0.1):
+
+    for obj in objs:
+        rigid_body = obj.rigid_body
+        rigid_body.collision_shape = collision_shape
+        rigid_body.type = rigid_body_type
+        rigid_body.mass = mass
+        rigid_body.friction = friction
+        rigid_body.restitution = bounciness
+        rigid_body.linear_damping = linear_damping
+        rigid_body.angular_damping = angular_damping
+
+
+def remove_rigid_body_objects(objs, scene=None):
+    """
+    Take objects out of the rigid body world, so that the simulation no
+    longer moves them.
+    """
+
+    collection = get_rigid_body_collection(scene)
+    for obj in objs:
+        if collection.objects.get(obj.name) is not None:
+            collection.objects.unlink(obj)
+
+
+def get_world_matrices(objs, scene=None):
+    """
+    Get the world matrices of objects in the rigid body world, as left 
+    by the last evaluated frame of the simulation, as a (N, 4, 4) array.
+    They are read with a single `foreach_get` over the collection of the
+    world.
+    """
+
+    collection = get_rigid_body_collection(scene)
+    matrices = np.empty(len(collection.objects) * 16, dtype=np.float32)
+    collection.objects.foreach_get('matrix_world', matrices)
+    # Matrices are flattened column by column
+    matrices = matrices.reshape(-1, 4, 4).transpose(0, 2, 1)
+
+    return matrices[[collection.objects.find(obj.name) for obj in objs]]
+
+
+def get_max_displacement(previous_matrices, matrices):
+    """
+    Get the largest distance (in meters) travelled by the origin of any
+    object between two sets of world matrices (see `get_world_matrices`).
+    """
+
+    displacements = matrices[:, :3, 3] - previous_matrices[:, :3, 3]
+
+    return float(np.max(np.linalg.norm(displacements, axis=1), initial=0.0))
+
+
+def bake_simulation(objs, animated_objs=(), scene=None):
+    """
+    Make the transforms computed by the rigid body simulation the actual
+    location, rotation and scale of objects (like 'Apply Visual 
+    Transform'), take them out of the rigid body world and remove the 
+    animation data of `animated_objs`. Nothing is evaluated but once, at
+    the end.
+    """
+
+    matrices = get_world_matrices(objs, scene)
+
+    remove_rigid_body_objects(objs, scene)
+    for obj in animated_objs:
+        obj.animation_data_clear()
+
+    # Setting the world matrix sets location, rotation and scale
+    for obj, matrix in zip(objs, matrices):
+        obj.matrix_world = matrix.tolist()
+
+    bpy.context.view_layer.update()
+
+
+def set_random_initial_velocity(obj, max_offset):
+    """
+    Set a random initial velocity (with only x and y components) for the 
+    given object, using keyframes. For a demonstration of how this works 
+    in practice, check this YouTube video:
+    https://www.youtube.com/watch?v=Xe5fiGrG_2s
+    """
+
+    offset_x, offset_y = np.random.uniform(
+        low=-max_offset, 
+        high=max_offset, 
+        size=2)
+
+    # Keyframes are inserted at the given frames directly, without 
+    # changing (and evaluating) the current frame
+    obj.rigid_body.kinematic = True
+    obj.keyframe_insert('location', frame=1)
+    obj.keyframe_insert('rigid_body.kinematic', frame=1)
+
+    obj.location.x += offset_x
+    obj.location.y += offset_y
+    obj.keyframe_insert('location', frame=3)
+    obj.keyframe_insert('rigid_body.kinematic', frame=3)
+
+    obj.rigid_body.kinematic = False
+    obj.keyframe_insert('rigid_body.kinematic', frame=4)
+
+
+def position_balls(
+    balls, 
+    game_area, 
+    max_ball_diameter_m=0.059, 
+    initial_velocity=True):
+
+    game_area_center = game_area.location
+    game_area_width = game_area.dimensions.x
+    game_area_height = game_area.dimensions.y
+    
+    x_min = game_area_center.x - (game_area_width / 2)
+    x_max = game_area_center.x + (game_area_width / 2)
+    # y_min = game_area_center.y - (game_area_height / 2)
+    # y_max = game_area_center.y + (game_area_height / 2)
+
+    n_balls_in_first_row = (len(balls) + 1) // 2
+    x_coordinates_first_row, step_x = np.linspace(
+        x_min, 
+        x_max, 
+        num=n_balls_in_first_row + 2, 
+        retstep=True)
+    x_coordinates_first_row = x_coordinates_first_row[1:-1]
+
+    n_balls_in_second_row = len(balls) // 2
+    x_coordinates_second_row = np.linspace(
+        x_min, 
+        x_max, 
+        num=n_balls_in_second_row + 2, 
+        retstep=False)
+    x_coordinates_second_row = x_coordinates_second_row[1:-1]
+
+    step_y = game_area_height / 2
+    y_coordinate_first_row = game_area_center.y + (step_y / 2)
+    y_coordinate_second_row = game_area_center.y - (step_y / 2)
+
+    permuted_ball_indices = np.random.permutation(len(balls))
+
+    for i, x_coord in enumerate(x_coordinates_first_row):
+        
+        balls[permuted_ball_indices[i]].location.x = x_coord
+        balls[permuted_ball_indices[i]].location.y = y_coordinate_first_row
+
+    for i, x_coord in enumerate(
+        x_coordinates_second_row, 
+        len(x_coordinates_first_row)):
+        
+        balls[permuted_ball_indices[i]].location.x = x_coord
+        balls[permuted_ball_indices[i]].location.y = y_coordinate_second_row
+    
+    if not initial_velocity:
+        return
+
+    # Set initial velocity
+    for ball in balls:
+        max_offset = min(step_x//2, step_y//2) - max_ball_diameter_m
+        set_random_initial_velocity(ball, max_offset=max_offset)
+
+
+def save_object_transforms(objs):
+    """
+    Take a snapshot of the world matrix of each of the given objects, so 
+    that they can be put back in place with `restore_object_transforms`.
+    """
+
+    return [(obj, obj.matrix_world.copy()) for obj in objs]
+
+
+def restore_object_transforms(saved_transforms):
+    """
+    Put objects back in place, given a snapshot taken with 
+    `save_object_transforms`.
+    """
+
+    for obj, matrix_world in saved_transforms:
+        obj.matrix_world = matrix_world.copy()
+
+
+def get_settled_layout(objs):
+    """
+    Get the world matrices of objects, as a dict mapping their names to
+    4x4 arrays (e.g. to be stored in a `layout_cache.LayoutCache`).
+    """
+
+    return {obj.name: np.array(obj.matrix_world) for obj in objs}
+
+
+def apply_settled_layout(world_matrices):
+    """
+    Move objects back where they were when `get_settled_layout` was 
+    called, without running any simulation.
+    """
+
+    for name, matrix in world_matrices.items():
+        bpy.data.objects[name].matrix_world = np.asarray(matrix).tolist()
+
+    bpy.context.view_layer.update()
+
+
+def get_physics_parameters(scene=None, **parameters):
+    """
+    Get the parameters of the scene that the outcome of a rigid body 
+    simulation depends on (gravity, frame rate and rigid body world 
+    settings), along with any keyword argument (e.g. the number of 
+    frames to simulate), as a dict of JSON-serializable values.
+    """
+
+    if scene is None:
+        scene = bpy.context.scene
+
+    parameters['gravity'] = list(scene.gravity)
+    parameters['fps'] = scene.render.fps / scene.render.fps_base
+
+    rigid_body_world = scene.rigidbody_world
+    if rigid_body_world is not None:
+        for name in [
+            'time_scale', 
+            'substeps_per_frame', 
+            'steps_per_second', 
+            'solver_iterations', 
+            'use_split_impulse'
+        ]:
+            # Which settings exist depends on the version of Blender
+            if hasattr(rigid_body_world, name):
+                parameters[name] = getattr(rigid_body_world, name)
+
+    return parameters
+
+
+def scramble_balls(
+    palle, 
+    birilli, 
+    game_area, 
+    n_frames=300, 
+    settle_threshold=None, 
+    settle_frames=10):
+    """
+    Scramble the balls over the game area and run a rigid body 
+    simulation that separates overlapping balls and pins. When this 
+    function returns, the objects are left where the simulation put 
+    them, without any physics or animation data attached.
+
+    The simulation runs up to frame `n_frames`. If `settle_threshold` is
+    given, it stops as soon as no ball or pin has moved by more than 
+    `settle_threshold` meters per frame for `settle_frames` consecutive 
+    frames, since nothing would change afterwards (for at least as long
+    as the objects keep still). Returns the number of frames simulated.
+    """
+
+    # Enable rigid body physics for both balls and pins
+    add_rigid_body_objects(palle + birilli)
+    set_rigid_body_settings(
+        palle, 
+        collision_shape='SPHERE', 
+        rigid_body_type='ACTIVE', 
+        mass=1,
+        bounciness=0.5
+    )
+    set_rigid_body_settings(
+        birilli, 
+        collision_shape='CONVEX_HULL', 
+        rigid_body_type='ACTIVE', 
+        mass=0.005,
+        linear_damping=0.5,
+        angular_damping=1.0
+    )
+
+    # Scramble the balls (leaving the z-coordinate unchanged) and give 
+    # them an initial velocity
+    position_balls(palle, game_area)
+
+    # Run the simulation to separate overlapping objects
+    scene = bpy.context.scene
+    scene.frame_end = n_frames
+    n_simulated_frames = 0
+    n_still_frames = 0
+    previous_matrices = None
+    with prof.profiler.stage('physics'):
+        for f in range(1, scene.frame_end):
+            scene.frame_set(f)
+            n_simulated_frames += 1
+            if settle_threshold is None:
+                continue
+
+            matrices = get_world_matrices(palle + birilli)
+            # Balls are pushed by keyframes until frame 4 (see 
+            # `set_random_initial_velocity`)
+            if (
+                previous_matrices is not None and
+                f > 4 and
+                get_max_displacement(previous_matrices, matrices) < settle_threshold
+            ):
+                n_still_frames += 1
+                if n_still_frames >= settle_frames:
+                    break
+            else:
+                n_still_frames = 0
+            previous_matrices = matrices
+        prof.profiler.count(simulation_frames=n_simulated_frames)
+
+    # Apply transformations (location and rotation) made by the 
+    # simulation, disable rigid body physics for all objects and remove 
+    # animation data from balls that was used to give them an initial 
+    # velocity
+    bake_simulation(palle + birilli, animated_objs=palle)
+
+    return n_simulated_frames
+
+
+def get_game_area_limits(game_area):
+    """
+    Get the limits, along the x and y axes, of the game area, i.e. the 
+    positions of the cushions.
+    """
+
+    return get_ball_limits(game_area, margin=0.0)
+
+
+def knock_down_pin(pin):
+    """
+    Lay a pin down on the table, in a random direction. 
+    
+    NOTE: this assumes that the pin is upright when its rotation is 
+    zero, and that its origin is at its center. Its rotation mode is
+    set to 'XYZ' Euler, since `rotation_euler` is ignored otherwise.
+    """
+
+    height = pin.dimensions.z
+    diameter = pin.dimensions.x
+
+    pin.rotation_mode = 'XYZ'
+    pin.rotation_euler = (np.pi / 2, 0.0, np.random.uniform(0, 2 * np.pi))
+    pin.location.z -= (height - diameter) / 2
+
+
+def scramble_balls_numpy(
+    palle, 
+    birilli, 
+    game_area, 
+    max_initial_speed=1.5, 
+    **physics_parameters
+):
+    """
+    Same as `scramble_balls`, but balls are settled with the NumPy 
+    physics engine in `table_physics` instead of running a rigid body 
+    simulation in Blender. Balls only move in the xy-plane, and pins are
+    either left where they are or knocked down (see `knock_down_pin`).
+    Any keyword argument is passed on to `table_physics.simulate_table`.
+
+    Returns the number of simulation steps that have been taken.
+    """
+
+    # Scramble the balls (leaving the z-coordinate unchanged) and give 
+    # them an initial velocity
+    position_balls(palle, game_area, initial_velocity=False)
+    ball_velocities = np.random.uniform(
+        low=-max_initial_speed, 
+        high=max_initial_speed, 
+        size=(len(palle), 2)
+    )
+
+    ball_positions, pins_up, n_steps = tp.simulate_table(
+        [(palla.location.x, palla.location.y) for palla in palle],
+        ball_velocities,
+        [palla.dimensions.x / 2 for palla in palle],
+        get_game_area_limits(game_area),
+        pin_positions=[
+            (birillo.location.x, birillo.location.y) for birillo in birilli
+        ],
+        pin_radii=[birillo.dimensions.x / 2 for birillo in birilli],
+        **physics_parameters
+    )
+
+    # Write the settled positions back to the objects, all at once
+    for palla, (x, y) in zip(palle, ball_positions):
+        palla.location.x = x
+        palla.location.y = y
+
+    for birillo, is_up in zip(birilli, pins_up):
+        if not is_up:
+            knock_down_pin(birillo)
+
+    return n_steps
+
+
+def place_balls(
+    palle, 
+    birilli, 
+    game_area, 
+    distribution='uniform', 
+    max_ball_diameter_m=pu.BALL_DIAMETER,
+    **distribution_parameters
+):
+    """
+    Place the balls within the limits given by `get_ball_limits`, so 
+    that they don't overlap each other or the pins, without running any 
+    physics simulation (see `placement_utils`). Any keyword argument is 
+    passed on to the chosen distribution.
+    """
+
+    # Balls can't get closer to a pin than the sum of their radii
+    exclusion_zones = [
+        (
+            birillo.location.x, 
+            birillo.location.y, 
+            birillo.dimensions.x / 2 + max_ball_diameter_m / 2
+        ) 
+        for birillo in birilli
+    ]
+
+    # Draw the seed from the global random state, so that seeding NumPy 
+    # makes placements reproducible
+    rng = np.random.default_rng(np.random.randint(2**31))
+
+    positions = pu.sample_positions(
+        len(palle),
+        get_ball_limits(game_area),
+        min_distance=max_ball_diameter_m,
+        exclusion_zones=exclusion_zones,
+        distribution=distribution,
+        rng=rng,
+        **distribution_parameters
+    )
+
+    for palla, (x, y) in zip(palle, positions):
+        palla.location.x = x
+        palla.location.y = y
+
+
+def apply_layout(layout, ball_names, pin_names):
+    """
+    Move balls and pins according to a layout, i.e. a row of a pool of 
+    layouts generated with `layout_utils.generate_layouts`, whose 
+    columns refer to the objects named `ball_names` and `pin_names`.
+    """
+
+    for ball_name, (x, y), rotation in zip(
+        ball_names, 
+        layout['ball_positions'], 
+        layout['ball_rotations']):
+
+        palla = bpy.data.objects[ball_name]
+        palla.location.x = x
+        palla.location.y = y
+        # rotation_euler is ignored by objects in any other rotation mode
+        palla.rotation_mode = 'XYZ'
+        palla.rotation_euler = rotation
+
+    for pin_name, is_up in zip(pin_names, layout['pins_up']):
+        if not is_up:
+            knock_down_pin(bpy.data.objects[pin_name])
@@ -1,9 +1,84 @@
-import itertools
+from contextlib import contextmanager
 
 import numpy as np
 import bpy
 
 import coordinates_utils as cu
+import index_buffer_utils as ibu
+import profiling as prof
+import rasterizer as ra
+import silhouette_utils as silu
+
+# Local coordinates of the hull vertices of each mesh (see 
+# `get_hull_vertex_coordinates_in_world_space`), by mesh name
+_hull_vertex_cache = {}
+
+# Local coordinates of the vertices and vertex indices of the triangles
+# of each mesh (see `get_object_mesh`), by mesh name
+_triangle_cache = {}
+
+# World space coordinates of the vertices (or hull vertices) of each 
+# object, with the world matrix they were computed for, by object name 
+# (only within `shared_world_coordinates`)
+_world_coords_cache = None
+
+
+@contextmanager
+def shared_world_coordinates():
+    """
+    Within this context, the world space coordinates of the vertices of
+    an object are computed only once, and reused for as long as the 
+    object doesn't move (e.g. by all the views of a scene, which only 
+    differ in the camera). Meshes must not be edited in the meantime.
+    """
+
+    global _world_coords_cache
+
+    _world_coords_cache = {}
+    try:
+        yield
+    finally:
+        _world_coords_cache = None
+
+
+def _get_world_coords(obj, kind, get_local_coords):
+    """
+    Transform the local coordinates returned by `get_local_coords` to 
+    world space, or reuse those computed for the same `kind` of vertices
+    of `obj` (see `shared_world_coordinates`).
+    """
+
+    matrix_world = np.array(obj.matrix_world)
+
+    if _world_coords_cache is not None:
+        key = (obj.name, kind)
+        cached = _world_coords_cache.get(key)
+        if cached is not None and np.array_equal(cached[0], matrix_world):
+            prof.profiler.count(shared_transforms=1)
+            return cached[1]
+
+    world_coords = cu.transform_points(matrix_world, get_local_coords())
+
+    if _world_coords_cache is not None:
+        _world_coords_cache[key] = (matrix_world, world_coords)
+
+    return world_coords
+
+
+def get_vertex_coordinates_in_world_space(obj):
+    """
+    Get an (N, 3) array with the world space coordinates of each vertex 
+    of the mesh object `obj`.
+    """
+
+    def get_local_coords():
+        vertices = obj.data.vertices
+        local_coords = np.empty(len(vertices) * 3, dtype=np.float32)
+        vertices.foreach_get('co', local_coords)
+        return local_coords.reshape(-1, 3)
+
+    return _get_world_coords(obj, 'mesh', get_local_coords)
+
 
 def get_vertex_coordinates_in_rendered_image(
     obj, 
@@ -20,53 +95,293 @@ def get_vertex_coordinates_in_rendered_image(
     of its vertices in the rendered image.
     """
 
-    vertex_coordinates = []
-    for vertex in obj.data.vertices:
-
-        # Get vertex coordinates in world space
-        vertex_coords = obj.matrix_world @ vertex.co
-
-        # Get vertex coordinates in camera space. Each coordinate will 
-        # be in the [0, 1] range, provided that the 3D point is within 
-        # the camera's scope
-        vertex_camera_view_coords = cu.world_to_camera_view_with_projection(
-            camera_sensor_width, 
-            camera_sensor_height,
-            lens_focal_length, 
-            camera_obj,
-            vertex_coords,
-            projection
-        )
-        
-        # Map the x-coordinate in the range [0, render_width]
-        vertex_camera_view_x = int(vertex_camera_view_coords[0] * render_width)
-        # Map the y-coordinate in the range [0, render_height]
-        vertex_camera_view_y = int(vertex_camera_view_coords[1] * render_height)
-
-        # Convert pixel coordinates from Blender format (where (0, 0) is
-        # at the bottom left of the image) to NumPy format (where (0, 0)
-        # is at the top left of the image)
-        vertex_camera_view_x, vertex_camera_view_y = cu.blender_to_numpy(
-            vertex_camera_view_x,
-            vertex_camera_view_y,
-            render_height
-        )
+    # Get vertex coordinates in world space, reading them from the mesh 
+    # in a single call rather than one vertex at a time
+    vertex_coords = get_vertex_coordinates_in_world_space(obj)
 
-        vertex_coordinates.append([
-            vertex_camera_view_x,
-            vertex_camera_view_y
-        ])
+    # Get pixel coordinates (in NumPy format, where (0, 0) is at the top
+    # left of the image) of all vertices in one vectorized pass
+    vertex_coordinates = cu.world_to_pixel_coordinates(
+        camera_sensor_width, 
+        camera_sensor_height,
+        lens_focal_length, 
+        np.array(camera_obj.matrix_world),
+        vertex_coords,
+        render_width,
+        render_height,
+        projection
+    )
 
     # Remove duplicates from the resulting array before returning it. 
     # This will be useful in case the object has lots of vertices. For 
     # example, spheres in Blender can have over 5000 vertices, so it is 
     # only natural for some of them to be mapped on the very same pixel
-    vertex_coordinates = np.array(vertex_coordinates)
     vertex_coordinates = np.unique(vertex_coordinates, axis=0)
 
     return vertex_coordinates
 
 
+def get_hull_vertex_coordinates_in_world_space(obj):
+    """
+    Get an (N, 3) array with the world space coordinates of the convex 
+    hull vertices of the mesh object `obj` (see 
+    `silhouette_utils.get_hull_vertex_indices`). Hull vertices are 
+    found only the first time a mesh is seen.
+    """
+
+    mesh = obj.data
+    key = (mesh.name, len(mesh.vertices))
+    if key not in _hull_vertex_cache:
+        local_coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', local_coords)
+        local_coords = local_coords.reshape(-1, 3)
+        _hull_vertex_cache[key] = local_coords[
+            silu.get_hull_vertex_indices(local_coords)
+        ]
+
+    return _get_world_coords(obj, 'hull', lambda: _hull_vertex_cache[key])
+
+
+def get_bounding_box_in_rendered_image(
+    obj, 
+    camera_obj,
+    camera_sensor_width, 
+    camera_sensor_height,
+    lens_focal_length,
+    render_width,
+    render_height,
+    projection,
+    shape='mesh'
+):
+    """
+    Get the bounding box, as [min row, min column, width, height], of 
+    an object in the rendered image. `shape` tells how it is computed:
+        - 'sphere': analytically, from the object's location and 
+          dimensions (its origin must be at the center of the sphere).
+        - 'hull': from the vertices of the convex hull of the mesh.
+        - 'mesh': from all the vertices of the mesh.
+    """
+
+    if shape == 'sphere':
+        return silu.get_sphere_bounding_box(
+            camera_sensor_width,
+            camera_sensor_height,
+            lens_focal_length,
+            np.array(camera_obj.matrix_world),
+            np.array(obj.matrix_world.translation),
+            max(obj.dimensions) / 2,
+            render_width,
+            render_height,
+            projection
+        )
+
+    if shape == 'hull':
+        vertex_coords = get_hull_vertex_coordinates_in_world_space(obj)
+    elif shape == 'mesh':
+        vertex_coords = get_vertex_coordinates_in_world_space(obj)
+    else:
+        raise ValueError(f'Unknown shape: {shape}')
+    prof.profiler.count(vertices=len(vertex_coords))
+
+    return silu.get_bounding_box(cu.world_to_pixel_coordinates(
+        camera_sensor_width, 
+        camera_sensor_height,
+        lens_focal_length, 
+        np.array(camera_obj.matrix_world),
+        vertex_coords,
+        render_width,
+        render_height,
+        projection
+    ))
+
+
+def get_sphere_complete_mask(
+    obj, 
+    camera_obj,
+    camera_sensor_width, 
+    camera_sensor_height,
+    lens_focal_length,
+    render_width,
+    render_height,
+    projection,
+    bbox=None
+):
+    """
+    Get the complete mask of a sphere (whose origin must be at its 
+    center) in the rendered image, analytically and without rendering
+    (see `silhouette_utils.get_sphere_mask`), as RLE counts. Raises a
+    `ValueError` if the camera is inside the sphere.
+    """
+
+    return silu.get_sphere_mask(
+        camera_sensor_width,
+        camera_sensor_height,
+        lens_focal_length,
+        np.array(camera_obj.matrix_world),
+        np.array(obj.matrix_world.translation),
+        max(obj.dimensions) / 2,
+        render_width,
+        render_height,
+        projection,
+        bbox
+    )
+
+
+def get_object_mesh(obj, pass_index=None):
+    """
+    Describe the mesh of `obj` for the rasterizer (see 
+    `rasterizer.make_mesh`), with the object's own pass index unless
+    `pass_index` is given. Meshes are triangulated only the first time 
+    they are seen, so they must not be edited in the meantime.
+    """
+
+    mesh = obj.data
+    key = (mesh.name, len(mesh.vertices))
+    if key not in _triangle_cache:
+        local_coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', local_coords)
+
+        mesh.calc_loop_triangles()
+        triangles = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get('vertices', triangles)
+
+        _triangle_cache[key] = (local_coords, triangles)
+
+    local_coords, triangles = _triangle_cache[key]
+
+    return ra.make_mesh(
+        local_coords,
+        triangles,
+        np.array(obj.matrix_world),
+        obj.pass_index if pass_index is None else pass_index
+    )
+
+
+def rasterize_objects(
+    objects,
+    camera_obj,
+    camera_sensor_width, 
+    camera_sensor_height,
+    lens_focal_length,
+    render_width,
+    render_height,
+    projection,
+    occluders=()
+):
+    """
+    Compute the object index pass of `objects` (a list of Blender 
+    objects) with the software rasterizer, instead of rendering it. 
+    `occluders` are objects that can hide `objects` but are not labelled
+    themselves: they are treated as background. Returns the index buffer
+    in NumPy format (row 0 is the top row of the image).
+    """
+
+    meshes = [get_object_mesh(obj) for obj in objects]
+    meshes.extend(
+        get_object_mesh(obj, ibu.BACKGROUND_PASS_INDEX) for obj in occluders
+    )
+    prof.profiler.count(triangles=sum(len(mesh['triangles']) for mesh in meshes))
+
+    index_buffer, _ = ra.rasterize_index_buffer(
+        meshes,
+        camera_sensor_width,
+        camera_sensor_height,
+        lens_focal_length,
+        np.array(camera_obj.matrix_world),
+        render_width,
+        render_height,
+        projection
+    )
+
+    return index_buffer
+
+
+def read_index_buffer(render_width, render_height, out=None):
+    """
+    Read the object index pass from the 'Viewer Node' image into a 
+    `render_height` x `render_width` array, whose first row is the 
+    bottom row of the render (as in Blender).
+
+    The pixels are copied with a single `foreach_get` call into `out`, a
+    float32 array of size `render_width * render_height * 4` (RGBA, that
+    is), which is allocated if not given. Pass the same `out` array 
+    across frames to avoid reallocating it every time. The returned 
+    array is a view of `out`.
+    """
+
+    if out is None:
+        out = np.empty(render_height * render_width * 4, dtype=np.float32)
+
+    bpy.data.images['Viewer Node'].pixels.foreach_get(out)
+
+    # Keep only one value for each pixel (white pixels have 1 in all 
+    # RGBA channels anyway)
+    return out.reshape(render_height, render_width, 4)[:, :, 0]
+
+
+def get_index_buffer_in_rendered_image(render_width, render_height, out=None):
+    """
+    Read the object index pass like `read_index_buffer` does, but in 
+    NumPy format, i.e. row 0 is the top row of the render.
+    """
+
+    return np.flipud(read_index_buffer(render_width, render_height, out))
+
+
+def get_visible_masks_in_rendered_image(
+    render_width,
+    render_height,
+    pass_indices=None,
+    encoding='rle',
+    out=None
+):
+    """
+    Get the pixel masks of the visible portion of every object in the 
+    rendered image, reading the object index pass only once.
+
+    Returns a dict mapping each pass index to the mask of the 
+    corresponding object, either run-length encoded or cropped to its 
+    bounding box, depending on `encoding` (see 
+    `index_buffer_utils.get_masks`). Unlike 
+    `get_visible_pixel_mask_in_rendered_image`, masks are in image 
+    orientation, i.e. row 0 is the top row of the render. See 
+    `read_index_buffer` for the meaning of `out`. The same requirements 
+    as `get_visible_pixel_mask_in_rendered_image` apply.
+    """
+
+    pixels = read_index_buffer(render_width, render_height, out)
+
+    return ibu.get_masks(np.flipud(pixels), pass_indices, encoding)
+
+
+def get_visible_masks_and_outlines_in_rendered_image(
+    render_width,
+    render_height,
+    pass_indices=None,
+    output_masks=True,
+    output_outlines=True,
+    out=None
+):
+    """
+    Get both the run-length encoded masks and the outlines of the 
+    visible portion of every object in the rendered image, reading the 
+    object index pass only once. Both are in image orientation, i.e. row
+    0 is the top row of the render.
+
+    Returns a tuple with two dicts mapping each pass index to, 
+    respectively, the mask and the outline of the corresponding object 
+    (or None in place of either dict, if not requested). The same 
+    requirements as `get_visible_pixel_mask_in_rendered_image` apply.
+    """
+
+    pixels = get_index_buffer_in_rendered_image(render_width, render_height, out)
+
+    masks = ibu.get_masks(pixels, pass_indices) if output_masks else None
+    outlines = ibu.get_outlines(pixels, pass_indices) if output_outlines else None
+
+    return masks, outlines
+
+
 def get_visible_pixel_mask_in_rendered_image(
     object_pass_index,
     render_width,
@@ -88,17 +403,8 @@ def get_visible_pixel_mask_in_rendered_image(
         4. Render the scene (either programmatically or via the GUI).
     """
 
-    pixels = np.array(bpy.data.images['Viewer Node'].pixels[:]).reshape([
-        render_height, 
-        render_width, 
-        4  # RGBA, that is
-    ])
+    pixels = read_index_buffer(render_width, render_height)
 
-    # Keep only one value for each pixel (white pixels have 1 in all 
-    # RGBA channels anyway), thus converting the image to black and 
-    # white
-    pixels = pixels[:, :, 0]
-    
     pixel_mask = np.argwhere(pixels == object_pass_index)
     # TODO: capire perché c'è bisogno di questa istruzione
     pixel_mask[:, 0] = render_height - pixel_mask[:, 0]
@@ -125,39 +431,41 @@ def get_visible_outline_in_rendered_image(
            output of the 'Render Layers' node to the 'Image' input of 
            the 'Viewer' node.
         4. Render the scene (either programmatically or via the GUI).   
+
+    If you need the outlines of more than one object, use 
+    `get_visible_outlines_in_rendered_image` instead, which computes 
+    all of them at once.
     """
 
-    pixels = np.array(bpy.data.images['Viewer Node'].pixels[:]).reshape([
-        render_height, 
-        render_width, 
-        4  # RGBA, that is
-    ])
+    outlines = get_visible_outlines_in_rendered_image(
+        render_width,
+        render_height,
+        pass_indices=[object_pass_index]
+    )
 
-    # Keep only one value for each pixel (white pixels have 1 in all 
-    # RGBA channels anyway), thus converting the image to black and 
-    # white
-    pixels = pixels[:, :, 0]
+    return outlines[int(object_pass_index)]
 
-    pixels_copy = np.zeros_like(pixels)
 
-    indexes = itertools.product(
-        range(1, render_height - 1), 
-        range(1, render_width - 1)
-    )
-    for row, col in indexes:
+def get_visible_outlines_in_rendered_image(
+    render_width,
+    render_height,
+    pass_indices=None
+):
+    """
+    Get the pixel coordinates of the visible portion of the outline of 
+    every object in the rendered image, in a single pass.
 
-        val = pixels[row, col]
+    Returns a dict mapping each pass index to the outline coordinates of
+    the corresponding object (see 
+    `index_buffer_utils.group_pixels_by_pass_index` for the meaning of 
+    `pass_indices`). The same requirements as 
+    `get_visible_outline_in_rendered_image` apply.
+    """
 
-        if pixels[row, col-1] != val or \
-           pixels[row-1, col] != val or \
-           pixels[row, col+1] != val or \
-           pixels[row+1, col] != val:
-            
-            # The pixel is part of the outline of an object, so we keep 
-            # it
-            pixels_copy[row, col] = val        
+    pixels = read_index_buffer(render_width, render_height)
 
-    outline = np.argwhere(pixels_copy == object_pass_index)
-    outline[:, 0] = render_height - outline[:, 0]
+    outlines = ibu.get_outlines(pixels, pass_indices)
+    for outline in outlines.values():
+        outline[:, 0] = render_height - outline[:, 0]
 
-    return outline
\ No newline at end of file
+    return outlines
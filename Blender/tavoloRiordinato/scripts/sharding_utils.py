@@ -0,0 +1,107 @@
+from pathlib import Path
+import json
+import os
+
+import numpy as np
+
+MANIFEST_FILENAME = 'manifest.jsonl'
+
+
+def derive_seed(*keys):
+    """
+    Derive a 32-bit seed from any number of non-negative integer keys,
+    e.g. (job seed, shard index) or (shard seed, sample index).
+
+    Seeds derived from different keys are statistically independent, so
+    that shards (and samples within a shard) don't overlap, and the same
+    keys always give the same seed.
+    """
+
+    seed_sequence = np.random.SeedSequence([int(key) for key in keys])
+    return int(seed_sequence.generate_state(1, dtype=np.uint32)[0])
+
+
+def get_view_frame_id(frame_id, view_index, n_views):
+    """
+    Get the ID under which view `view_index` (out of `n_views`) of frame
+    `frame_id` is stored (in the annotation store or as a COCO image).
+    The views of consecutive frames get consecutive, non-overlapping
+    ranges of IDs, and a frame with a single view keeps its own ID.
+    """
+
+    if not 0 <= view_index < n_views:
+        raise ValueError(f'View index {view_index} out of {n_views} views')
+
+    return frame_id * n_views + view_index
+
+
+def split_into_shards(start_index, n_samples, n_shards):
+    """
+    Split the sample indices from `start_index` to
+    `start_index + n_samples - 1` into `n_shards` contiguous ranges of
+    (almost) the same size. Returns a list of (start index, number of
+    samples) pairs, one for each shard.
+    """
+
+    sizes = np.full(n_shards, n_samples // n_shards)
+    sizes[:n_samples % n_shards] += 1
+    starts = start_index + np.cumsum(sizes) - sizes
+
+    return [(int(start), int(size)) for start, size in zip(starts, sizes)]
+
+
+def iterate_manifest(manifest_path):
+    """
+    Yield the records of a manifest, i.e. a file with one JSON record 
+    per line, one at a time. Nothing is yielded if the manifest doesn't
+    exist. Incomplete lines (e.g. because the process writing the 
+    manifest was killed) are ignored.
+    """
+
+    manifest_path = Path(manifest_path)
+    if not manifest_path.exists():
+        return
+
+    with open(manifest_path) as file_pointer:
+        for line in file_pointer:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def read_manifest(manifest_path):
+    """
+    Read all the records of a manifest (see `iterate_manifest`) into a
+    list.
+    """
+
+    return list(iterate_manifest(manifest_path))
+
+
+def append_to_manifest(manifest_path, record):
+    """
+    Append a record to a manifest, making sure it reaches the disk
+    before returning, so that completed samples are not lost if the
+    process is interrupted.
+    """
+
+    with open(manifest_path, 'ab+') as file_pointer:
+        # If the last line was left incomplete, start a new one
+        file_pointer.seek(0, 2)
+        if file_pointer.tell() > 0:
+            file_pointer.seek(-1, 2)
+            if file_pointer.read(1) != b'\n':
+                file_pointer.write(b'\n')
+
+        file_pointer.write((json.dumps(record) + '\n').encode())
+        file_pointer.flush()
+        os.fsync(file_pointer.fileno())
+
+
+def get_completed_sample_ids(manifest_path):
+    """
+    Get the set of IDs of the samples recorded in a manifest.
+    """
+
+    return {record['sample_id'] for record in read_manifest(manifest_path)}
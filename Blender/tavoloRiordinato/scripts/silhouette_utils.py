@@ -0,0 +1,247 @@
+"""
+Compute the bounding boxes and masks of objects in the rendered image
+without projecting every vertex of their meshes.
+
+For a sphere (e.g. a ball), the silhouette seen from the camera is the
+circle where the cone of rays tangent to the sphere touches it: its
+bounding box is found by projecting a fixed number of points of that
+circle, and its (complete) mask by testing which pixels' rays fall
+within the cone, so the cost doesn't depend on how many vertices the
+mesh has. For any convex object, only the vertices of its convex hull
+can end up at the border of the projection, so a subset of vertices can
+be computed once per mesh and projected instead of the full mesh.
+
+Works with any of the projections in `lens_projections`. Neither `bpy`
+nor `mathutils` are needed.
+"""
+
+import numpy as np
+
+import coordinates_utils as cu
+import index_buffer_utils as ibu
+import lens_projections as lp
+
+
+def get_sphere_outline_points(camera_matrix_world, center, radius, n_points=64):
+    """
+    Get an (n_points, 3) array of world space points on the silhouette
+    of a sphere, as seen from the camera whose 4x4 world matrix is
+    `camera_matrix_world`. Raises a `ValueError` if the camera is inside
+    the sphere.
+    """
+
+    camera_location = np.asarray(camera_matrix_world, dtype=np.float64)[:3, 3]
+    axis = np.asarray(center, dtype=np.float64) - camera_location
+    distance = np.linalg.norm(axis)
+    if distance <= radius:
+        raise ValueError('The camera is inside the sphere')
+    axis /= distance
+
+    # Two unit vectors orthogonal to the axis of the cone and to each
+    # other
+    helper = np.eye(3)[np.argmin(np.abs(axis))]
+    first = np.cross(axis, helper)
+    first /= np.linalg.norm(first)
+    second = np.cross(axis, first)
+
+    # Tangent points are at angle `alpha` from the axis of the cone
+    alpha = np.arcsin(radius / distance)
+    tangent_length = np.sqrt(distance**2 - radius**2)
+    angles = np.linspace(0, 2 * np.pi, n_points, endpoint=False)
+    directions = (
+        np.cos(alpha) * axis
+        + np.sin(alpha) * (
+            np.cos(angles)[:, None] * first + np.sin(angles)[:, None] * second
+        )
+    )
+
+    return camera_location + tangent_length * directions
+
+
+def get_bounding_box(pixel_coords):
+    """
+    Get the bounding box, as [min row, min column, width, height], of an
+    (N, 2) array of pixel coordinates in NumPy format.
+    """
+
+    min_row_index, min_col_index = np.min(pixel_coords, axis=0)
+    max_row_index, max_col_index = np.max(pixel_coords, axis=0)
+
+    return np.array([
+        min_row_index,
+        min_col_index,
+        max_col_index - min_col_index + 1,
+        max_row_index - min_row_index + 1
+    ])
+
+
+def get_sphere_bounding_box(
+    camera_sensor_width,
+    camera_sensor_height,
+    lens_focal_length,
+    camera_matrix_world,
+    center,
+    radius,
+    render_width,
+    render_height,
+    projection=lp.rectilinear,
+    n_points=64
+):
+    """
+    Get the bounding box (see `get_bounding_box`) of a sphere in the
+    rendered image, by projecting `n_points` points of its silhouette.
+    """
+
+    outline_points = get_sphere_outline_points(
+        camera_matrix_world,
+        center,
+        radius,
+        n_points
+    )
+    pixel_coords = cu.world_to_pixel_coordinates(
+        camera_sensor_width,
+        camera_sensor_height,
+        lens_focal_length,
+        camera_matrix_world,
+        outline_points,
+        render_width,
+        render_height,
+        projection
+    )
+
+    return get_bounding_box(pixel_coords)
+
+
+def get_sphere_mask(
+    camera_sensor_width,
+    camera_sensor_height,
+    lens_focal_length,
+    camera_matrix_world,
+    center,
+    radius,
+    render_width,
+    render_height,
+    projection=lp.rectilinear,
+    bbox=None
+):
+    """
+    Get the complete mask of a sphere in the rendered image (i.e. as if
+    no other object occluded it), run-length encoded as in
+    `index_buffer_utils.encode_rle`. A pixel belongs to the mask if the
+    ray through its center hits the sphere. Only pixels within `bbox`
+    (see `get_sphere_bounding_box`, which is called if not given) are
+    tested.
+    """
+
+    if bbox is None:
+        bbox = get_sphere_bounding_box(
+            camera_sensor_width,
+            camera_sensor_height,
+            lens_focal_length,
+            camera_matrix_world,
+            center,
+            radius,
+            render_width,
+            render_height,
+            projection
+        )
+
+    # Pixels within the bounding box (enlarged by one pixel, to account
+    # for the outline being sampled), clipped to the image
+    min_row, min_col, bbox_width, bbox_height = bbox
+    rows = np.arange(max(min_row - 1, 0), min(min_row + bbox_height + 1, render_height))
+    cols = np.arange(max(min_col - 1, 0), min(min_col + bbox_width + 1, render_width))
+    n_pixels = render_width * render_height
+    if len(rows) == 0 or len(cols) == 0:
+        return ibu.encode_rle([], n_pixels)
+
+    # Column-major order, as in COCO
+    col_grid, row_grid = np.meshgrid(cols, rows, indexing='ij')
+    pixel_coords = np.column_stack([row_grid.ravel(), col_grid.ravel()])
+
+    rays = cu.pixel_coordinates_to_camera_rays(
+        camera_sensor_width,
+        camera_sensor_height,
+        lens_focal_length,
+        pixel_coords,
+        render_width,
+        render_height,
+        lp.inverses[projection]
+    )
+
+    # Direction of the center of the sphere in camera space
+    world_to_camera_matrix = np.linalg.inv(
+        np.asarray(camera_matrix_world, dtype=np.float64)
+    )
+    center_camera_space = cu.transform_points(world_to_camera_matrix, center)[0]
+    distance = np.linalg.norm(center_camera_space)
+    axis = center_camera_space / distance
+
+    # A ray hits the sphere if it is within the cone tangent to it
+    cos_alpha = np.sqrt(1.0 - min(radius / distance, 1.0)**2)
+    inside = rays @ axis >= cos_alpha
+
+    positions = pixel_coords[inside, 1] * render_height + pixel_coords[inside, 0]
+
+    return ibu.encode_rle(positions, n_pixels)
+
+
+def get_hull_vertex_indices(vertices, n_directions=1000):
+    """
+    Get the (sorted) indices of the vertices, given as an (N, 3) array,
+    that are the furthest along at least one of `n_directions` evenly
+    spread directions. These are vertices of the convex hull, and all
+    the others are close to the hull's faces, so projecting them gives
+    the bounding box of the whole mesh (up to the resolution given by
+    `n_directions`).
+    """
+
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+
+    # Directions on a Fibonacci sphere
+    indices = np.arange(n_directions) + 0.5
+    polar_angles = np.arccos(1 - 2 * indices / n_directions)
+    azimuths = np.pi * (1 + 5**0.5) * indices
+    directions = np.column_stack([
+        np.cos(azimuths) * np.sin(polar_angles),
+        np.sin(azimuths) * np.sin(polar_angles),
+        np.cos(polar_angles)
+    ])
+
+    centered_vertices = vertices - vertices.mean(axis=0)
+
+    return np.unique(np.argmax(centered_vertices @ directions.T, axis=0))
+
+
+def group_non_overlapping_boxes(bboxes, margin=2):
+    """
+    Split objects into as few groups as possible (greedily, largest 
+    first) so that the bounding boxes of the objects in the same group,
+    each enlarged by `margin` pixels on every side, don't overlap. 
+    Bounding boxes are given as in `get_bounding_box`. Returns a list of
+    lists of indices into `bboxes`.
+
+    Objects in the same group can be rendered together and still give
+    their complete masks, since none can occlude another.
+    """
+
+    bboxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+    top = bboxes[:, 0] - margin
+    left = bboxes[:, 1] - margin
+    bottom = bboxes[:, 0] + bboxes[:, 3] + margin
+    right = bboxes[:, 1] + bboxes[:, 2] + margin
+
+    groups = []
+    for i in np.argsort(-(bboxes[:, 2] * bboxes[:, 3]), kind='stable'):
+        for group in groups:
+            members = np.array(group)
+            if not np.any(
+                (top[i] < bottom[members]) & (top[members] < bottom[i]) &
+                (left[i] < right[members]) & (left[members] < right[i])
+            ):
+                group.append(int(i))
+                break
+        else:
+            groups.append([int(i)])
+
+    return groups
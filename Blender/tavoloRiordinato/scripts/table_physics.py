@@ -0,0 +1,265 @@
+"""
+A minimal 2D physics engine for balls and pins on the game area.
+
+Balls are modelled as discs that roll on the cloth, slowing down because
+of rolling friction, and bounce off each other, off the cushions and off
+the pins. Pins are static discs that get knocked down (which is just a
+flag here) when a ball hits them fast enough; knocked down pins no
+longer take part in collisions. All bodies are updated at once, with
+NumPy, at each fixed-size step, so that settling a whole table takes a
+few milliseconds. Neither `bpy` nor `mathutils` are needed.
+
+Table limits are given as a dict with keys 'x_min', 'x_max', 'y_min' and
+'y_max' (the same format as `scramble_utils.get_ball_limits`), and are
+the positions of the cushions.
+"""
+
+import numpy as np
+
+GRAVITY = 9.81  # m/s^2
+
+
+def _resolve_ball_collisions(
+    positions,
+    velocities,
+    radii,
+    inverse_masses,
+    restitution
+):
+    """
+    Separate overlapping balls and make the ones that are approaching
+    each other bounce. All pairs are handled at once, and the
+    corrections that a ball gets from different pairs are summed up.
+    Arrays are modified in place. Returns the largest overlap found.
+    """
+
+    first, second = np.triu_indices(len(positions), k=1)
+
+    deltas = positions[second] - positions[first]
+    distances = np.linalg.norm(deltas, axis=1)
+    overlaps = radii[first] + radii[second] - distances
+
+    colliding = overlaps > 0
+    if not np.any(colliding):
+        return 0.0
+
+    first, second = first[colliding], second[colliding]
+    distances = distances[colliding]
+    overlaps = overlaps[colliding]
+
+    # Normals go from the first to the second ball of each pair. Balls
+    # in the very same place are pushed apart along the x-axis
+    normals = np.zeros((len(first), 2))
+    normals[:, 0] = 1.0
+    nonzero = distances > 1e-12
+    normals[nonzero] = deltas[colliding][nonzero] / distances[nonzero, None]
+
+    inverse_mass_sums = inverse_masses[first] + inverse_masses[second]
+
+    # Push balls apart, proportionally to their inverse masses
+    corrections = (overlaps / inverse_mass_sums)[:, None] * normals
+    np.add.at(positions, first, -corrections * inverse_masses[first, None])
+    np.add.at(positions, second, corrections * inverse_masses[second, None])
+
+    # Apply an impulse to pairs of balls that are getting closer
+    relative_velocities = np.einsum(
+        'ij,ij->i',
+        velocities[second] - velocities[first],
+        normals
+    )
+    approaching = relative_velocities < 0
+    impulses = np.where(
+        approaching,
+        -(1 + restitution) * relative_velocities / inverse_mass_sums,
+        0.0
+    )[:, None] * normals
+    np.add.at(velocities, first, -impulses * inverse_masses[first, None])
+    np.add.at(velocities, second, impulses * inverse_masses[second, None])
+
+    return overlaps.max()
+
+
+def _resolve_pin_collisions(
+    positions,
+    velocities,
+    radii,
+    pin_positions,
+    pin_radii,
+    pins_up,
+    restitution,
+    topple_speed
+):
+    """
+    Make balls bounce off the pins that are still up, and knock down
+    pins that are hit faster than `topple_speed`. Arrays are modified in
+    place. Returns the largest overlap found.
+    """
+
+    if not np.any(pins_up):
+        return 0.0
+
+    deltas = positions[:, None, :] - pin_positions[None, :, :]
+    distances = np.linalg.norm(deltas, axis=2)
+    overlaps = radii[:, None] + pin_radii[None, :] - distances
+    colliding = (overlaps > 0) & pins_up[None, :]
+    if not np.any(colliding):
+        return 0.0
+
+    balls, pins = np.nonzero(colliding)
+    normals = deltas[balls, pins] / np.maximum(distances[balls, pins], 1e-12)[:, None]
+
+    # Pins are static, so only balls are moved
+    np.add.at(positions, balls, overlaps[balls, pins][:, None] * normals)
+
+    normal_velocities = np.einsum('ij,ij->i', velocities[balls], normals)
+    approaching = normal_velocities < 0
+    impulses = np.where(
+        approaching,
+        -(1 + restitution) * normal_velocities,
+        0.0
+    )[:, None] * normals
+    np.add.at(velocities, balls, impulses)
+
+    knocked_down = pins[approaching & (-normal_velocities > topple_speed)]
+    pins_up[knocked_down] = False
+
+    return overlaps[balls, pins].max()
+
+
+def _resolve_cushion_collisions(
+    positions,
+    velocities,
+    radii,
+    table_limits,
+    restitution
+):
+    """
+    Keep balls within the cushions, making them bounce off. Arrays are
+    modified in place.
+    """
+
+    for axis, (low, high) in enumerate([
+        (table_limits['x_min'], table_limits['x_max']),
+        (table_limits['y_min'], table_limits['y_max'])
+    ]):
+        below = positions[:, axis] < low + radii
+        positions[below, axis] = low + radii[below]
+        velocities[below, axis] = np.abs(velocities[below, axis]) * restitution
+
+        above = positions[:, axis] > high - radii
+        positions[above, axis] = high - radii[above]
+        velocities[above, axis] = -np.abs(velocities[above, axis]) * restitution
+
+
+def simulate_table(
+    ball_positions,
+    ball_velocities,
+    ball_radii,
+    table_limits,
+    ball_masses=None,
+    pin_positions=None,
+    pin_radii=None,
+    pins_up=None,
+    time_step=1 / 240,
+    max_steps=2400,
+    rolling_friction=0.2,
+    linear_damping=0.04,
+    ball_restitution=0.5,
+    cushion_restitution=0.7,
+    pin_restitution=0.3,
+    topple_speed=0.3,
+    rest_speed=1e-3,
+    overlap_tolerance=1e-5,
+    n_collision_iterations=2
+):
+    """
+    Simulate balls rolling on the table until they all come to rest, 
+    without overlapping each other or the pins (or until `max_steps` 
+    steps have been taken).
+
+    `ball_positions` and `ball_velocities` are (N, 2) arrays (in meters
+    and meters per second), `ball_radii` and `ball_masses` have shape
+    (N,). Pins are given by their (M, 2) positions, (M,) radii and (M,)
+    boolean flags telling whether they are up. Balls slow down because
+    of rolling friction (a constant deceleration of `rolling_friction`
+    times gravity) and linear damping (a fraction of the velocity lost
+    every second, as in Bullet).
+
+    Returns a tuple with the final (N, 2) ball positions, the final (M,)
+    pin flags and the number of steps taken.
+    """
+
+    positions = np.array(ball_positions, dtype=np.float64).reshape(-1, 2)
+    velocities = np.array(ball_velocities, dtype=np.float64).reshape(-1, 2)
+    radii = np.broadcast_to(
+        np.asarray(ball_radii, dtype=np.float64),
+        len(positions)
+    )
+    if ball_masses is None:
+        ball_masses = np.ones(len(positions))
+    inverse_masses = 1.0 / np.broadcast_to(
+        np.asarray(ball_masses, dtype=np.float64),
+        len(positions)
+    )
+
+    if pin_positions is None:
+        pin_positions = np.empty((0, 2))
+    pin_positions = np.asarray(pin_positions, dtype=np.float64).reshape(-1, 2)
+    pin_radii = np.broadcast_to(
+        np.asarray(0.0 if pin_radii is None else pin_radii, dtype=np.float64),
+        len(pin_positions)
+    )
+    if pins_up is None:
+        pins_up = np.ones(len(pin_positions), dtype=bool)
+    pins_up = np.array(pins_up, dtype=bool)
+
+    friction_decrease = rolling_friction * GRAVITY * time_step
+    damping_factor = (1.0 - linear_damping) ** time_step
+
+    # No steps are taken if max_steps is 0
+    step = 0
+    for step in range(1, max_steps + 1):
+
+        # Slow balls down, stopping those that are slow enough
+        velocities *= damping_factor
+        speeds = np.linalg.norm(velocities, axis=1)
+        scale = np.where(
+            speeds > friction_decrease,
+            1.0 - friction_decrease / np.maximum(speeds, 1e-12),
+            0.0
+        )
+        velocities *= scale[:, None]
+
+        positions += velocities * time_step
+
+        for _ in range(n_collision_iterations):
+            ball_overlap = _resolve_ball_collisions(
+                positions,
+                velocities,
+                radii,
+                inverse_masses,
+                ball_restitution
+            )
+            pin_overlap = _resolve_pin_collisions(
+                positions,
+                velocities,
+                radii,
+                pin_positions,
+                pin_radii,
+                pins_up,
+                pin_restitution,
+                topple_speed
+            )
+            _resolve_cushion_collisions(
+                positions,
+                velocities,
+                radii,
+                table_limits,
+                cushion_restitution
+            )
+
+        at_rest = np.all(np.linalg.norm(velocities, axis=1) < rest_speed)
+        if at_rest and max(ball_overlap, pin_overlap) < overlap_tolerance:
+            break
+
+    return positions, pins_up, step
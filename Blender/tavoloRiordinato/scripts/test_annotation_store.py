@@ -0,0 +1,32 @@
+import numpy as np
+
+import annotation_store as ans
+
+
+def test_reopen_with_stale_shard(tmp_path):
+    """
+    A store whose next shard was left on disk by a crash (written after
+    a rollover, but never indexed) is reopened and extended correctly.
+    """
+
+    records = [{'values': np.full(100, i, dtype=np.int64)} for i in range(3)]
+
+    with ans.AnnotationWriter(tmp_path, max_shard_size=1000) as writer:
+        writer.write(0, records[0])
+
+    # Stale bytes in the shard the next rollover goes to
+    stale_path = tmp_path / 'shard_00001.bin'
+    stale_path.write_bytes(b'stale bytes that were never indexed')
+
+    with ans.AnnotationWriter(tmp_path, max_shard_size=1000) as writer:
+        writer.write(1, records[1])
+        writer.write(2, records[2])
+
+    reader = ans.AnnotationReader(tmp_path)
+    assert len(reader) == 3
+    assert set(reader.index['shard'].tolist()) == {0, 1, 2}
+    for i, record in enumerate(records):
+        np.testing.assert_array_equal(
+            reader.read_record(i)['values'],
+            record['values']
+        )
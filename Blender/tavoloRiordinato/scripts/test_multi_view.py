@@ -0,0 +1,76 @@
+import json
+
+import annotation_store as ans
+import coco_utils as cocu
+import sharding_utils as shu
+
+N_VIEWS = 3
+FRAME_IDS = [1, 2]
+
+
+def _make_annotation(frame_id, view_index):
+
+    return {
+        'name': f'ball_{frame_id}_{view_index}',
+        'category_id': 1,
+        'pass_index': 1,
+        'location': [frame_id, view_index],
+        'bbox': [0, 0, 2, 2]
+    }
+
+
+def test_consecutive_multi_view_frames(tmp_path):
+    """
+    The views of two consecutive frames, labelled as `label_image.py`
+    does, all end up in the annotation store and in the merged COCO
+    dataset, none of them overwriting another.
+    """
+
+    store_dir = tmp_path / 'store'
+    coco_path = tmp_path / cocu.COCO_LINES_FILENAME
+
+    with ans.AnnotationWriter(store_dir) as annotation_writer, \
+         cocu.CocoWriter(coco_path, cocu.make_categories(['Palle'], [1])) as coco_writer:
+        for frame_id in FRAME_IDS:
+            for view_index in range(N_VIEWS):
+                view_frame_id = shu.get_view_frame_id(frame_id, view_index, N_VIEWS)
+                annotation = _make_annotation(frame_id, view_index)
+                metadata = {
+                    'view_name': f'view{view_index:02d}',
+                    'view_index': view_index,
+                    'scene_frame_id': frame_id
+                }
+                annotation_writer.write(view_frame_id, ans.pack_frame_annotations(
+                    [annotation],
+                    metadata=metadata
+                ))
+                coco_writer.add_image(
+                    {
+                        **cocu.make_image_entry(view_frame_id, f'{view_frame_id:06d}.png', 4, 4),
+                        **metadata
+                    },
+                    [cocu.make_object_annotation(annotation, [4, 4, 8], view_frame_id, 4, 4)]
+                )
+
+    reader = ans.AnnotationReader(store_dir)
+    assert len(set(reader.frame_ids.tolist())) == len(FRAME_IDS) * N_VIEWS
+    for frame_id in FRAME_IDS:
+        for view_index in range(N_VIEWS):
+            objects, metadata = reader.read_frame(
+                shu.get_view_frame_id(frame_id, view_index, N_VIEWS)
+            )
+            assert objects[0]['name'] == f'ball_{frame_id}_{view_index}'
+            assert metadata['view_index'] == view_index
+            assert metadata['scene_frame_id'] == frame_id
+
+    n_images, n_annotations = cocu.write_coco_dataset([coco_path], tmp_path / 'coco.json')
+    assert n_images == n_annotations == len(FRAME_IDS) * N_VIEWS
+    with open(tmp_path / 'coco.json') as coco_file:
+        images = json.load(coco_file)['images']
+    assert sorted(
+        (image['scene_frame_id'], image['view_index']) for image in images
+    ) == [
+        (frame_id, view_index)
+        for frame_id in FRAME_IDS
+        for view_index in range(N_VIEWS)
+    ]
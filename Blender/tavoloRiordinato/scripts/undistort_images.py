@@ -0,0 +1,88 @@
+"""
+Convert rendered images from the projection of the camera's lens to 
+another one (by default, from fisheye equisolid to rectilinear), e.g. 
+for detectors that expect undistorted images. Usage:
+
+    python3 undistort_images.py -i ../dataset/*.png -o ../undistorted \
+        --cache-dir ../remap_cache
+
+The remap table is built once for all images (or loaded from 
+`--cache-dir`, if it was built before), see `remap_utils.py`.
+"""
+
+from pathlib import Path
+import argparse
+import sys
+
+import cv2
+
+scripts_folder = Path(__file__).parent
+sys.path.insert(0, str(scripts_folder))
+import lens_projections as lp
+import remap_utils as ru
+
+projection_names = [projection.__name__ for projection in lp.inverses]
+
+this_script_name = Path(__file__).stem
+parser = argparse.ArgumentParser(this_script_name)
+parser.add_argument(
+    '-i', '--input-paths',
+    nargs='+',
+    required=True
+)
+parser.add_argument(
+    '-o', '--output-dir',
+    required=True
+)
+parser.add_argument(
+    '-csw', '--camera-sensor-width',
+    type=float,
+    default=18.0
+)
+parser.add_argument(
+    '-csh', '--camera-sensor-height',
+    type=float,
+    default=13.5
+)
+parser.add_argument(
+    '-f', '--lens-focal-length',
+    type=float,
+    default=8.90999984741211
+)
+parser.add_argument(
+    '-sp', '--source-projection',
+    choices=projection_names,
+    default='fisheye_equisolid'
+)
+parser.add_argument(
+    '-tp', '--target-projection',
+    choices=projection_names,
+    default='rectilinear'
+)
+parser.add_argument(
+    '--cache-dir',
+    default=None
+)
+args = parser.parse_args()
+
+output_dir = Path(args.output_dir)
+output_dir.mkdir(parents=True, exist_ok=True)
+
+for input_path in map(Path, args.input_paths):
+    image = cv2.imread(str(input_path), cv2.IMREAD_UNCHANGED)
+    render_height, render_width = image.shape[:2]
+
+    # Tables are cached in memory, so this is only slow for the first 
+    # image of each size
+    table = ru.get_remap_table(
+        args.camera_sensor_width,
+        args.camera_sensor_height,
+        args.lens_focal_length,
+        getattr(lp, args.source_projection),
+        getattr(lp, args.target_projection),
+        render_width,
+        render_height,
+        args.cache_dir
+    )
+
+    cv2.imwrite(str(output_dir / input_path.name), ru.remap_image(image, table))